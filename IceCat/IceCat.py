@@ -1,22 +1,30 @@
-# use C implementation for speed
-import xml.etree.cElementTree as ET
-
 import json
-import xmltodict
-import progressbar
-
-import requests
 import gzip
+import io
 import os
 import sys
 import collections
-
-from multiprocessing import Process, Queue
-
-from IceCat import bulk_downloader
-import pprint
+import collections.abc
 import re
-import codecs
+
+# heavier subsystems and dependencies are loaded on first use, see _lazy
+from IceCat._lazy import lazy_import
+xml_backend = lazy_import('IceCat.xml_backend')
+progressbar = lazy_import('progressbar')
+futures = lazy_import('concurrent.futures')
+bulk_downloader = lazy_import('IceCat.bulk_downloader')
+compact_store = lazy_import('IceCat.compact')
+http_transport = lazy_import('IceCat.transport')
+index_parser = lazy_import('IceCat.index_parser')
+reference = lazy_import('IceCat.reference')
+detail_schema = lazy_import('IceCat.details')
+xml_manifest = lazy_import('IceCat.manifest')
+spill_store = lazy_import('IceCat.spill')
+export = lazy_import('IceCat.export')
+sharding = lazy_import('IceCat.shard')
+gtin = lazy_import('IceCat.gtin')
+xml_cache = lazy_import('IceCat.cache')
+product_schema = lazy_import('IceCat.schema')
 
 # CZECH langid = 15 (See list in "CategoriesList.xml")
 # Some categories might not be defined for CZECH.
@@ -27,6 +35,59 @@ Process only English data
 '''
 
 
+def extract_details(data, keys):
+    '''
+    Extract product detail keys from a product XML document. Returns a dict of lower cased keys to values.
+
+    :param data: root Element of the product XML
+    :param keys: a list of product detail keys. Refer to Basic Usage Example
+    '''
+    o = {}
+    # for elem in data.iter('Product'):
+    for attribute in keys:
+        if '@' in attribute:
+            attr = attribute[attribute.index("@") + 1:attribute.rindex("]")]
+            q = data.find('./*' + attribute)
+            if q is not None:
+                o.update({attr.lower(): q.attrib[attr]})
+        else:
+            for name in data.iter(attribute):
+                textname = name.text or ''
+                if re.findall(r'\w+', textname):
+                    o.update({attribute.lower(): name.text})
+                else:
+                    for i in name.attrib:
+                        o.update({i.lower(): name.attrib[i]})
+    return o
+
+
+def fetch_file(transport, url, local_file, log):
+    '''
+    Download url to local_file. Returns local_file, or False on a bad status code.
+    The file is written next to local_file and renamed, concurrent readers never see a partial file.
+
+    :param transport: transport.Transport instance
+    :param url: url to download
+    :param local_file: target file name
+    :param log: logging.getLogger() instance
+    '''
+    res = transport.get(url, stream=True)
+    log.debug("Got headers: {}".format(res.headers))
+
+    if not 200 <= res.status_code < 299:
+        log.error("Did not receive good status code: {}".format(res.status_code))
+        res.close()
+        return False
+
+    part = local_file + '.part'
+    with open(part, 'wb') as f:
+        for chunk in res.iter_content(chunk_size=1024):
+            if chunk:
+                f.write(chunk)
+    os.replace(part, local_file)
+    return local_file
+
+
 class IceCat(object):
     '''
 
@@ -36,17 +97,20 @@ class IceCat(object):
     :param xml_file: XML product index file. If None the file will be downloaded from the Ice Cat web site.
     :param auth: Username and password touple, as needed for Ice Cat website authentication
     :param data_dir: Directory to hold downloaded reference and product xml files
+    :param transport: optional transport.Transport instance. By default the process wide transport
+                      for auth is used, so connections are reused between downloads.
 
 
     '''
 
-    def __init__(self, log=None, xml_file=None, auth=('user', 'passwd'), data_dir='_data/'):
+    def __init__(self, log=None, xml_file=None, auth=('user', 'passwd'), data_dir='_data/', transport=None):
         self.log = log
         if not log:
             import logging
             self.log = logging.getLogger()
 
         self.auth = auth
+        self.transport = transport
 
         self.data_dir = data_dir
 
@@ -68,25 +132,13 @@ class IceCat(object):
 
         # save the response in the data dir before parsing
         self.local_file = self.data_dir + os.path.basename(self.FILENAME)
-        res = requests.get(self.baseurl + self.FILENAME, auth=self.auth, stream=True)
-        with open(self.local_file, 'wb') as f:
-            for chunk in res.iter_content(chunk_size=1024):
-                if chunk:
-                    f.write(chunk)
-            f.closed
-        self.log.debug("Got headers: {}".format(res.headers))
-
-        if 200 <= res.status_code < 299:
-            # handle gzipped files
-            return self.local_file
-            # if self.local_file.endswith('.gz'):
-            #     with gzip.open(self.local_file, 'rb') as f:
-            #         return ET.parse(f).getroot()
-            # else:
-            #         return ET.parse(self.local_file).getroot()
-        else:
-            self.log.error("Did not receive good status code: {}".format(res.status_code))
-            return False
+        return self._fetch(self.baseurl + self.FILENAME, self.local_file)
+
+    def _fetch(self, url, local_file):
+        # download url to local_file, returns local_file or False
+        if not self.transport:
+            self.transport = http_transport.get_transport(self.auth)
+        return fetch_file(self.transport, url, local_file, self.log)
 
 
 class IceCatSupplierMapping(IceCat):
@@ -104,7 +156,7 @@ class IceCatSupplierMapping(IceCat):
     def _parse(self, xml_file):
 
         if xml_file:
-            data = ET.parse(xml_file).getroot()
+            data = xml_backend.parse(xml_file)
         else:
             self.log.error("Failed to retrieve suppliers")
             return False
@@ -150,14 +202,16 @@ class IceCatCategoryMapping(IceCat):
     def _parse(self, xml_file):
         if xml_file.endswith('.gz'):
             with gzip.open(xml_file, 'rb') as f:
-                data = ET.parse(f).getroot()
+                data = xml_backend.parse(f)
         else:
-            data = ET.parse(xml_file).getroot()
+            data = xml_backend.parse(xml_file)
 
         '''
         Data is an XML ElementTree Object
         '''
         self.id_map = {}
+        self.parents = {}
+        self._titles = None
         self.catid = ''
         self.catname = ''
         self.findpath = 'Name[@langid="' + langid + '"]'
@@ -170,6 +224,9 @@ class IceCatCategoryMapping(IceCat):
             if not self.catname:
                 self.catname = "Unknown"
             self.id_map[self.catid] = self.catname
+            parent = elem.find('ParentCategory')
+            if parent is not None and parent.get('ID') and parent.get('ID') != self.catid:
+                self.parents[self.catid] = parent.get('ID')
         self.log.info("Parsed {} Categories from IceCat CategoriesList".format(str(len(self.id_map.keys()))))
 
     def get_cat_byId(self, cat_id):
@@ -182,6 +239,33 @@ class IceCatCategoryMapping(IceCat):
             return self.id_map[cat_id]
         return False
 
+    def get_titles(self):
+        '''
+        Return a dict of category IDs to title cased category names. Computed once and memoized.
+        '''
+        if self._titles is None:
+            self._titles = {cat_id: name.title() for cat_id, name in self.id_map.items()}
+        return self._titles
+
+    def get_subtree(self, roots):
+        '''
+        Return a dict of category IDs to names for the given root categories and all categories below them
+
+        :param roots: list of category IDs
+        '''
+        children = collections.defaultdict(list)
+        for cat_id, parent in self.parents.items():
+            children[parent].append(cat_id)
+        selected = {}
+        stack = [str(root) for root in roots]
+        while stack:
+            cat_id = stack.pop()
+            if cat_id in selected:
+                continue
+            selected[cat_id] = self.id_map.get(cat_id, "Unknown")
+            stack.extend(children[cat_id])
+        return selected
+
     def dump_categories_to_file(self, filename=None):
         '''
         Save CategoriesList to a JSON file
@@ -220,28 +304,31 @@ class IceCatProductDetails(IceCat):
 
     baseurl = 'https://data.icecat.biz/'
     TYPE = 'Product details'
+    # product detail document of a product id, relative to baseurl
+    DETAILS_PATH = 'export/freexml.int/EN/{}.xml'
 
-    o = {}
+    @classmethod
+    def fetch(cls, product_id, keys, transport, log):
+        '''
+        Download the product xml of one product and extract keys, without a file in data_dir.
+        Returns a dict of lower cased keys to values, or None on a bad status code.
+        Used by the on demand lookups, ProductLookup and IceCatClient.
+
+        :param product_id: IceCat product id
+        :param keys: a list of product detail keys. Refer to Basic Usage Example
+        :param transport: transport.Transport instance
+        :param log: logging.getLogger() instance
+        '''
+        url = cls.baseurl + cls.DETAILS_PATH.format(product_id)
+        res = transport.get(url)
+        if not 200 <= res.status_code < 299:
+            log.warning("Bad status code: {} for url: {}".format(res.status_code, url))
+            return None
+        return detail_schema.DetailExtractor(keys).extract(io.BytesIO(res.content))
 
     def _parse(self, xml_file):
         self.xml_file = xml_file
-        data = ET.parse(xml_file).getroot()
-
-        # for elem in data.iter('Product'):
-        for attribute in self.keys:
-            if '@' in attribute:
-                attr = attribute[attribute.index("@") + 1:attribute.rindex("]")]
-                q = data.find('./*' + attribute)
-                if q is not None:
-                    self.o.update({attr.lower(): q.attrib[attr]})
-            else:
-                for name in data.iter(attribute):
-                    textname = name.text
-                    if re.findall('\w+', textname):
-                        self.o.update({attribute.lower(): name.text})
-                    else:
-                        for i in name.attrib:
-                            self.o.update({i.lower(): name.attrib[i]})
+        self.o = detail_schema.DetailExtractor(self.keys).extract(xml_file)
 
         self.log.debug("Parsed product details for {}".format(xml_file))
         if self.cleanup_data_files:
@@ -254,29 +341,135 @@ class IceCatProductDetails(IceCat):
         return self.o
 
 
+class LazyProduct(collections.abc.MutableMapping):
+    '''
+    Product record whose detail fields are parsed from the cached product xml on first access.
+    Index fields are served without parsing. Reading any other key, iterating or converting to a dict
+    parses the xml once and merges the details, as IceCatProductDetails would. Created by
+    add_product_details_parallel(lazy=True).
+
+    :param item: product dict from the catalog index
+    :param xml_file: cached product detail xml file
+    :param keys: a list of product detail keys. Refer to Basic Usage Example
+    :param log: optional logging.getLogger() instance
+    '''
+    __slots__ = ('_item', '_xml_file', '_keys', '_log', '_written')
+
+    def __init__(self, item, xml_file, keys, log=None):
+        self._item = item
+        self._xml_file = xml_file
+        self._keys = keys
+        self._log = log
+        self._written = set()
+
+    @property
+    def resolved(self):
+        return self._xml_file is None
+
+    def resolve(self):
+        '''
+        Parse the product details now. Returns the underlying product dict.
+        '''
+        if self._xml_file is not None:
+            xml_file, self._xml_file = self._xml_file, None
+            try:
+                details = detail_schema.DetailExtractor(self._keys).extract(xml_file)
+            except Exception:
+                details = {}
+                if self._log:
+                    self._log.error("Could not obtain product details from {}: {}".format(xml_file, sys.exc_info()))
+            # values set on the record before it was resolved win, as with the eager update order
+            for key, value in details.items():
+                if key not in self._written:
+                    self._item[key] = value
+            self._written = None
+        return self._item
+
+    def __getitem__(self, key):
+        if self._xml_file is not None and key in self._item:
+            return self._item[key]
+        return self.resolve()[key]
+
+    def __setitem__(self, key, value):
+        if self._written is not None:
+            self._written.add(key)
+        self._item[key] = value
+
+    def __delitem__(self, key):
+        del self.resolve()[key]
+
+    def __iter__(self):
+        return iter(self.resolve())
+
+    def __len__(self):
+        return len(self.resolve())
+
+    def __repr__(self):
+        state = 'resolved' if self.resolved else 'pending ' + self._xml_file
+        return 'LazyProduct({!r}, {})'.format(self._item, state)
+
+
+class _Chain(object):
+    # products carried over from the previous run followed by the detail items, iterable more than once
+    def __init__(self, *parts):
+        self.parts = parts
+
+    def __iter__(self):
+        for part in self.parts:
+            for item in part:
+                yield item
+
+    def __len__(self):
+        return sum(len(part) for part in self.parts)
+
+
 class IceCatCatalog(IceCat):
     '''
     Parse Ice Cat catalog index file.
     Special handling of the input data is based on IceCAT OCI Revision date: April 24, 2015, Version 2.46:
          - resolve supplier ID, and Category ID to their english names
-         - unroll ean_upcs nested structure to flat value, or list
+         - normalize the ean_upcs nested structure to a list of GTINs, see gtin.normalize(). Invalid codes are
+           kept in ean_upcs_invalid and counted in self.invalid_ean_upcs
          - convert attribute names according to the table (to lower case)
          - drop keys in the exclude_list, default ['Country_Markets']
          - discard parent layers above 'file' key
 
-    :param suppliers: IceCatSupplierMapping object. If None specified a mapping is instantiated inside the class.
-    :param categories: IceCatCategoryMapping object. If None specified a mapping is instantiated inside the class.
+    :param suppliers: IceCatSupplierMapping object. If None specified the process wide shared mapping is used,
+                      see reference.get_reference().
+    :param categories: IceCatCategoryMapping object. If None specified the process wide shared mapping is used.
     :param exclude_keys: a list of keys to omit from the product index.
     :param fullcatalog: Set to True to download full product catalog. 64-bit python is required for this option
                         because of >2GB memory footprint. You will need ~4.5 GB of virtual memory to process a 500k
                         item catalog.
+    :param compact: Set to True to keep the products in a column oriented CompactCatalog instead of a list
+                    of dicts. Items still behave like dicts, memory use drops to a fraction. Recommended with fullcatalog.
+    :param snapshot: JSON or NDJSON file written by dump_to_file(), write_snapshot() or export from an earlier run.
+                     The index (usually the daily one) is merged onto it: new products are added, products with a newer
+                     Updated value are replaced or marked off market. Changes are kept in self.changes, and
+                     add_product_details..() only fetch details for changed products.
+    :param parse_workers: Number of processes used to parse the index. With more than one the index is
+                          split into byte ranges parsed in parallel, recommended with fullcatalog.
+    :param memory_limit: Optional number of bytes of product data to keep in memory. Products past the limit are
+                         spilled to a temporary SQLite file in data_dir (see spill.SpillCatalog). get_data(),
+                         dump_to_file() and add_product_details..() work across memory and disk, so the full
+                         catalog runs in a fixed memory budget. Can not be combined with compact.
 
     Refer to IceCat class for additional arguments
     '''
 
-    def __init__(self, suppliers=None, categories=None, exclude_keys=['Country_Markets'], fullcatalog=False, *args, **kwargs):
+    def __init__(self, suppliers=None, categories=None, exclude_keys=['Country_Markets'], fullcatalog=False,
+                 compact=False, snapshot=None, parse_workers=1, memory_limit=None, *args, **kwargs):
+        if compact and memory_limit:
+            raise ValueError("compact and memory_limit can not be combined")
         self.suppliers = suppliers
         self.categories = categories
+        self.compact = compact
+        self.snapshot = snapshot
+        self.parse_workers = parse_workers
+        self.memory_limit = memory_limit
+        self.changes = None
+        # snapshot records replaced by the index, their details are reused if the product xml did not change
+        self._previous = {}
 
         self.exclude_keys = exclude_keys
         if fullcatalog:
@@ -367,38 +560,9 @@ class IceCatCatalog(IceCat):
 
     def _postprocessor(self, path, key, value):
         if key == "file":
-            # '''
-            # Look up supplier id
-            # '''
-            # try:
-                # value.update({'supplier': self.suppliers.get_mfr_byId(value['supplier_id'])})
-            # except:
-                # self.log.warning("Unable to find supplier for supplier_id: {}".format(value['supplier_id']))
-
-            '''
-            Look up category
-            '''
-            try:
-                value.update({'category': self.categories.get_cat_byId(value['catid']).title()})
-            except:
-                self.log.warning("Unable to find category for catid: {}".format(value['catid']))
-
-            # unroll EAN_UPCS. sometimes this is a list of single value dicts, other times it's a string.
-            if 'EAN_UPCS' in value:
-                try:
-                    value['EAN_UPCS'] = [value['EAN_UPCS']['EAN_UPC']['Value']]
-                except TypeError:
-                    upcs = []
-                    for item in value['EAN_UPCS']['EAN_UPC']:
-                        upcs.append(list(item.values())[0])
-                    value['EAN_UPCS'] = upcs
-                except:
-                    # something bad happened with upcs
-                    self.log.warning("Unable to unroll EAN_UPCS {} for product_id: {}".format(
-                        sys.exc_info(), value['product_id']))
-
-            self.key_count += 1
-            self.bar.update(self.key_count)
+            self.invalid_ean_upcs += index_parser.unroll_ean_upcs(value, self.log)
+            if self._collect_product(value):
+                return None
 
         # skip keys we are not interested in.
         elif key in self.exclude_keys:
@@ -406,13 +570,28 @@ class IceCatCatalog(IceCat):
 
         return key.lower(), value
 
+    def _collect_product(self, value):
+        # returns True when the product is stored, False when the index parser should return it
+        self.key_count += 1
+        self.bar.update(self.key_count)
+
+        if self.snapshot:
+            # merge onto the loaded snapshot as the index streams by
+            self._merge_product(value)
+        elif self.compact or self.parse_workers > 1 or self.memory_limit:
+            # products go straight to the product store
+            self.o.append(value)
+        else:
+            return False
+        return True
+
     # used to flatten a nested structure if needed
 
     def _flatten(self, d, parent_key='', sep='_'):
         items = []
         for k, v in d.items():
             new_key = parent_key + sep + k if parent_key else k
-            if isinstance(v, collections.MutableMapping):
+            if isinstance(v, collections.abc.MutableMapping):
                 items.extend(self._flatten(v, new_key, sep=sep).items())
             else:
                 items.append((new_key, v))
@@ -421,83 +600,450 @@ class IceCatCatalog(IceCat):
     def _parse(self, xml_file):
         self.xml_file = xml_file
         self.key_count = 0
-
-        # skip suppliers for now, there were some problems with downloading xml file
-        # if not self.suppliers:
-            # self.suppliers = IceCatSupplierMapping(log=self.log, auth=self.auth, data_dir=self.data_dir)
-        if not self.categories:
-            self.categories = IceCatCategoryMapping(log=self.log, data_dir=self.data_dir, auth=self.auth)
+        self.invalid_ean_upcs = 0
+        self._load_references()
+
+        if self.snapshot:
+            self._load_snapshot()
+        elif self.compact:
+            self.o = compact_store.CompactCatalog()
+        elif self.memory_limit:
+            self.o = self._spill_catalog()
+        elif self.parse_workers > 1:
+            self.o = []
 
         print("Parsing products from index file:", xml_file)
         with progressbar.ProgressBar(max_value=progressbar.UnknownLength) as self.bar:
-            with open(self.xml_file, 'rb') as f:
-                self.o = xmltodict.parse(f, attr_prefix='', postprocessor=self._postprocessor,
-                                         namespace_separator='', process_namespaces=True, namespaces=self._namespaces)
-            f.closed
+            products = self._parse_index(xml_file)
 
-            # peel down to file key
-            self.o = self.o['icecat-interface']['files.index']['file']
+            if not (self.compact or self.snapshot or self.parse_workers > 1 or self.memory_limit):
+                self.o = products
             self.log.info("Parsed {} products from IceCat catalog".format(str(len(self.o))))
+            if self.changes is not None:
+                self.log.info("Merged index onto snapshot {}: {}".format(
+                    self.snapshot, ', '.join('{} {}'.format(len(v), k) for k, v in self.changes.items())))
+
+        self._log_invalid_codes()
+        self._resolve_names()
         return len(self.o)
 
-    def add_product_details_parallel(self, keys=['ProductDescription'], connections=5):
+    def _load_references(self):
+        if not self.suppliers:
+            try:
+                self.suppliers = reference.get_reference(IceCatSupplierMapping, log=self.log, auth=self.auth,
+                                                         data_dir=self.data_dir, transport=self.transport)
+            except Exception:
+                self.log.warning("Unable to load supplier mapping, supplier names will not be resolved: {}".format(
+                    sys.exc_info()))
+                self.suppliers = None
+        if not self.categories:
+            self.categories = reference.get_reference(IceCatCategoryMapping, log=self.log, auth=self.auth,
+                                                      data_dir=self.data_dir, transport=self.transport)
+
+    def _parse_index(self, xml_file):
+        # stream one index file through _collect_product(). returns the products it did not store
+        if self.parse_workers > 1:
+            for products in index_parser.parse_index_parallel(xml_file, workers=self.parse_workers,
+                                                              exclude_keys=self.exclude_keys):
+                for value in products:
+                    self.invalid_ean_upcs += len(value.get('ean_upcs_invalid', ()))
+                    self._collect_product(value)
+            return []
+
+        kept = []
+        for value in xml_backend.parse_records(xml_file, 'file', self._postprocessor):
+            product = self._postprocessor(None, 'file', value)
+            if product is not None:
+                kept.append(product[1])
+        return kept
+
+    def _spill_catalog(self):
+        return spill_store.SpillCatalog(self.memory_limit, spill_dir=self.data_dir)
+
+    def _load_snapshot(self):
+        # streamed into the product store one product at a time, a memory_limit holds while loading
+        products = export.read_products(self.snapshot)
+        if self.compact:
+            self.o = compact_store.CompactCatalog()
+            self.o.extend(products)
+        elif self.memory_limit:
+            self.o = self._spill_catalog()
+            self.o.extend(products)
+        else:
+            self.o = list(products)
+        self._positions = {item['product_id']: i for i, item in enumerate(self.o)}
+        self.changes = collections.OrderedDict([('added', []), ('updated', []), ('off_market', [])])
+        self.log.info("Loaded {} products from snapshot {}".format(len(self.o), self.snapshot))
+
+    def _merge_product(self, value):
+        product_id = value['product_id']
+        pos = self._positions.get(product_id)
+        if pos is None:
+            self._positions[product_id] = len(self.o)
+            self.o.append(value)
+            self.changes['added'].append(product_id)
+            return
+
+        if not self._replace_product(pos, value):
+            return
+        if value.get('on_market') == '0':
+            self.changes['off_market'].append(product_id)
+        else:
+            self.changes['updated'].append(product_id)
+
+    def _replace_product(self, pos, value):
+        # replace the product at pos when value has a newer Updated, returns True if replaced
+        current = self.o[pos]
+        if int(value.get('updated') or 0) <= int(current.get('updated') or 0):
+            return False
+        if self.snapshot:
+            self._previous[value['product_id']] = dict(current)
+        if isinstance(self.o, (list, spill_store.SpillCatalog)):
+            self.o[pos] = value
+        else:
+            current.clear()
+            current.update(value)
+        return True
+
+    def changed_ids(self):
+        '''
+        Return the set of product ids added, updated or taken off market by the index, see self.changes.
+        Empty without a snapshot.
+        '''
+        if self.changes is None:
+            return set()
+        return set(product_id for ids in self.changes.values() for product_id in ids)
+
+    def select_categories(self, categories):
+        '''
+        Keep only the products of categories, and download details for these categories only
+
+        :param categories: category ids, e.g. IceCatCategoryMapping.get_subtree(['571']), or a dict of
+                           category ids to names like IceCatCatalog._categories. None selects all categories.
+        '''
+        self._categories = categories
+        if categories is not None:
+            self._filter_products(lambda item: item['catid'] in self._categories)
+
+    def _detail_items(self):
+        # with a snapshot only the products changed by the index need fresh details
+        if self.changes is None:
+            return self.o
+        changed = self.changed_ids()
+        return [item for item in self.o if item['product_id'] in changed]
+
+    def _log_invalid_codes(self):
+        if self.invalid_ean_upcs:
+            self.log.warning("{} invalid EAN/UPC codes in the index, kept in ean_upcs_invalid".format(
+                self.invalid_ean_upcs))
+
+    def _resolve_names(self):
+        '''
+        Resolve category and supplier names for all parsed products.
+        Done as one join over the catid/supplier_id values against the mapping tables,
+        instead of a lookup per product while parsing.
+        '''
+        joins = []
+        if self.categories:
+            joins.append(('catid', 'category', self.categories.get_titles()))
+        if self.suppliers:
+            joins.append(('supplier_id', 'supplier', self.suppliers.id_map))
+
+        for source, target, table in joins:
+            if hasattr(self.o, 'join'):
+                missing = self.o.join(source, target, table)
+            else:
+                missing = collections.Counter()
+                for item in self.o:
+                    name = table.get(item.get(source))
+                    if name is None:
+                        missing[item.get(source)] += 1
+                    else:
+                        item[target] = name
+            for key, count in missing.items():
+                self.log.warning("Unable to find {} for {}: {} ({} products)".format(target, source, key, count))
+
+    def add_product_details_parallel(self, keys=['ProductDescription'], connections=5, priority='updated',
+                                     deadline=None, lazy=False, shard=None, cache_size=None, cache_age=None):
         '''
         Download and parse product details, using threads.
 
         :param keys: List of Ice Cat product detail XML keys to include in the output.  Refer to Basic Usage Example.
         :param connections: Number of simultanious download threads.  Do not go over 100.
+        :param priority: Index key used to order the downloads, highest value first. 'updated' fetches the most
+                         recently updated products first, 'product_view' the most viewed ones. None keeps index order.
+        :param deadline: Optional time budget in seconds of the download. When it expires no new download is
+                         started, the products downloaded so far are parsed, the rest are left pending. Pending
+                         products are saved to product_xml/pending.json in download priority order and picked up
+                         first by the next run.
+        :param lazy: Set to True to skip parsing here. Products become LazyProduct records that parse their
+                     cached product xml the first time a detail field is read. Not available with compact=True.
+        :param shard: Optional (k, n) tuple. Only the products of shard k of n are kept in the catalog and get
+                      details, see shard.py. The manifest and pending list of a shard are kept in files of their
+                      own, e.g. product_xml/manifest.0-of-4.ndjson, so several shards can share data_dir.
+        :param cache_size: Optional size limit in bytes of the product xml kept in product_xml/. The least recently
+                           used files are removed as the download goes, see cache.CacheRetention. The product xml
+                           of the products in the active categories is never removed, of every shard, so shards
+                           sharing data_dir do not evict each other's product xml.
+        :param cache_age: Optional number of seconds product xml is kept after its last use
+
+        Every download is recorded in product_xml/manifest.ndjson (see manifest.Manifest). With a snapshot, products
+        updated by the index whose product xml content did not change keep the details of the snapshot and are not
+        parsed again, their ids are listed in self.unchanged. The detail keys a product xml gave are noted in the
+        manifest when it is parsed, an unchanged product gets back exactly these keys, so it has the same fields as
+        a parsed one. Without such a note, e.g. after a lazy run or with other keys, it is parsed. Products whose product xml was answered with a bad
+        status code (404, or 429/503 throttling) are listed in self.failed and saved to product_xml/failed.json,
+        the next run downloads them again as it does the pending ones. The download outcomes are counted in
+        self.fetch_summary.
+
+        Returns the list of pending product ids.
         '''
         self.keys = keys
         self.connections = connections
-        baseurl = 'https://data.icecat.biz/'
+        baseurl = IceCatProductDetails.baseurl
         TYPE = 'Product details'
         urls = []
 
         xml_dir = self.data_dir + 'product_xml/'
+        pending_file = xml_dir + 'pending{}.json'.format(sharding.suffix(shard))
+        failed_file = xml_dir + 'failed{}.json'.format(sharding.suffix(shard))
 
         if not os.path.exists(xml_dir):
             os.makedirs(xml_dir)
 
         # Process only selected categories, skip all the others
-        self.o = list(filter(lambda item: (item['catid'] in self._categories) , self.o))
-
-        for item in self.o:
-            urls.append(baseurl + item['path'].encode('latin-1').decode())
+        if self._categories is not None:
+            self._filter_products(lambda item: (item['catid'] in self._categories))
+        # pinned before the shard filter, the other shards use the rest of the category products
+        retention = self._xml_cache(xml_dir, cache_size, cache_age)
+        if shard:
+            self._filter_products(lambda item: sharding.in_shard(item['product_id'], shard))
+            self.log.info("Shard {}/{}: {} products".format(shard[0], shard[1], len(self.o)))
+        items = self._detail_items()
+        carried = self._load_pending(pending_file, items)
+        retried = self._load_pending(failed_file, _Chain(carried, items))
+        carried += retried
+        items = _Chain(carried, items)
+
+        # cached xml of replaced products may be stale, download it again
+        replaced = set()
+        if self.changes is not None:
+            replaced = set(self.changes['updated'] + self.changes['off_market'])
+        # a failed download may have left the stale xml of an earlier run in the cache
+        replaced.update(item['product_id'] for item in retried)
+
+        priorities = {}
+        meta = {}
+        refresh = set()
+        for item in items:
+            url = baseurl + item['path'].encode('latin-1').decode()
+            urls.append(url)
+            meta[url] = {'product_id': item['product_id'], 'updated': item.get('updated')}
+            if item['product_id'] in replaced:
+                refresh.add(url)
+            if priority and item.get(priority, '').isdigit():
+                priorities[url] = int(item[priority])
+        # left over from the previous run goes first
+        for item in carried:
+            priorities[baseurl + item['path'].encode('latin-1').decode()] = sys.maxsize
         self.log.info("Downloading detail data with {} connections".format(self.connections))
 
+        if not self.transport:
+            self.transport = http_transport.get_transport(self.auth)
+        self.transport.resize(self.connections)
+        manifest = xml_manifest.Manifest(xml_dir + 'manifest{}.ndjson'.format(sharding.suffix(shard)), log=self.log)
         download = bulk_downloader.fetchURLs(log=self.log, urls=urls, auth=self.auth,
                                              connections=self.connections,
-                                             data_dir=xml_dir)
-
+                                             data_dir=xml_dir, transport=self.transport,
+                                             priorities=priorities, deadline=deadline, manifest=manifest,
+                                             meta=meta, refresh=refresh, cache=retention)
+        not_fetched = set(download.get_pending())
+        self.fetch_summary = download.summary()
+        failed = set(download.get_failed())
+        self.unchanged = []
+        self.failed = []
+
+        if lazy and not isinstance(self.o, list):
+            self.log.warning("Lazy product details need a list catalog, parsing eagerly")
+            lazy = False
+
+        pending = {}
+        failed_items = []
+        wrapped = {}
         self.key_count = 0
         print("Parsing product details:")
-        with progressbar.ProgressBar(max_value=len(self.o)) as self.bar:
-            for item in self.o:
+        with progressbar.ProgressBar(max_value=len(items)) as self.bar:
+            for item, url in zip(items, urls):
+                if url in not_fetched:
+                    pending[url] = item
+                    continue
+                if url in failed:
+                    # bad status code, no product xml to parse
+                    self.failed.append(item['product_id'])
+                    failed_items.append(item)
+                    continue
+                if url in download.unchanged and item['product_id'] in self._previous:
+                    # same product xml as in the snapshot, restore the keys its details were noted with
+                    entry = manifest.get(url)
+                    previous = self._previous[item['product_id']]
+                    if entry['detail_keys'] == list(self.keys) and all(key in previous for key in entry['details']):
+                        for key in entry['details']:
+                            item[key] = previous[key]
+                        self.unchanged.append(item['product_id'])
+                        continue
                 xml_file = xml_dir + os.path.basename(item['path'])
+                if lazy:
+                    wrapped[id(item)] = LazyProduct(item, xml_file, self.keys, log=self.log)
+                    continue
                 self.key_count += 1
                 self.bar.update(self.key_count)
                 try:
                     product_detais = IceCatProductDetails(xml_file=xml_file, keys=self.keys,
                                                           auth=self.auth, data_dir=xml_dir, log=self.log, cleanup_data_files=False)
-                    item.update(product_detais.get_data())
+                    details = product_detais.get_data()
+                    item.update(details)
+                    manifest.note(url, detail_keys=list(self.keys), details=list(details))
                 except:
                     self.log.error(
                         "Could not obtain product details from IceCat for product_id {}".format(item['path']))
 
-    def add_product_details(self, keys=['ProductDescription']):
+        if wrapped:
+            self.o[:] = [wrapped.get(id(item), item) for item in self.o]
+        manifest.save()
+
+        if self.unchanged:
+            self.log.info("{} updated products have unchanged product xml, details reused".format(len(self.unchanged)))
+        if self.failed:
+            self.log.warning("No product xml for {} products, see self.failed".format(len(self.failed)))
+        if retention is not None:
+            retention.enforce()
+            self.cache_summary = retention.summary()
+        # in the order the download would have fetched them
+        pending = [pending[url] for url in download.get_pending() if url in pending]
+        self._save_pending(pending_file, pending)
+        self._save_pending(failed_file, failed_items, 'failed')
+        self.pending = [item['product_id'] for item in pending]
+        return self.pending
+
+    def _load_pending(self, pending_file, items):
+        # products left pending by a previous run, that are not queued already
+        if not os.path.isfile(pending_file):
+            return []
+        with open(pending_file, 'r') as f:
+            pending = json.load(f)
+        queued = set(item['product_id'] for item in items)
+        wanted = set(product['product_id'] for product in pending) - queued
+        present = set(item['product_id'] for item in self.o if item['product_id'] in wanted)
+        for product in pending:
+            if product['product_id'] in wanted and product['product_id'] not in present:
+                self.o.append(product)
+                present.add(product['product_id'])
+
+        # look the records up once everything is appended, a product store may move them while appending
+        known = {}
+        for item in self.o:
+            if item['product_id'] in wanted:
+                known[item['product_id']] = item
+        carried = []
+        for product in pending:
+            if product['product_id'] in known:
+                carried.append(known.pop(product['product_id']))
+        if carried:
+            self.log.info("Picked up {} pending products from the previous run".format(len(carried)))
+        return carried
+
+    def _save_pending(self, pending_file, pending, state='left pending'):
+        # pending or failed products, downloaded first by the next run
+        if pending:
+            with open(pending_file, 'w') as f:
+                f.write(json.dumps(pending, default=self._json_default))
+            self.log.warning("{} products {}, saved to {}".format(len(pending), state, pending_file))
+        elif os.path.isfile(pending_file):
+            os.remove(pending_file)
+
+    def add_product_details(self, keys=['ProductDescription'], cache_size=None, cache_age=None):
         '''
         Download and parse product details.  Use add_product_details_parallel() instead, for a much improved performance.
 
         :param keys: List of Ice Cat product detail XML keys to include in the output.  Refer to Basic Usage Example.
+        :param cache_size: Optional size limit of product_xml/ in bytes, see add_product_details_parallel()
+        :param cache_age: Optional number of seconds product xml is kept after its last use
         '''
         self.keys = keys
-        for item in self.o:
+        xml_dir = self.data_dir + 'product_xml/'
+        if not os.path.exists(xml_dir):
+            os.makedirs(xml_dir)
+        retention = self._xml_cache(xml_dir, cache_size, cache_age)
+        # cached xml of replaced products may be stale, download it again
+        replaced = set()
+        if self.changes is not None:
+            replaced = set(self.changes['updated'] + self.changes['off_market'])
+        for item in self._detail_items():
+            # product xml is kept in the same cache as add_product_details_parallel() uses
+            xml_file = xml_dir + os.path.basename(item['path'])
             try:
-                product_detais = IceCatProductDetails(filename=item['path'], keys=self.keys,
-                                                      auth=self.auth, data_dir=self.data_dir, log=self.log)
+                if os.path.isfile(xml_file) and item['product_id'] not in replaced:
+                    product_detais = IceCatProductDetails(xml_file=xml_file, keys=self.keys, auth=self.auth,
+                                                          data_dir=xml_dir, log=self.log, cleanup_data_files=False)
+                else:
+                    product_detais = IceCatProductDetails(filename=item['path'], keys=self.keys,
+                                                          auth=self.auth, data_dir=xml_dir, log=self.log,
+                                                          transport=self.transport, cleanup_data_files=False)
                 item.update(product_detais.get_data())
+                if retention is not None:
+                    retention.used(xml_file)
             except:
                 self.log.error("Could not obtain product details from IceCat for product_id {}".format(item['path']))
+        if retention is not None:
+            retention.enforce()
+            self.cache_summary = retention.summary()
+
+    def _xml_cache(self, xml_dir, cache_size, cache_age):
+        # retention of the product xml cache, the xml of the products in the catalog is pinned
+        if cache_size is None and cache_age is None:
+            return None
+        pinned = [os.path.basename(item['path']) for item in self.o]
+        return xml_cache.CacheRetention(xml_dir, max_size=cache_size, max_age=cache_age, pinned=pinned, log=self.log)
+
+    def _filter_products(self, predicate):
+        # keep the product container type, CompactCatalog filters its columns in place of a list copy
+        if hasattr(self.o, 'filter'):
+            self.o = self.o.filter(predicate)
+        else:
+            self.o = list(filter(predicate, self.o))
+        if self.changes is not None:
+            # the change set describes the products kept
+            kept = set(item['product_id'] for item in self.o)
+            for key, ids in self.changes.items():
+                self.changes[key] = [product_id for product_id in ids if product_id in kept]
+
+    def write_snapshot(self, filename):
+        '''
+        Save the merged catalog as a snapshot for the next incremental run, and the change set
+        (product ids added, updated and taken off market) next to it as <filename>.changes.json
+
+        :param filename: snapshot file name
+        '''
+        self.dump_to_file(filename)
+        if self.changes is not None:
+            changes_file = os.path.splitext(filename)[0] + '.changes.json'
+            with open(changes_file, 'w') as f:
+                f.write(json.dumps(self.changes, indent=2))
+            self.log.info("Change set written to {}".format(changes_file))
+
+    def write_gtin_index(self, filename):
+        '''
+        Write the GTIN (EAN/UPC) to product_id lookup index of the catalog, see gtin.GtinIndex.
+        Returns the number of GTINs written.
+
+        :param filename: index file name
+        '''
+        count = gtin.build_index(self.o, filename)
+        self.log.info("GTIN index of {} codes written to {}".format(count, filename))
+        return count
+
+    def _json_default(self, obj):
+        return export.json_default(obj)
 
     def get_data(self):
         '''
@@ -505,6 +1051,17 @@ class IceCatCatalog(IceCat):
         '''
         return self.o
 
+    def get_records(self, schema=None, strict=False):
+        '''
+        Iterate the products as typed records with parsed ids, dates and lists, see schema.ProductSchema
+
+        :param schema: optional ProductSchema, by default one for the detail keys of the last add_product_details..()
+        :param strict: raise ValueError for a product value that does not parse
+        '''
+        schema = schema or product_schema.ProductSchema(keys=getattr(self, 'keys', ()))
+        for item in self.o:
+            yield schema.from_dict(item, strict=strict)
+
     def dump_to_file(self, filename=None):
         '''
         Save product attributes to a JSON file
@@ -517,7 +1074,130 @@ class IceCatCatalog(IceCat):
             # change extension for the JSON output
             self.json_file = os.path.splitext(self.xml_file)[0] + '.json'
 
-        with open(self.json_file, 'w') as f:
-            f.write(json.dumps(self.o, indent=2))
+        if isinstance(self.o, list):
+            with open(self.json_file, 'w') as f:
+                f.write(json.dumps(self.o, indent=2, default=self._json_default))
+            f.closed
+        else:
+            # one product at a time, same layout as the list dump
+            export.write_json(self.o, self.json_file)
         self.log.info("JSON output written to {}".format(self.json_file))
-        f.closed
\ No newline at end of file
+
+
+class IceCatMultiMarketCatalog(IceCatCatalog):
+    '''
+    Parse the Ice Cat catalog index of several country/language feeds in one run.
+    The indexes are downloaded concurrently and products are deduplicated by product_id, so product
+    details are downloaded once per product. For a product listed in several feeds the most recently
+    updated record is kept, with
+
+         - markets: sorted list of the feeds listing the product
+         - country_markets: sorted list of the Country_Markets values of all feeds
+
+    :param markets: list of feed names, e.g. ['CZ', 'DE', 'EN']. Refer to the Ice Cat export/freexml/ directory.
+    :param xml_files: optional dict of feed name to a local index file. Feeds not listed are downloaded.
+                      A feed that fails to download is skipped with an error logged, IOError is raised only
+                      when no feed could be downloaded.
+
+    Refer to IceCatCatalog class for additional arguments, compact and memory_limit choose the product store
+    as there. snapshot is not supported.
+    '''
+
+    MARKET_BASEURL = 'https://data.icecat.biz/export/freexml/{}/'
+
+    def __init__(self, markets=['CZ'], xml_files=None, exclude_keys=['Country_Markets'], *args, **kwargs):
+        if kwargs.get('snapshot'):
+            raise ValueError("IceCatMultiMarketCatalog does not support snapshot")
+        self.markets = markets
+        self.market_files = dict(xml_files or {})
+        # Country_Markets is merged, not dropped
+        exclude_keys = [key for key in exclude_keys if key != 'Country_Markets']
+        if all(market in self.market_files for market in markets):
+            kwargs['xml_file'] = self.market_files[markets[0]]
+        super(IceCatMultiMarketCatalog, self).__init__(exclude_keys=exclude_keys, *args, **kwargs)
+
+    def _download(self):
+        if not self.transport:
+            self.transport = http_transport.get_transport(self.auth)
+        self.transport.resize(len(self.markets))
+
+        def fetch(market):
+            market_dir = self.data_dir + market + '/'
+            if not os.path.exists(market_dir):
+                os.makedirs(market_dir, exist_ok=True)
+            url = self.MARKET_BASEURL.format(market) + self.FILENAME
+            self.log.info("Downloading {} from {}".format(self.TYPE, url))
+            return self._fetch(url, market_dir + self.FILENAME)
+
+        missing = [market for market in self.markets if market not in self.market_files]
+        with futures.ThreadPoolExecutor(max_workers=max(1, len(missing))) as pool:
+            for market, local_file in zip(missing, pool.map(fetch, missing)):
+                if local_file:
+                    self.market_files[market] = local_file
+                else:
+                    self.log.error("Could not download index for market {}".format(market))
+        # any market that arrived is parsed, _parse() goes through market_files
+        for market in self.markets:
+            if market in self.market_files:
+                return self.market_files[market]
+        raise IOError("Could not download the index of any market: {}".format(', '.join(self.markets)))
+
+    def _parse(self, xml_file):
+        self.xml_file = xml_file
+        self.key_count = 0
+        self.invalid_ean_upcs = 0
+        self._load_references()
+        if self.compact:
+            self.o = compact_store.CompactCatalog()
+        elif self.memory_limit:
+            self.o = self._spill_catalog()
+        else:
+            self.o = []
+        self._positions = {}
+
+        with progressbar.ProgressBar(max_value=progressbar.UnknownLength) as self.bar:
+            for market in self.markets:
+                if market not in self.market_files:
+                    continue
+                self._market = market
+                print("Parsing products from index file:", self.market_files[market])
+                self._parse_index(self.market_files[market])
+            self.log.info("Parsed {} unique products from {} markets".format(len(self.o), len(self.markets)))
+
+        self._log_invalid_codes()
+        self._resolve_names()
+        return len(self.o)
+
+    def _country_markets(self, value):
+        # Country_Markets is {'country_market': {'value': 'US'}} or {'country_market': [{'value': 'US'}, ...]}
+        markets = value.get('country_markets')
+        if not isinstance(markets, dict):
+            return []
+        entries = markets.get('country_market')
+        if isinstance(entries, dict):
+            entries = [entries]
+        if not isinstance(entries, list):
+            return []
+        return [entry['value'] for entry in entries if isinstance(entry, dict) and 'value' in entry]
+
+    def _collect_product(self, value):
+        self.key_count += 1
+        self.bar.update(self.key_count)
+
+        value['country_markets'] = sorted(set(self._country_markets(value)))
+        value['markets'] = [self._market]
+        product_id = value['product_id']
+        pos = self._positions.get(product_id)
+        if pos is None:
+            self._positions[product_id] = len(self.o)
+            self.o.append(value)
+            return True
+
+        current = self.o[pos]
+        markets = sorted(set(current['markets']) | set(value['markets']))
+        country_markets = sorted(set(current['country_markets']) | set(value['country_markets']))
+        self._replace_product(pos, value)
+        current = self.o[pos]
+        current['markets'] = markets
+        current['country_markets'] = country_markets
+        return True
@@ -0,0 +1,5 @@
+import sys
+
+from IceCat.cli import main
+
+sys.exit(main())
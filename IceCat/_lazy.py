@@ -0,0 +1,69 @@
+'''
+Deferred imports.
+
+lazy_import() returns a stand-in module that imports the real one on first attribute access.
+The package uses it for its heavier subsystems (http transport, download, index
+parsing, product stores, export) and their third party dependencies, so that
+e.g. loading a cached category mapping does not pay for requests or the XML parsers.
+
+The first access imports the module with importlib.import_module() under a lock, so
+threads touching a lazy module at the same time all see the loaded module
+(importlib.util.LazyLoader is not thread safe before Python 3.12).
+'''
+import importlib
+import importlib.util
+import sys
+import threading
+import types
+
+_lock = threading.RLock()
+
+
+class _LazyModule(types.ModuleType):
+    # stand-in for a module not imported yet, attribute reads and writes go to the real module
+
+    def __init__(self, name):
+        super(_LazyModule, self).__init__(name)
+        object.__setattr__(self, '_module', None)
+
+    def _load(self):
+        module = object.__getattribute__(self, '_module')
+        if module is None:
+            with _lock:
+                module = object.__getattribute__(self, '_module')
+                if module is None:
+                    module = importlib.import_module(self.__name__)
+                    object.__setattr__(self, '_module', module)
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        return '<lazy module {!r}>'.format(self.__name__)
+
+
+def lazy_import(name):
+    '''
+    Return module name, loaded on first use. An already imported module is returned as is.
+
+    :param name: absolute module name, e.g. 'progressbar' or 'IceCat.bulk_downloader'
+    '''
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    # find_spec() of a submodule imports its package, only the top level package is looked up then
+    parent = name.rpartition('.')[0]
+    if parent and parent not in sys.modules:
+        found = importlib.util.find_spec(name.partition('.')[0])
+    else:
+        found = importlib.util.find_spec(name)
+    if found is None:
+        raise ImportError("No module named {!r}".format(name), name=name)
+    return _LazyModule(name)
@@ -1,30 +1,64 @@
 import os, time, datetime, sys
+import hashlib
 
 from threading import Thread
-import requests
 from time import time, sleep
 import queue
 import logging
 import progressbar
+import collections
+from urllib.parse import urlsplit
 
+from IceCat import transport as http_transport
+from IceCat import shard as sharding
+
+# outcome of a url: downloaded, local file kept, 304 for the cached file, bad status code, not processed
+FETCHED = 'fetched'
+CACHED = 'cached'
+NOT_MODIFIED = 'not_modified'
+FAILED = 'failed'
+PENDING = 'pending'
+OUTCOMES = (FETCHED, CACHED, NOT_MODIFIED, FAILED, PENDING)
+SUCCESS = (FETCHED, CACHED, NOT_MODIFIED)
+
+URLResult = collections.namedtuple('URLResult', 'url outcome status bytes seconds attempts error')
 
 
 class fetchURLs(object):
     '''     
     Download and save a list of URLs
-    using parallel connections.  A separate session is maintained for each
-    download thread.     If throttling is detected (broken connections)
-    the thread is terminated in order to reduce the load on the web serve.
+    using parallel connections.  All download threads share one keep-alive
+    session, the connection pool is sized to the number of threads.
+    If throttling is detected (broken connections) the thread is terminated
+    in order to reduce the load on the web serve.
     If a local file already exists for a given URL, that URL is skipped.
-    There is no check currently if remote document is     newer than the
-    local file.     If the URL does not end with a file name fetchURLs
+    URLs in refresh are downloaded again even if a local file exists, with the
+    ETag of the manifest entry as If-None-Match.  If the URL does not end with a file name fetchURLs
     will generate a default filename in the format <website>.index.html
+    Duplicate URLs are fetched once.  URLs are downloaded in order of priority,
+    URLs with equal priority are interleaved across hosts and path prefixes.
+    The outcome of every URL (see OUTCOMES) is kept with its HTTP status, bytes, latency and
+    number of attempts, see get_results(), get_failed() and summary().
 
     :param urls: A list of absolute URLs to fetch
+    :param priorities: An optional dict of URL to a number, higher numbers are fetched first
+    :param deadline: Optional time budget in seconds. When it expires no new download is started, downloads in
+                     flight are finished (each one bounded by the transport timeout) before fetchURLs returns.
+                     URLs not fetched are reported by get_pending()
     :param data_dir:  Directory to save files in
     :param connections: Number of simultanious download threads
     :param auth: Username and password touple, if needed for website authentication
     :param log: An optional logging.getLogger() instance
+    :param transport: An optional transport.Transport instance, the process wide transport for auth is used by default
+    :param manifest: An optional manifest.Manifest. Every download is recorded with its size, ETag and content hash.
+                     After the run self.changed holds the URLs that brought new content, self.unchanged the URLs
+                     whose content hash matched the previous download.
+    :param meta: An optional dict of URL to manifest fields, e.g. {'product_id': '3827', 'updated': '20160208150856'}
+    :param refresh: An optional set of URLs to download again even if the local file exists
+    :param shard: An optional (k, n) tuple, only the URLs of shard k of n are fetched. URLs are
+                  assigned by the product_id of their meta entry, or by the URL itself, see shard.shard_of()
+    :param cache: An optional cache.CacheRetention of data_dir. Downloads and cache hits are reported to it,
+                  it trims the directory as the download goes
 
     This class is usually called from IceCat
 
@@ -38,91 +72,278 @@ class fetchURLs(object):
                     ],
                 data_dir = '_data/product_xml/',
                 auth=('goober@aol.com','password'),
-                connections=5):
+                connections=5,
+                transport=None,
+                priorities=None,
+                deadline=None,
+                manifest=None,
+                meta=None,
+                refresh=None,
+                shard=None,
+                cache=None):
+
+        self.log = log
+        if not log:
+            self.log = logging.getLogger()
 
-        self.urls = queue.Queue()
+        self.meta = meta or {}
+        if shard:
+            urls = [url for url in urls if sharding.in_shard(self.meta.get(url, {}).get('product_id', url), shard)]
+            self.log.info("Shard {}/{}: {} urls".format(shard[0], shard[1], len(urls)))
 
-        for i in urls:
-            self.urls.put(i)
+        self.urls = queue.PriorityQueue()
+        self.rank = {}
+
+        for i, url in enumerate(self._schedule(urls, priorities or {})):
+            self.rank[url] = i
+            self.urls.put((i, url))
 
         self.data_dir = data_dir
         self.connections = connections
+        self.deadline = deadline
+        self.done = set()
+        self.stopped = False
+        self.manifest = manifest
+        self.refresh = set(refresh or ())
+        self.changed = set()
+        self.unchanged = set()
+        self.cache = cache
+        self.results = {}
+        self.attempts = {}
+        self.errors = {}
         self.auth = auth
-        self.log = log
-        if not log:
-            self.log = logging.getLogger()
+        self.transport = transport or http_transport.get_transport(auth, connections)
+        self.transport.resize(connections)
         
         logging.getLogger("requests").setLevel(logging.WARNING)
         # self.log.setLevel(logging.WARNING)
 
         print("Downloading product details:")
-        with progressbar.ProgressBar(max_value=len(urls)) as self.bar:
+        with progressbar.ProgressBar(max_value=len(self.rank)) as self.bar:
             self._download()
 
-    def _worker(self):
-        s = requests.Session()
-        s.auth = self.auth
+    def _schedule(self, urls, priorities):
+        '''
+        Return the unique urls in download order
+        '''
+        unique = list(collections.OrderedDict.fromkeys(urls))
+        if len(unique) < len(urls):
+            self.log.info("Skipping {} duplicate urls".format(len(urls) - len(unique)))
+
+        # group by priority, within a priority round robin over host and path prefix
+        levels = collections.OrderedDict()
+        for url in sorted(unique, key=lambda u: -priorities.get(u, 0)):
+            parts = urlsplit(url)
+            prefix = (parts.netloc, os.path.dirname(parts.path))
+            levels.setdefault(priorities.get(url, 0), collections.OrderedDict()).setdefault(prefix, []).append(url)
 
+        ordered = []
+        for groups in levels.values():
+            groups = list(groups.values())
+            for i in range(max(len(g) for g in groups)):
+                ordered.extend(g[i] for g in groups if i < len(g))
+        return ordered
+
+    def _worker(self):
         while True:
-            url = self.urls.get()
-            self.bar.update(self.success_count)
+            rank, url = self.urls.get()
+            if self.stopped:
+                # out of time or done, leave the url pending
+                self.urls.task_done()
+                break
+            self.bar.update(len(self.done))
             bn = os.path.basename(url)
             if not bn:
                 file = self.data_dir + os.path.basename(os.path.dirname(url)) + '.index.html'
             else:
                 file = self.data_dir + bn
 
-            if os.path.isfile(file):
-                modified = os.path.getmtime(file)
-                # headers = {'If-Modified-Since': }  # do this later
+            cached = os.path.isfile(file)
+            if cached and url not in self.refresh:
                 # self.log.warning("Skipping {} - file exists".format(url))
+                if self.manifest is not None and url not in self.manifest:
+                    self._record_file(url, file)
+                self._result(url, CACHED, size=os.path.getsize(file))
+                self._used(file)
                 self.urls.task_done()  
-                self.success_count += 1
                 continue
 
+            headers = {}
+            entry = self.manifest.get(url) if self.manifest is not None else None
+            if cached and entry and entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+
+            # only the thread holding the url touches its attempts
+            self.attempts[url] = self.attempts.get(url, 0) + 1
+            started = time()
             try:
-                res = s.get(url)
+                res = self.transport.get(url, stream=True, headers=headers)
             except:
                 self.log.warning("Bad request {} for url: {}".format(sys.exc_info(), url))
+                self.errors[url] = repr(sys.exc_info()[1])
                 #put item back into queue
-                self.urls.put(url)
+                self.urls.put((rank, url))
                 self.urls.task_done()  
                 # this could be due to throttling, exit thread  
                 break
 
 
             
+            if res.status_code == 304 and entry:
+                # cached file is current
+                res.close()
+                self._record(url, entry['size'], entry['sha1'], entry['etag'], previous=entry)
+                self._result(url, NOT_MODIFIED, 304, entry['size'], time() - started)
+                self._used(file)
+                self.urls.task_done()
+                continue
+
             if 200 <=res.status_code < 299:
-                self.success_count += 1
                 self.log.debug("Fetched {}".format(url))
             else:
                 self.log.warning("Bad status code: {} for url: {}".format(res.status_code, url))
+                res.close()
+                self._result(url, FAILED, res.status_code, seconds=time() - started)
                 self.urls.task_done()    
                 continue
 
-            with open(file, 'wb') as f:
-                for chunk in res.iter_content(chunk_size=1024*1024):
-                    if chunk:
-                        f.write(chunk)
-            
+            # write to a temp file first, a partial file would be skipped as cached next time
+            part = file + '.part'
+            digest = hashlib.sha1()
+            size = 0
+            try:
+                with open(part, 'wb') as f:
+                    for chunk in res.iter_content(chunk_size=1024*1024):
+                        if chunk:
+                            f.write(chunk)
+                            digest.update(chunk)
+                            size += len(chunk)
+                os.replace(part, file)
+            except:
+                self.log.warning("Broken download {} for url: {}".format(sys.exc_info(), url))
+                self.errors[url] = repr(sys.exc_info()[1])
+                if os.path.isfile(part):
+                    os.remove(part)
+                self.urls.put((rank, url))
+                self.urls.task_done()
+                break
 
+            self._record(url, size, digest.hexdigest(), res.headers.get('ETag'), previous=entry)
+            self._result(url, FETCHED, res.status_code, size, time() - started)
+            self._used(file, size)
             self.urls.task_done()    
+
+    def _result(self, url, outcome, status=None, size=0, seconds=0.0):
+        # each url is finished by one thread, no lock needed
+        self.results[url] = URLResult(url, outcome, status, size, seconds, self.attempts.get(url, 0),
+                                      self.errors.get(url))
+        self.done.add(url)
+
+    def _used(self, file, size=None):
+        if self.cache is not None:
+            self.cache.used(file, size)
+
+    def _record(self, url, size, sha1, etag, previous=None):
+        if self.manifest is None:
+            return
+        fields = dict(self.meta.get(url, {}))
+        if previous is not None and previous['sha1'] == sha1:
+            self.unchanged.add(url)
+            # same content, the details noted for it still hold
+            fields.update(detail_keys=previous.get('detail_keys'), details=previous.get('details'))
+        else:
+            self.changed.add(url)
+        fields.update(size=size, sha1=sha1, etag=etag)
+        self.manifest.record(url, **fields)
+
+    def _record_file(self, url, file):
+        # a file cached before the manifest was kept
+        digest = hashlib.sha1()
+        with open(file, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024*1024), b''):
+                digest.update(chunk)
+        fields = dict(self.meta.get(url, {}))
+        fields.update(size=os.path.getsize(file), sha1=digest.hexdigest(),
+                      fetched_at=int(os.path.getmtime(file)))
+        self.manifest.record(url, **fields)
     
     def _download(self):
-        self.success_count = 0
         if not os.path.exists(self.data_dir):
             os.makedirs(self.data_dir)
 
         start = time()
+        threads = []
         for i in range(self.connections):
             t = Thread(target=self._worker)
             t.daemon = True
             t.start()
-        self.urls.join()
-        self.log.info('fetched {} URLs in %0.3fs'.format(self.success_count) % (time()-start))
+            threads.append(t)
+
+        # same as self.urls.join(), but gives up when the deadline passes or every worker has exited
+        with self.urls.all_tasks_done:
+            while self.urls.unfinished_tasks:
+                wait = 1.0
+                if self.deadline is not None:
+                    wait = min(wait, start + self.deadline - time())
+                    if wait <= 0:
+                        self.log.warning("Download deadline of {}s reached".format(self.deadline))
+                        break
+                if not any(t.is_alive() for t in threads):
+                    self.log.warning("All download threads exited")
+                    break
+                self.urls.all_tasks_done.wait(wait)
+        self.stopped = True
+        # wake the threads waiting for a url, and let the ones downloading finish their file. no thread records
+        # a download once the manifest is saved. ranks past the last url keep the queue order
+        for i in range(len(threads)):
+            self.urls.put((len(self.rank) + i, None))
+        for t in threads:
+            t.join()
+        if self.manifest is not None:
+            self.manifest.save()
+
+        self.success_count = self.get_count()
+        pending = len(self.rank) - len(self.done)
+        self.log.info('fetched {} URLs in %0.3fs, {} pending'.format(self.success_count, pending) % (time()-start))
 
     def get_count(self):
         '''
         Returns the number of successfully fetched urls
         '''
-        return self.success_count
\ No newline at end of file
+        return sum(1 for result in list(self.results.values()) if result.outcome in SUCCESS)
+
+    def get_results(self):
+        '''
+        Returns a URLResult per url in download order. URLs that were not processed have outcome 'pending',
+        with the attempts made and the last error.
+        '''
+        results = dict(self.results)
+        return [results.get(url) or URLResult(url, PENDING, None, 0, 0.0, self.attempts.get(url, 0), self.errors.get(url))
+                for url in self.rank]
+
+    def get_failed(self):
+        '''
+        Returns the list of urls answered with a bad status code. Together with get_pending() these are
+        the urls to run again.
+        '''
+        return [result.url for result in self.get_results() if result.outcome == FAILED]
+
+    def summary(self):
+        '''
+        Returns the number of urls per outcome, and the bytes, attempts and seconds of all downloads
+        '''
+        totals = collections.OrderedDict((outcome, 0) for outcome in OUTCOMES)
+        totals.update(bytes=0, attempts=0, seconds=0.0)
+        for result in self.get_results():
+            totals[result.outcome] += 1
+            totals['bytes'] += result.bytes
+            totals['attempts'] += result.attempts
+            totals['seconds'] += result.seconds
+        return totals
+
+    def get_pending(self):
+        '''
+        Returns the list of urls that were not processed, because the deadline expired or the
+        download threads gave up
+        '''
+        return [url for url in self.rank if url not in self.done]
\ No newline at end of file
@@ -0,0 +1,173 @@
+'''
+Retention of the product xml cache (product_xml/).
+
+Downloaded product xml is kept so the next run can skip or revalidate it.
+CacheRetention bounds the cache by total size and by age:
+
+- the modification time of a file is its last use, downloads and cache hits touch it
+- files unused for longer than max_age are removed
+- past max_size the least recently used files are removed, down to low_water of max_size
+- pinned files, the products of the active categories, are never removed
+
+The cache directory is scanned once.  Downloads and hits update the in-memory
+index as they happen (used()), so eviction runs incrementally alongside the
+downloads instead of rescanning the directory.  The evictable files are kept in
+least recently used order, pinned files are counted apart: a download costs the
+files it evicts, and nothing more once only pinned files are left.
+
+    retention = cache.CacheRetention('_data/product_xml/', max_size=20 * 2**30, max_age=30 * 86400,
+                                     pinned=['3827.xml', '108912.xml'])
+'''
+import collections
+import os
+import threading
+import time
+
+SUFFIX = '.xml'
+
+
+class CacheRetention(object):
+    '''
+    Size and age bounded product xml cache directory. Thread safe.
+
+    :param directory: product xml cache directory
+    :param max_size: optional size limit of the cached xml in bytes
+    :param max_age: optional number of seconds a file is kept after its last use
+    :param pinned: file names never removed, e.g. the product xml of the active categories
+    :param log: optional logging.getLogger() instance
+    :param low_water: fraction of max_size the cache is trimmed to when it grows past max_size
+    '''
+
+    def __init__(self, directory, max_size=None, max_age=None, pinned=(), log=None, low_water=0.9):
+        self.directory = directory
+        self.max_size = max_size
+        self.max_age = max_age
+        self.pinned = set(pinned)
+        self.log = log
+        self.low_water = low_water
+        # evictable file name -> [size, last use], least recently used first
+        self.entries = collections.OrderedDict()
+        # pinned file name -> size
+        self.pinned_entries = {}
+        self.size = 0
+        self.pinned_size = 0
+        self.evicted = 0
+        self.evicted_bytes = 0
+        self._warned = False
+        self._lock = threading.Lock()
+        self._scan()
+
+    def _scan(self):
+        if not os.path.isdir(self.directory):
+            return
+        found = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.name.endswith(SUFFIX) and entry.is_file():
+                    stat = entry.stat()
+                    found.append((stat.st_mtime, entry.name, stat.st_size))
+        for last_used, name, size in sorted(found):
+            self._add(name, size, last_used)
+
+    def _add(self, name, size, last_used):
+        self.size += size
+        if name in self.pinned:
+            self.pinned_size += size
+            self.pinned_entries[name] = size
+        else:
+            self.entries[name] = [size, last_used]
+
+    def _discard(self, name):
+        if name in self.pinned_entries:
+            size = self.pinned_entries.pop(name)
+            self.pinned_size -= size
+        else:
+            size = self.entries.pop(name)[0]
+        self.size -= size
+
+    def __len__(self):
+        return len(self.entries) + len(self.pinned_entries)
+
+    def __contains__(self, name):
+        name = os.path.basename(name)
+        return name in self.entries or name in self.pinned_entries
+
+    def used(self, path, size=None):
+        '''
+        Record a download or cache hit of path, then trim the cache if it grew past max_size
+
+        :param path: product xml file
+        :param size: file size, looked up when None
+        '''
+        name = os.path.basename(path)
+        now = time.time()
+        try:
+            os.utime(path, (now, now))
+            if size is None:
+                size = os.path.getsize(path)
+        except OSError:
+            return
+        with self._lock:
+            if name in self.entries or name in self.pinned_entries:
+                self._discard(name)
+            # appended last, the most recently used
+            self._add(name, size, now)
+            # nothing to trim when only pinned files are left
+            if self.max_size is not None and self.size > self.max_size and self.entries:
+                self._trim(self.max_size * self.low_water)
+
+    def _remove(self, names):
+        for name in names:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            size = self.entries.pop(name)[0]
+            self.size -= size
+            self.evicted += 1
+            self.evicted_bytes += size
+
+    def _trim(self, target):
+        # least recently used first, pinned files are not in entries
+        victims = []
+        size = self.size
+        for name, (file_size, last_used) in self.entries.items():
+            if size <= target:
+                break
+            victims.append(name)
+            size -= file_size
+        self._remove(victims)
+        if size > target and not self._warned and self.log:
+            self._warned = True
+            self.log.warning("Product xml cache of {} bytes is over its limit, {} pinned files of {} bytes".format(
+                size, len(self.pinned_entries), self.pinned_size))
+
+    def enforce(self):
+        '''
+        Remove the files past max_age, then the least recently used ones past max_size.
+        Returns the number of files removed.
+        '''
+        with self._lock:
+            evicted = self.evicted
+            if self.max_age is not None:
+                oldest = time.time() - self.max_age
+                victims = []
+                for name, (size, last_used) in self.entries.items():
+                    if last_used >= oldest:
+                        break
+                    victims.append(name)
+                self._remove(victims)
+            if self.max_size is not None and self.size > self.max_size:
+                self._trim(self.max_size)
+            evicted = self.evicted - evicted
+        if evicted and self.log:
+            self.log.info("Removed {} files from the product xml cache, {} files of {} bytes left".format(
+                evicted, len(self), self.size))
+        return evicted
+
+    def summary(self):
+        '''
+        Returns the number of files and bytes cached and removed
+        '''
+        return {'files': len(self), 'bytes': self.size, 'pinned': len(self.pinned_entries),
+                'evicted': self.evicted, 'evicted_bytes': self.evicted_bytes}
@@ -0,0 +1,249 @@
+'''
+Command line interface, installed as the icecat console script.
+
+    icecat sync daily --output daily.ndjson --connections 50
+    icecat sync full --parse-workers 4 --memory-limit 2048 --category 571 --category 119 \\
+        --output fullcatalog.sqlite --metrics metrics.json
+    icecat sync daily --incremental --snapshot catalog.json --changed-only --output changes.ndjson
+    icecat sync full --shard 0/4 --output full.0.ndjson
+    icecat merge --output full.ndjson full.0.ndjson full.1.ndjson full.2.ndjson full.3.ndjson
+    icecat diff yesterday.index.xml today.index.xml --output delta.ndjson
+
+Credentials are read from --user/--password or the ICECAT_USER and ICECAT_PASSWORD
+environment variables.  One run downloads and parses the index, then downloads and
+parses the product details, then writes the output, see sync().  The stages run one
+after the other, --connections and --parse-workers set the parallelism within the
+details and index stages.  merge combines the outputs of sharded runs, see shard.py,
+diff compares two index files, see diff.py.
+'''
+import argparse
+import collections
+import contextlib
+import json
+import logging
+import os
+import sys
+import time
+
+from IceCat import IceCat
+from IceCat import diff as index_diff
+from IceCat import export
+from IceCat import reference
+from IceCat import shard as sharding
+
+DEFAULT_KEYS = [
+    'ProductDescription[@LongDesc]',
+    'ShortSummaryDescription',
+    'LongSummaryDescription',
+    'ProductDescription[@ShortDesc]',
+    'Product',
+]
+
+
+def _parser():
+    parser = argparse.ArgumentParser(prog='icecat', description='IceCat open catalog tools')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    sync = commands.add_parser('sync', help='download the product index and product details, write the catalog')
+    sync.add_argument('kind', choices=['daily', 'full'], help='daily or full product index')
+    sync.add_argument('--user', default=os.environ.get('ICECAT_USER'), help='IceCat user, default $ICECAT_USER')
+    sync.add_argument('--password', default=os.environ.get('ICECAT_PASSWORD'),
+                      help='IceCat password, default $ICECAT_PASSWORD')
+    sync.add_argument('--data-dir', help='directory for downloaded files, default _<kind>_data/')
+    sync.add_argument('-o', '--output', help='output file, default <kind>.json')
+    sync.add_argument('--format', choices=sorted(export.WRITERS),
+                      help='output format, default from the output file extension')
+    sync.add_argument('--bulk-index', default='icecat', help='with --format bulk, target index of the bulk actions')
+    sync.add_argument('--bulk-id-field', default='product_id', help='with --format bulk, product key used as _id')
+    sync.add_argument('--bulk-chunk-size', type=int, default=10, metavar='MB',
+                      help='with --format bulk, size limit of a bulk file, the output is split in numbered files')
+    sync.add_argument('--gzip', action='store_true', help='with --format bulk, gzip the bulk files')
+    sync.add_argument('-c', '--connections', type=int, default=10, help='simultanious product detail downloads')
+    sync.add_argument('--parse-workers', type=int, default=1, help='processes parsing the index')
+    sync.add_argument('--category', action='append', metavar='ID',
+                      help='category root, the category and all categories below it are included. Repeatable, '
+                           'default all categories, with or without --no-details')
+    sync.add_argument('--key', action='append', metavar='KEY',
+                      help='product detail key or section name, e.g. ProductDescription[@ShortDesc] or features. '
+                           'Repeatable, default: ' + ', '.join(DEFAULT_KEYS))
+    sync.add_argument('--no-details', action='store_true', help='write the index only')
+    sync.add_argument('--incremental', action='store_true',
+                      help='merge the index onto the snapshot of the previous run, fetch changed products only')
+    sync.add_argument('--changed-only', action='store_true',
+                      help='with --incremental, write only the products added or changed by this run. '
+                           'With --format bulk, products taken off market are written as delete actions')
+    sync.add_argument('--snapshot', help='snapshot file of --incremental, default <data-dir>/snapshot.json, '
+                                         'with --shard K/N <data-dir>/snapshot.K-of-N.json')
+    sync.add_argument('--compact', action='store_true', help='column oriented in-memory catalog')
+    sync.add_argument('--memory-limit', type=int, metavar='MB', help='spill products to disk past this size')
+    sync.add_argument('--shard', type=sharding.parse, metavar='K/N',
+                      help='fetch details for shard K of N only, K counts from 0. Merge the outputs with icecat merge')
+    sync.add_argument('--cache-size', type=int, metavar='MB',
+                      help='size limit of the product xml cache, least recently used xml of other categories first')
+    sync.add_argument('--cache-age', type=float, metavar='DAYS', help='remove cached product xml unused for DAYS')
+    sync.add_argument('--deadline', type=float, metavar='SECONDS',
+                      help='time budget of the product xml downloads, the downloaded products are parsed, '
+                           'the rest is left pending for the next run')
+    sync.add_argument('--gtin-index', metavar='FILE', help='also write the EAN/UPC to product_id lookup index')
+    sync.add_argument('--metrics', metavar='FILE',
+                      help='write run metrics as JSON, - for stdout, progress output then goes to stderr')
+    sync.add_argument('--index-file', help='local index file instead of downloading it')
+    sync.add_argument('--categories-file', help='local CategoriesList file instead of downloading it')
+    sync.add_argument('--suppliers-file', help='local supplier_mapping file instead of downloading it')
+    sync.add_argument('--log-level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'])
+    sync.add_argument('--log-file', help='log to a file instead of stderr')
+
+    merge = commands.add_parser('merge', help='combine the outputs and manifests of sharded sync runs')
+    merge.add_argument('inputs', nargs='+', metavar='INPUT', help='json or ndjson output of a shard')
+    merge.add_argument('-o', '--output', required=True, help='merged output file')
+    merge.add_argument('--format', choices=sorted(export.WRITERS),
+                       help='output format, default from the output file extension')
+    merge.add_argument('--manifest', action='append', metavar='FILE',
+                       help='product xml manifest of a shard, e.g. product_xml/manifest.0-of-4.ndjson. Repeatable')
+    merge.add_argument('--manifest-output', metavar='FILE',
+                       help='merged manifest, default manifest.ndjson next to the first --manifest')
+    merge.add_argument('--log-level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'])
+    merge.add_argument('--log-file', help='log to a file instead of stderr')
+
+    diff = commands.add_parser('diff', help='added, removed and changed products between two index files')
+    diff.add_argument('old', help='earlier index file')
+    diff.add_argument('new', help='later index file')
+    diff.add_argument('-o', '--output', help='write the changes as NDJSON, one change per line')
+    diff.add_argument('--tmp-dir', help='directory of the temporary database, default the system temp directory')
+    diff.add_argument('--log-level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'])
+    diff.add_argument('--log-file', help='log to a file instead of stderr')
+    return parser
+
+
+def _reference(cls, xml_file, args, auth, log):
+    if xml_file:
+        return cls(log=log, xml_file=xml_file, auth=auth, data_dir=args.data_dir)
+    return reference.get_reference(cls, log=log, auth=auth, data_dir=args.data_dir)
+
+
+def sync(args, log):
+    '''
+    Run the index, details and export stages, one after the other. Returns a dict of run metrics.
+
+    :param args: parsed sync arguments
+    :param log: logging.getLogger() instance
+    '''
+    auth = (args.user, args.password)
+    seconds = collections.OrderedDict()
+    started = time.time()
+    # a shard keeps only its own products, each shard needs a snapshot of its own
+    snapshot = args.snapshot or os.path.join(args.data_dir, 'snapshot{}.json'.format(sharding.suffix(args.shard)))
+
+    stage = time.time()
+    categories = _reference(IceCat.IceCatCategoryMapping, args.categories_file, args, auth, log)
+    suppliers = _reference(IceCat.IceCatSupplierMapping, args.suppliers_file, args, auth, log)
+    catalog = IceCat.IceCatCatalog(log=log, auth=auth, data_dir=args.data_dir, xml_file=args.index_file,
+                                   fullcatalog=(args.kind == 'full'), categories=categories, suppliers=suppliers,
+                                   compact=args.compact, parse_workers=args.parse_workers,
+                                   memory_limit=args.memory_limit * 2 ** 20 if args.memory_limit else None,
+                                   snapshot=snapshot if args.incremental and os.path.isfile(snapshot) else None)
+    # without --category every category, the details and the index only output cover the same products
+    catalog.select_categories(categories.get_subtree(args.category) if args.category else None)
+    seconds['index'] = time.time() - stage
+
+    cache_size = args.cache_size * 2 ** 20 if args.cache_size else None
+    cache_age = args.cache_age * 86400 if args.cache_age else None
+    pending = []
+    if not args.no_details:
+        stage = time.time()
+        pending = catalog.add_product_details_parallel(keys=args.key or DEFAULT_KEYS, connections=args.connections,
+                                                       deadline=args.deadline, shard=args.shard,
+                                                       cache_size=cache_size, cache_age=cache_age)
+        seconds['details'] = time.time() - stage
+
+    stage = time.time()
+    if args.changed_only and catalog.changes is not None:
+        # only what changed since the previous run
+        changed = catalog.changed_ids()
+        products = [item for item in catalog.get_data() if item['product_id'] in changed]
+    else:
+        products = catalog.get_data()
+    options = {}
+    if args.format == 'bulk':
+        options = dict(index=args.bulk_index, id_field=args.bulk_id_field, chunk_size=args.bulk_chunk_size * 2 ** 20,
+                       compress=args.gzip)
+        if args.changed_only and catalog.changes is not None and args.bulk_id_field:
+            # products taken off market are deleted from the search index, not indexed again
+            off_market = set(catalog.changes['off_market'])
+            options['deletes'] = [item.get(args.bulk_id_field) for item in products
+                                  if item['product_id'] in off_market]
+            products = [item for item in products if item['product_id'] not in off_market]
+    written = export.write(products, args.output, args.format, **options)
+    if args.incremental:
+        catalog.write_snapshot(snapshot)
+    if args.gtin_index:
+        catalog.write_gtin_index(args.gtin_index)
+    seconds['export'] = time.time() - stage
+    seconds['total'] = time.time() - started
+
+    return collections.OrderedDict([
+        ('kind', args.kind),
+        ('started', time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(started))),
+        ('seconds', seconds),
+        ('products', len(catalog.get_data())),
+        ('written', written),
+        ('output', args.output),
+        ('changes', {k: len(v) for k, v in catalog.changes.items()} if catalog.changes is not None else None),
+        ('pending', len(pending)),
+        ('unchanged', len(getattr(catalog, 'unchanged', []))),
+        ('failed', len(getattr(catalog, 'failed', []))),
+        ('invalid_ean_upcs', catalog.invalid_ean_upcs),
+        ('fetch', getattr(catalog, 'fetch_summary', None)),
+        ('cache', getattr(catalog, 'cache_summary', None)),
+        ('connections', args.connections),
+        ('parse_workers', args.parse_workers),
+        ('shard', '{}/{}'.format(*args.shard) if args.shard else None),
+    ])
+
+
+def main(argv=None):
+    '''
+    Console script entry point
+    '''
+    parser = _parser()
+    args = parser.parse_args(argv)
+    if args.command == 'sync':
+        if not (args.user and args.password):
+            parser.error('IceCat credentials needed: --user and --password, or ICECAT_USER and ICECAT_PASSWORD')
+        args.data_dir = args.data_dir or '_{}_data/'.format(args.kind)
+        if not args.data_dir.endswith('/'):
+            args.data_dir += '/'
+        args.output = args.output or '{}.json'.format(args.kind)
+
+    logging.basicConfig(filename=args.log_file, level=getattr(logging, args.log_level),
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    log = logging.getLogger('IceCat')
+
+    if args.command == 'merge':
+        sharding.merge(args.inputs, args.output, args.format, manifests=args.manifest,
+                       manifest_output=args.manifest_output, log=log)
+        return 0
+    if args.command == 'diff':
+        with index_diff.IndexDiff(args.old, args.new, tmp_dir=args.tmp_dir) as changes:
+            counts = changes.write(args.output) if args.output else changes.counts()
+        log.info("Index diff {} -> {}: {}".format(args.old, args.new, counts))
+        json.dump(counts, sys.stdout, sort_keys=True)
+        sys.stdout.write('\n')
+        return 0
+
+    # with the metrics on stdout the progress output goes to stderr, stdout stays valid JSON
+    with contextlib.redirect_stdout(sys.stderr if args.metrics == '-' else sys.stdout):
+        metrics = sync(args, log)
+    log.info("Synced {} products in {:.1f}s".format(metrics['products'], metrics['seconds']['total']))
+    if args.metrics == '-':
+        json.dump(metrics, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    elif args.metrics:
+        with open(args.metrics, 'w') as f:
+            json.dump(metrics, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,208 @@
+'''
+asyncio client for the IceCat reference, index and product endpoints.
+
+The IceCat classes download and parse in their constructors.  IceCatClient runs
+that blocking work in a thread pool, so an asyncio application can use the
+library without blocking its event loop:
+
+    async with IceCatClient(auth=('icat_user', 'icat_passwd')) as c:
+        categories = await c.categories()
+        details = await c.product_details(['3827', '108912'], keys=['ProductDescription[@ShortDesc]'])
+        async for item in c.iter_products('daily'):
+            ...
+'''
+import asyncio
+import functools
+import logging
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from IceCat import IceCat
+from IceCat import index_parser
+from IceCat import transport as http_transport
+from IceCat import reference
+
+INDEX_FILES = {'daily': 'daily.index.xml', 'full': 'files.index.xml'}
+
+
+class IceCatClient(object):
+    '''
+    Async context manager around the IceCat endpoints. Reference files are downloaded
+    once per client and reused.
+
+    :param auth: Username and password touple, as needed for Ice Cat website authentication
+    :param data_dir: Directory to hold downloaded reference and index files
+    :param connections: Maximum number of simultanious downloads, sizes the thread pool and the connection pool
+    :param log: optional logging.getLogger() instance
+    '''
+
+    def __init__(self, auth=('user', 'passwd'), data_dir='_data/', connections=20, log=None):
+        self.auth = auth
+        self.data_dir = data_dir
+        self.connections = connections
+        self.log = log or logging.getLogger()
+        self.transport = None
+        self._executor = None
+        self._semaphore = None
+        self._references = {}
+
+    async def __aenter__(self):
+        self._executor = ThreadPoolExecutor(max_workers=self.connections)
+        self._semaphore = asyncio.Semaphore(self.connections)
+        self.transport = http_transport.get_transport(self.auth, self.connections)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._executor.shutdown(wait=False)
+        self._executor = None
+
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    async def _reference(self, cls, xml_file):
+        if cls not in self._references:
+            if xml_file:
+                load = self._run(cls, log=self.log, xml_file=xml_file, auth=self.auth, data_dir=self.data_dir,
+                                 transport=self.transport)
+            else:
+                # shared with every other client and catalog in the process
+                load = self._run(reference.get_reference, cls, log=self.log, auth=self.auth, data_dir=self.data_dir,
+                                 transport=self.transport)
+            self._references[cls] = asyncio.ensure_future(load)
+        try:
+            return await self._references[cls]
+        except Exception:
+            if cls is not IceCat.IceCatSupplierMapping:
+                raise
+            # as in IceCatCatalog, products are still listed, without supplier names
+            self.log.warning("Unable to load supplier mapping, supplier names will not be resolved: {}".format(
+                sys.exc_info()))
+            return None
+
+    async def categories(self, xml_file=None):
+        '''
+        Return the IceCatCategoryMapping. Downloaded on first call, then reused.
+
+        :param xml_file: optional local CategoriesList file
+        '''
+        return await self._reference(IceCat.IceCatCategoryMapping, xml_file)
+
+    async def suppliers(self, xml_file=None):
+        '''
+        Return the IceCatSupplierMapping. Downloaded on first call, then reused.
+        None when it could not be loaded, supplier names are not resolved then.
+
+        :param xml_file: optional local supplier_mapping file
+        '''
+        return await self._reference(IceCat.IceCatSupplierMapping, xml_file)
+
+    async def index(self, kind='daily', **kwargs):
+        '''
+        Download and parse a product index. Returns an IceCatCatalog.
+
+        :param kind: 'daily' or 'full'
+        :param kwargs: additional IceCatCatalog arguments, e.g. xml_file, compact, parse_workers
+        '''
+        self._check_kind(kind)
+        categories, suppliers = await asyncio.gather(self.categories(), self.suppliers())
+        return await self._run(IceCat.IceCatCatalog, log=self.log, auth=self.auth, data_dir=self.data_dir,
+                               transport=self.transport, fullcatalog=(kind == 'full'),
+                               categories=categories, suppliers=suppliers, **kwargs)
+
+    @staticmethod
+    def _check_kind(kind):
+        if kind not in INDEX_FILES:
+            raise ValueError("kind must be 'daily' or 'full', not {!r}".format(kind))
+
+    def _download_index(self, kind):
+        local_file = self.data_dir + INDEX_FILES[kind]
+        self.log.info("Downloading {} index".format(kind))
+        if not IceCat.fetch_file(self.transport, IceCat.IceCatCatalog.baseurl + INDEX_FILES[kind], local_file,
+                                 self.log):
+            raise IOError("Could not download the {} index".format(kind))
+        return local_file
+
+    async def iter_products(self, kind='daily', xml_file=None, exclude_keys=['Country_Markets'], batch=1000):
+        '''
+        Async iterator over the products of an index, yielded as the index is parsed, with category and
+        supplier names resolved. The catalog is never held in memory, use index() for an IceCatCatalog.
+
+        :param kind: 'daily' or 'full'
+        :param xml_file: optional local index file, may be gzipped. Downloaded to data_dir when None.
+        :param exclude_keys: a list of keys to omit from the products
+        :param batch: number of products handed from the parsing thread to the event loop at a time
+        '''
+        self._check_kind(kind)
+        categories, suppliers = await asyncio.gather(self.categories(), self.suppliers())
+        if xml_file is None:
+            xml_file = await self._run(self._download_index, kind)
+        titles = categories.get_titles()
+        names = suppliers.id_map if suppliers else {}
+
+        loop = asyncio.get_running_loop()
+        # a few batches in flight, the parser waits for a slow consumer
+        queue = asyncio.Queue(maxsize=4)
+        stop = threading.Event()
+
+        def put(products):
+            asyncio.run_coroutine_threadsafe(queue.put(products), loop).result()
+
+        def parse():
+            try:
+                products = []
+                for item in index_parser.iter_index(xml_file, exclude_keys):
+                    if item.get('catid') in titles:
+                        item['category'] = titles[item['catid']]
+                    if item.get('supplier_id') in names:
+                        item['supplier'] = names[item['supplier_id']]
+                    products.append(item)
+                    if len(products) == batch:
+                        put(products)
+                        products = []
+                        if stop.is_set():
+                            return
+                put(products)
+            finally:
+                if not stop.is_set():
+                    put(None)
+
+        producer = loop.run_in_executor(self._executor, parse)
+        try:
+            while True:
+                products = await queue.get()
+                if products is None:
+                    break
+                for item in products:
+                    yield item
+            # parse errors surface here
+            await producer
+        finally:
+            # the consumer stopped early, unblock and end the parsing thread
+            stop.set()
+            while not producer.done():
+                while not queue.empty():
+                    queue.get_nowait()
+                await asyncio.wait([producer], timeout=0.01)
+
+    async def _product(self, product_id, keys):
+        async with self._semaphore:
+            try:
+                return await self._run(IceCat.IceCatProductDetails.fetch, product_id, keys, self.transport, self.log)
+            except Exception as e:
+                self.log.error("Could not obtain product details from IceCat for product_id {}: {}".format(
+                    product_id, e))
+                return None
+
+    async def product_details(self, ids, keys=['ProductDescription']):
+        '''
+        Fetch product details for a list of product ids concurrently.
+        Returns a dict of product id to a dict of detail keys, or None when the product could not be fetched.
+
+        :param ids: list of product ids
+        :param keys: List of Ice Cat product detail XML keys. Refer to Basic Usage Example.
+        '''
+        ids = list(ids)
+        results = await asyncio.gather(*[self._product(product_id, keys) for product_id in ids])
+        return dict(zip(ids, results))
@@ -0,0 +1,448 @@
+'''
+Compact, column oriented storage for catalog index products.
+
+A full catalog parsed into one dict per product spends most of its memory on
+dict and string overhead.  CompactCatalog keeps the fixed index fields and the
+common detail fields in typed arrays, dictionary encoded string columns and
+offset encoded list columns, and hands out light weight CompactRow views that
+behave like the original product dicts.
+'''
+from array import array
+import collections.abc
+
+# sentinel for a missing value in integer columns
+MISSING = -2 ** 63
+
+
+class _IntColumn(object):
+    '''
+    Integer column, values are stored as 64-bit signed ints.
+    Only values that survive a str -> int -> str round trip are accepted,
+    anything else is left to the row overflow dict.
+    '''
+    def __init__(self, data=None):
+        self.data = data if data is not None else array('q')
+
+    def _encode(self, value):
+        if isinstance(value, str) and value.isdigit() and str(int(value)) == value:
+            return int(value)
+        return None
+
+    def append(self, value):
+        v = self._encode(value)
+        if v is None:
+            self.data.append(MISSING)
+            return False
+        self.data.append(v)
+        return True
+
+    def set(self, i, value):
+        v = self._encode(value)
+        if v is None:
+            self.data[i] = MISSING
+            return False
+        self.data[i] = v
+        return True
+
+    def raw(self, i):
+        return self.data[i]
+
+    def get(self, i):
+        v = self.data[i]
+        if v == MISSING:
+            return None
+        return str(v)
+
+    def clear(self, i):
+        self.data[i] = MISSING
+
+    def take(self, indices):
+        data = self.data
+        return _IntColumn(array('q', (data[i] for i in indices)))
+
+
+class _EncodedColumn(object):
+    '''
+    Dictionary encoded string column for low cardinality values
+    (quality, category, supplier ...).  Code 0 means missing.
+    '''
+    def __init__(self, codes=None, values=None):
+        self.codes = codes if codes is not None else array('L')
+        self.values = values if values is not None else [None]
+        self.index = {v: i for i, v in enumerate(self.values) if i}
+
+    def _encode(self, value):
+        if not isinstance(value, str):
+            return None
+        code = self.index.get(value)
+        if code is None:
+            code = len(self.values)
+            self.values.append(value)
+            self.index[value] = code
+        return code
+
+    def append(self, value):
+        code = self._encode(value)
+        if code is None:
+            self.codes.append(0)
+            return False
+        self.codes.append(code)
+        return True
+
+    def set(self, i, value):
+        code = self._encode(value)
+        if code is None:
+            self.codes[i] = 0
+            return False
+        self.codes[i] = code
+        return True
+
+    def raw(self, i):
+        return self.codes[i]
+
+    def get(self, i):
+        return self.values[self.codes[i]]
+
+    def clear(self, i):
+        self.codes[i] = 0
+
+    def take(self, indices):
+        codes = self.codes
+        return _EncodedColumn(array('L', (codes[i] for i in indices)), list(self.values))
+
+
+class _StrColumn(object):
+    '''
+    Plain string column for high cardinality values (paths, model names ...).
+    '''
+    def __init__(self, data=None):
+        self.data = data if data is not None else []
+
+    def append(self, value):
+        if not isinstance(value, str):
+            self.data.append(None)
+            return False
+        self.data.append(value)
+        return True
+
+    def set(self, i, value):
+        if not isinstance(value, str):
+            self.data[i] = None
+            return False
+        self.data[i] = value
+        return True
+
+    def raw(self, i):
+        return self.data[i]
+
+    def get(self, i):
+        return self.data[i]
+
+    def clear(self, i):
+        self.data[i] = None
+
+    def take(self, indices):
+        data = self.data
+        return _StrColumn([data[i] for i in indices])
+
+
+class _ListColumn(object):
+    '''
+    Column of str lists (EAN/UPC codes, manufacturer product codes ...).  The strings of all rows are
+    kept in one flat list, offsets holds where each row starts.  A single str value is stored as a
+    one element row, kinds tells a str from a list and marks missing values.
+    '''
+    MISSING, STR, LIST = 0, 1, 2
+
+    def __init__(self, offsets=None, values=None, kinds=None):
+        self.offsets = offsets if offsets is not None else array('Q', [0])
+        self.values = values if values is not None else []
+        self.kinds = kinds if kinds is not None else bytearray()
+
+    def _encode(self, value):
+        if isinstance(value, str):
+            return self.STR, [value]
+        if isinstance(value, list) and all(isinstance(v, str) for v in value):
+            return self.LIST, value
+        return self.MISSING, None
+
+    def append(self, value):
+        kind, items = self._encode(value)
+        if items is not None:
+            self.values.extend(items)
+        self.offsets.append(len(self.values))
+        self.kinds.append(kind)
+        return kind != self.MISSING
+
+    def set(self, i, value):
+        kind, items = self._encode(value)
+        start, end = self.offsets[i], self.offsets[i + 1]
+        if items is None or len(items) != end - start:
+            # a row can not grow or shrink in place
+            self.kinds[i] = self.MISSING
+            return False
+        self.values[start:end] = items
+        self.kinds[i] = kind
+        return True
+
+    def raw(self, i):
+        return self.kinds[i], tuple(self.values[self.offsets[i]:self.offsets[i + 1]])
+
+    def get(self, i):
+        kind = self.kinds[i]
+        if kind == self.MISSING:
+            return None
+        if kind == self.STR:
+            return self.values[self.offsets[i]]
+        return self.values[self.offsets[i]:self.offsets[i + 1]]
+
+    def clear(self, i):
+        self.kinds[i] = self.MISSING
+
+    def take(self, indices):
+        column = _ListColumn()
+        for i in indices:
+            column.append(self.get(i))
+        return column
+
+
+class CompactRow(collections.abc.MutableMapping):
+    '''
+    Dict-like view of a single product in a CompactCatalog.
+    Reads and writes go straight to the catalog columns, keys that have no
+    column (product details, nested structures) are kept in a per row overflow dict.
+    '''
+    __slots__ = ('_catalog', '_index')
+
+    def __init__(self, catalog, index):
+        self._catalog = catalog
+        self._index = index
+
+    def __getitem__(self, key):
+        extra = self._catalog._extra.get(self._index)
+        if extra and key in extra:
+            return extra[key]
+        column = self._catalog._columns.get(key)
+        if column is not None:
+            value = column.get(self._index)
+            if value is not None:
+                return value
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        self._catalog._set(self._index, key, value)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._catalog._delete(self._index, key)
+
+    def __iter__(self):
+        # keys in the order a product dict gets them: index columns, overflow keys, then the detail and joined columns
+        i = self._index
+        extra = self._catalog._extra.get(i, {})
+        late = self._catalog._late
+        for key, column in self._catalog._columns.items():
+            if key not in extra and key not in late and column.get(i) is not None:
+                yield key
+        for key in extra:
+            yield key
+        for key in late:
+            if key not in extra and self._catalog._columns[key].get(i) is not None:
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return 'CompactRow({!r})'.format(dict(self))
+
+
+class CompactCatalog(collections.abc.Sequence):
+    '''
+    Memory efficient replacement for the list of product dicts built by IceCatCatalog.
+
+    Items are CompactRow views, so existing code that indexes, iterates or
+    updates products keeps working.  The typed columns can be reached with column()
+    for bulk operations, e.g. numpy.frombuffer(catalog.column('catid'), dtype='int64').
+    Values that do not fit their column, and keys without a column, are kept in a per row overflow dict.
+
+    :param columns: optional ordered list of (key, kind) tuples, kind is one of 'int', 'enum', 'str', 'list'.
+                    Defaults to the IceCat index attributes and the common product detail fields.
+    '''
+
+    COLUMNS = [
+        ('path', 'str'),
+        ('product_id', 'int'),
+        ('updated', 'int'),
+        ('quality', 'enum'),
+        ('supplier_id', 'int'),
+        ('prod_id', 'str'),
+        ('catid', 'int'),
+        ('on_market', 'int'),
+        ('model_name', 'str'),
+        ('product_view', 'int'),
+        ('highpic', 'str'),
+        ('highpicsize', 'int'),
+        ('highpicwidth', 'int'),
+        ('highpicheight', 'int'),
+        ('date_added', 'int'),
+        ('m_prod_id', 'list'),
+        ('ean_upcs', 'list'),
+        ('name', 'str'),
+        ('title', 'str'),
+        ('release_date', 'str'),
+        ('category', 'enum'),
+        ('supplier', 'enum'),
+    ]
+
+    # columns set from the product xml, after the index fields. Rows list them after the overflow keys
+    DETAILS = ('name', 'title', 'release_date')
+
+    _kinds = {
+        'int': _IntColumn,
+        'enum': _EncodedColumn,
+        'str': _StrColumn,
+        'list': _ListColumn,
+    }
+
+    def __init__(self, columns=None):
+        self._size = 0
+        self._extra = {}
+        # columns filled by join(), after parsing, in join order
+        self._joined = []
+        self._columns = collections.OrderedDict()
+        for key, kind in (columns or self.COLUMNS):
+            self._columns[key] = self._kinds[kind]()
+        # columns rows list after the overflow keys: the detail columns, then the joined ones
+        self._late = [key for key in self.DETAILS if key in self._columns]
+
+    def append(self, item):
+        '''
+        Add a product. Values that do not fit a typed column are kept as is.
+
+        :param item: product dict as produced by the index parser
+        '''
+        i = self._size
+        extra = {}
+        for key, column in self._columns.items():
+            value = item.get(key)
+            if not column.append(value) and value is not None:
+                extra[key] = value
+        for key, value in item.items():
+            if key not in self._columns:
+                extra[key] = value
+        if extra:
+            self._extra[i] = extra
+        self._size += 1
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+
+    def _set(self, i, key, value):
+        column = self._columns.get(key)
+        extra = self._extra.get(i)
+        if column is not None and column.set(i, value):
+            if extra and key in extra:
+                del extra[key]
+            return
+        self._extra.setdefault(i, {})[key] = value
+
+    def _delete(self, i, key):
+        column = self._columns.get(key)
+        if column is not None:
+            column.clear(i)
+        extra = self._extra.get(i)
+        if extra and key in extra:
+            del extra[key]
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [CompactRow(self, j) for j in range(*i.indices(self._size))]
+        if i < 0:
+            i += self._size
+        if not 0 <= i < self._size:
+            raise IndexError('CompactCatalog index out of range')
+        return CompactRow(self, i)
+
+    def __iter__(self):
+        for i in range(self._size):
+            yield CompactRow(self, i)
+
+    def column(self, key):
+        '''
+        Return the raw storage of a column: array('q') for int columns (missing values are
+        MISSING), array('L') of codes for enum columns, a list of str, or for list columns
+        a tuple of the array('Q') of row offsets and the flat list of str.
+
+        :param key: column name
+        '''
+        column = self._columns[key]
+        if isinstance(column, _EncodedColumn):
+            return column.codes
+        if isinstance(column, _ListColumn):
+            return column.offsets, column.values
+        return column.data
+
+    def join(self, source, target, table):
+        '''
+        Fill column target by looking up the values of column source in table.
+        Each distinct source value is looked up once.  Returns a Counter of the
+        source values that had no match in table.
+
+        :param source: key of the column to join on, e.g. 'catid'
+        :param target: key to set, e.g. 'category'
+        :param table: dict of source value (str) to target value
+        '''
+        src = self._columns[source]
+        if target in self._columns and target not in self._joined:
+            self._joined.append(target)
+            self._late = [key for key in self._late if key != target] + [target]
+        resolved = {}
+        missing = collections.Counter()
+        for i in range(self._size):
+            extra = self._extra.get(i)
+            if extra and source in extra:
+                value = extra[source]
+                name = table.get(value) if isinstance(value, str) else None
+            else:
+                raw = src.raw(i)
+                if raw in resolved:
+                    value, name = resolved[raw]
+                else:
+                    value = src.get(i)
+                    name = table.get(value)
+                    resolved[raw] = value, name
+            if name is None:
+                missing[value] += 1
+            else:
+                self._set(i, target, name)
+        return missing
+
+    def filter(self, predicate):
+        '''
+        Return a new CompactCatalog holding only the products for which predicate(row) is true
+
+        :param predicate: callable receiving a CompactRow
+        '''
+        indices = [i for i in range(self._size) if predicate(CompactRow(self, i))]
+        selected = CompactCatalog(columns=[])
+        selected._joined = list(self._joined)
+        selected._late = list(self._late)
+        for key, column in self._columns.items():
+            selected._columns[key] = column.take(indices)
+        for new, old in enumerate(indices):
+            if old in self._extra:
+                selected._extra[new] = dict(self._extra[old])
+        selected._size = len(indices)
+        return selected
+
+    def to_list(self):
+        '''
+        Return products as a list of plain dicts
+        '''
+        return [dict(row) for row in self]
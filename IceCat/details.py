@@ -0,0 +1,267 @@
+'''
+Schema driven product detail extraction.
+
+DetailExtractor reads a product XML in one streaming pass and returns the
+classic detail keys (same rules as IceCatProductDetails) together with repeated
+sub-structures - product features, gallery pictures, bullet points, related
+products - as lists of typed records.  Sections are requested by name in the
+detail key list, e.g.
+
+    keys = ['ProductDescription[@ShortDesc]', 'ShortSummaryDescription', 'features', 'gallery']
+'''
+import re
+import collections
+
+from IceCat import xml_backend
+
+# Feature names are taken in English only, same as the category names
+LANGID = '1'
+
+
+class Record(object):
+    '''
+    Base class of the typed section records. Fields are reachable as attributes and by key.
+    '''
+    __slots__ = ()
+    _fields = ()
+
+    def __init__(self, *args, **kwargs):
+        values = dict(zip(self._fields, args))
+        values.update(kwargs)
+        for field in self._fields:
+            setattr(self, field, values.get(field))
+
+    def __getitem__(self, key):
+        if key not in self._fields:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def keys(self):
+        return self._fields
+
+    def _asdict(self):
+        return collections.OrderedDict((field, getattr(self, field)) for field in self._fields)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self._asdict() == other._asdict()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__,
+                               ', '.join('{}={!r}'.format(f, getattr(self, f)) for f in self._fields))
+
+
+def record_type(name, fields):
+    '''
+    Create a Record class with __slots__ for the given field names
+    '''
+    return type(name, (Record,), {'__slots__': tuple(fields), '_fields': tuple(fields)})
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_bool(value):
+    if value is None:
+        return None
+    return value not in ('0', '', 'false', 'N')
+
+
+def _to_str(value):
+    return value
+
+
+_converters = {int: _to_int, float: _to_float, bool: _to_bool, str: _to_str}
+
+
+class Section(object):
+    '''
+    One repeated sub-structure of the product XML.
+
+    :param name: output key, also the name used in the detail key list
+    :param tag: tag of the element holding one record
+    :param fields: list of (field name, path, type) tuples. path is '@Attr' for an attribute of the record
+                   element, 'Child/Path' for the text of a descendant, 'Child/Path/@Attr' for an attribute of
+                   a descendant, '.' for the record element text. Alternatives are separated by '|', the first
+                   one found wins. type is str, int, float or bool.
+    :param record: optional class name of the records
+    '''
+    def __init__(self, name, tag, fields, record=None):
+        self.name = name
+        self.tag = tag
+        self.fields = []
+        for field, path, kind in fields:
+            alternatives = []
+            for alternative in path.split('|'):
+                if '@' in alternative:
+                    where, attr = alternative.rsplit('@', 1)
+                    where = where.rstrip('/') or None
+                else:
+                    where, attr = alternative, None
+                alternatives.append((where if where != '.' else None, attr))
+            self.fields.append((field, alternatives, _converters[kind]))
+        self.record = record_type(record or tag, [field for field, path, kind in fields])
+
+    def build(self, elem):
+        '''
+        Build a record from a complete record element
+        '''
+        values = []
+        for field, alternatives, convert in self.fields:
+            value = None
+            for where, attr in alternatives:
+                node = elem if where is None else elem.find(where)
+                if node is None:
+                    continue
+                value = node.get(attr) if attr else (node.text or '').strip() or None
+                if value is not None:
+                    break
+            values.append(convert(value))
+        return self.record(*values)
+
+
+SECTIONS = [
+    Section('features', 'ProductFeature', [
+        ('id', '@ID', int),
+        ('feature_id', 'Feature/@ID', int),
+        ('name', "Feature/Name[@langid='" + LANGID + "']/@Value", str),
+        ('group_id', '@CategoryFeatureGroup_ID', int),
+        ('no', '@No', int),
+        ('value', '@Value', str),
+        ('presentation_value', '@Presentation_Value', str),
+        ('sign', 'Feature/Measure/@Sign', str),
+        ('searchable', '@Searchable', bool),
+    ]),
+    Section('gallery', 'ProductPicture', [
+        ('id', '@ProductPicture_ID', int),
+        ('no', '@No', int),
+        ('pic', '@Pic', str),
+        ('width', '@PicWidth', int),
+        ('height', '@PicHeight', int),
+        ('size', '@Size', int),
+        ('thumb', '@ThumbPic', str),
+    ]),
+    Section('bullets', 'BulletPoint', [
+        ('no', '@No', int),
+        ('value', '@Value|.', str),
+    ]),
+    Section('related', 'ProductRelated', [
+        ('id', '@ID', int),
+        ('product_id', 'Product/@ID', int),
+        ('prod_id', 'Product/@Prod_id', str),
+        ('name', 'Product/@Name', str),
+        ('category_id', '@Category_ID', int),
+        ('supplier', 'Product/Supplier/@Name', str),
+        ('preferred', '@Preferred', bool),
+    ]),
+]
+
+
+class DetailExtractor(object):
+    '''
+    Extract detail keys and sections from product XML documents in one streaming pass.
+
+    :param keys: a list of product detail keys, refer to Basic Usage Example, and section names
+    :param sections: list of available Section definitions, defaults to SECTIONS
+    '''
+    def __init__(self, keys, sections=None):
+        available = collections.OrderedDict((section.name, section) for section in (sections or SECTIONS))
+        self.keys = [key for key in keys if key not in available]
+        self.sections = [available[key] for key in keys if key in available]
+        self._by_tag = {section.tag: section for section in self.sections}
+
+        # 'Tag[@Attr]' keys match the first grandchild of the root element
+        self._attr_keys = []
+        for key in self.keys:
+            if '@' in key:
+                self._attr_keys.append((key, key[:key.index('[')], key[key.index('@') + 1:key.rindex(']')]))
+        self._plain = set(key for key in self.keys if '@' not in key)
+
+    def extract(self, source):
+        '''
+        Return a dict of lower cased detail keys to values, and section names to lists of records.
+
+        :param source: file name or binary file object of a product XML
+        '''
+        attr_values = {}
+        plain_updates = collections.defaultdict(list)
+        records = collections.OrderedDict((section.name, []) for section in self.sections)
+        started = {}
+        depth = 0
+        seq = 0
+        open_records = 0
+
+        for event, elem in xml_backend.iterparse(source, events=('start', 'end')):
+            tag = elem.tag
+            if event == 'start':
+                if depth == 2:
+                    for key, key_tag, attr in self._attr_keys:
+                        if key not in attr_values and tag == key_tag and attr in elem.attrib:
+                            attr_values[key] = (attr.lower(), elem.attrib[attr])
+                if tag in self._plain:
+                    started[elem] = seq
+                    seq += 1
+                if tag in self._by_tag:
+                    open_records += 1
+                depth += 1
+                continue
+
+            depth -= 1
+            if tag in self._plain:
+                if re.findall(r'\w+', elem.text or ''):
+                    update = [(tag.lower(), elem.text)]
+                else:
+                    update = [(name.lower(), value) for name, value in elem.attrib.items()]
+                plain_updates[tag].append((started.pop(elem), update))
+            section = self._by_tag.get(tag)
+            if section is not None:
+                records[section.name].append(section.build(elem))
+                open_records -= 1
+            if not open_records:
+                # nothing below this element is needed any more
+                elem.clear()
+
+        # apply in key order, matches within a key in document order, later ones win
+        o = {}
+        for key in self.keys:
+            if '@' in key:
+                if key in attr_values:
+                    name, value = attr_values[key]
+                    o[name] = value
+            else:
+                for position, update in sorted(plain_updates.get(key, [])):
+                    o.update(update)
+        o.update(records)
+        return o
+
+    def restore(self, o):
+        '''
+        Turn section lists of plain dicts, e.g. loaded from JSON, back into records. Changes o in place.
+        '''
+        for section in self.sections:
+            if section.name in o:
+                o[section.name] = [item if isinstance(item, Record) else section.record(**item)
+                                   for item in o[section.name]]
+        return o
+
+
+def json_default(obj):
+    '''
+    json.dumps default hook for section records
+    '''
+    if isinstance(obj, Record):
+        return obj._asdict()
+    raise TypeError('{!r} is not JSON serializable'.format(obj))
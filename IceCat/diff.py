@@ -0,0 +1,143 @@
+'''
+Diff of two product index files, e.g. yesterday's and today's files.index.xml.
+
+Both indexes are streamed with index_parser.iter_index() into a temporary
+SQLite database keyed by product_id, the join of the two tables gives the
+changes in product_id order.  Memory use does not depend on the index size.
+
+    with diff.IndexDiff('yesterday.index.xml', 'today.index.xml') as changes:
+        for change in changes:
+            ...  # {'change': 'changed', 'product_id': '3827', 'fields': ['updated'], 'old': {...}, 'new': {...}}
+        changes.counts()  # {'added': 1, 'removed': 0, 'changed': 2}
+'''
+import json
+import os
+import sqlite3
+import tempfile
+
+from IceCat import index_parser
+
+CHANGES = ('added', 'removed', 'changed')
+
+
+def _remove(filename):
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
+
+
+class IndexDiff(object):
+    '''
+    Added, removed and changed products between two index files.
+
+    :param old_file: earlier index file
+    :param new_file: later index file
+    :param exclude_keys: a list of keys to omit from the compared products, as IceCatCatalog
+    :param tmp_dir: directory of the temporary database, default the system temp directory
+    :param batch: number of products inserted at a time
+    '''
+
+    def __init__(self, old_file, new_file, exclude_keys=['Country_Markets'], tmp_dir=None, batch=10000):
+        fd, self._filename = tempfile.mkstemp(suffix='.diff.sqlite', dir=tmp_dir)
+        os.close(fd)
+        self._db = sqlite3.connect(self._filename)
+        self._db.execute('PRAGMA journal_mode=OFF')
+        self._db.execute('PRAGMA synchronous=OFF')
+        self.batch = batch
+        try:
+            for table, xml_file in (('old', old_file), ('new', new_file)):
+                self._load(table, index_parser.iter_index(xml_file, exclude_keys))
+        except:
+            self.close()
+            raise
+
+    def _load(self, table, products):
+        self._db.execute('CREATE TABLE {} (product_id TEXT PRIMARY KEY, data TEXT)'.format(table))
+        insert = 'INSERT OR REPLACE INTO {} VALUES (?, ?)'.format(table)
+        rows = []
+        for item in products:
+            if 'product_id' not in item:
+                continue
+            rows.append((item['product_id'], json.dumps(item, sort_keys=True)))
+            if len(rows) == self.batch:
+                self._db.executemany(insert, rows)
+                rows = []
+        self._db.executemany(insert, rows)
+        self._db.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def added(self):
+        '''
+        Iterate the product ids only in the new index
+        '''
+        for row in self._db.execute('SELECT n.product_id FROM new n LEFT JOIN old o USING (product_id) '
+                                    'WHERE o.product_id IS NULL ORDER BY n.product_id'):
+            yield row[0]
+
+    def removed(self):
+        '''
+        Iterate the product ids only in the old index
+        '''
+        for row in self._db.execute('SELECT o.product_id FROM old o LEFT JOIN new n USING (product_id) '
+                                    'WHERE n.product_id IS NULL ORDER BY o.product_id'):
+            yield row[0]
+
+    def changed(self):
+        '''
+        Iterate (product_id, fields, old product, new product) of the products in both indexes that differ.
+        fields are the keys with a different value, e.g. ['catid', 'updated'] for a category move.
+        '''
+        for product_id, old, new in self._db.execute(
+                'SELECT o.product_id, o.data, n.data FROM old o JOIN new n USING (product_id) '
+                'WHERE o.data != n.data ORDER BY o.product_id'):
+            old, new = json.loads(old), json.loads(new)
+            fields = sorted(key for key in set(old) | set(new) if old.get(key) != new.get(key))
+            yield product_id, fields, old, new
+
+    def __iter__(self):
+        '''
+        Iterate the changes as dicts: change (one of CHANGES), product_id, and for changed products
+        the differing fields with their old and new values
+        '''
+        for product_id in self.added():
+            yield {'change': 'added', 'product_id': product_id}
+        for product_id in self.removed():
+            yield {'change': 'removed', 'product_id': product_id}
+        for product_id, fields, old, new in self.changed():
+            yield {'change': 'changed', 'product_id': product_id, 'fields': fields,
+                   'old': {key: old.get(key) for key in fields}, 'new': {key: new.get(key) for key in fields}}
+
+    def counts(self):
+        '''
+        Return the number of added, removed and changed products
+        '''
+        return {
+            'added': sum(1 for i in self.added()),
+            'removed': sum(1 for i in self.removed()),
+            'changed': self._db.execute('SELECT COUNT(*) FROM old o JOIN new n USING (product_id) '
+                                        'WHERE o.data != n.data').fetchone()[0],
+        }
+
+    def write(self, filename):
+        '''
+        Write the changes as NDJSON, one change per line. Returns the counts of the changes written.
+        '''
+        counts = dict.fromkeys(CHANGES, 0)
+        with open(filename, 'w') as f:
+            for change in self:
+                f.write(json.dumps(change))
+                f.write('\n')
+                counts[change['change']] += 1
+        return counts
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+            _remove(self._filename)
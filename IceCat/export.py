@@ -0,0 +1,286 @@
+'''
+Output writers for catalog products.
+
+Every writer takes an iterable of product dicts (a list, CompactCatalog or
+SpillCatalog) and a file name, and streams the products one at a time.
+Nested values (ean_upcs lists, detail sections) are kept as JSON in the
+column based formats.  read_products() streams a JSON or NDJSON output back,
+one product at a time.
+
+    export.write(catalog.get_data(), 'daily.ndjson', 'ndjson')
+    export.write(catalog.get_data(), 'bulk/daily.ndjson.gz', 'bulk', index='products')
+'''
+import collections.abc
+import gzip
+import json
+import os
+import re
+import sqlite3
+
+from IceCat import details as detail_schema
+
+
+def json_default(obj):
+    '''
+    json.dumps default hook for product records
+    '''
+    # features, gallery ... section records
+    if isinstance(obj, detail_schema.Record):
+        return obj._asdict()
+    # CompactRow, SpilledRow, LazyProduct and other dict-like records
+    if isinstance(obj, collections.abc.Mapping):
+        return dict(obj)
+    # CompactCatalog and other product sequences
+    return list(obj)
+
+
+def _columns(products):
+    # union of the product keys, in first seen order
+    columns = collections.OrderedDict()
+    for item in products:
+        for key in item:
+            columns[key] = None
+    return list(columns)
+
+
+def _cell(value):
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value, default=json_default)
+
+
+def write_json(products, filename):
+    '''
+    Write a JSON array, same layout as IceCatCatalog.dump_to_file()
+    '''
+    with open(filename, 'w') as f:
+        f.write('[')
+        count = 0
+        for item in products:
+            f.write(',\n  ' if count else '\n  ')
+            f.write(json.dumps(item, indent=2, default=json_default).replace('\n', '\n  '))
+            count += 1
+        f.write('\n]' if count else ']')
+    return count
+
+
+def write_ndjson(products, filename):
+    '''
+    Write one JSON object per line
+    '''
+    count = 0
+    with open(filename, 'w') as f:
+        for item in products:
+            f.write(json.dumps(item, default=json_default))
+            f.write('\n')
+            count += 1
+    return count
+
+
+def _json_array(f, chunk=2 ** 20):
+    # the items of a JSON array, decoded as they are read, the array is never in memory as a whole
+    decoder = json.JSONDecoder()
+    buffer = f.read(chunk).lstrip()
+    if not buffer.startswith('['):
+        raise ValueError("{} is not a JSON array".format(f.name))
+    pos = 1
+    eof = False
+    while True:
+        while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+            pos += 1
+        if pos < len(buffer) and buffer[pos] == ']':
+            return
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+        except ValueError:
+            # an item spans the end of the buffer
+            if eof:
+                raise
+            data = f.read(chunk)
+            eof = not data
+            buffer = buffer[pos:] + data
+            pos = 0
+            continue
+        yield item
+        pos = end
+
+
+def read_products(filename):
+    '''
+    Stream the products of a JSON array or NDJSON file, e.g. written by write_json(), write_ndjson() or
+    IceCatCatalog.dump_to_file()
+    '''
+    with open(filename, 'r') as f:
+        first = f.read(1)
+        while first.isspace():
+            first = f.read(1)
+        f.seek(0)
+        if first == '[':
+            yield from _json_array(f)
+            return
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def write_sqlite(products, filename, table='products'):
+    '''
+    Write a SQLite table with one TEXT column per product key. An existing table is replaced.
+    '''
+    columns = _columns(products)
+    db = sqlite3.connect(filename)
+    try:
+        db.execute('DROP TABLE IF EXISTS "{}"'.format(table))
+        db.execute('CREATE TABLE "{}" ({})'.format(table, ', '.join('"{}" TEXT'.format(c) for c in columns)))
+        insert = 'INSERT INTO "{}" ({}) VALUES ({})'.format(table, ', '.join('"{}"'.format(c) for c in columns),
+                                                            ', '.join('?' for c in columns))
+        count = 0
+        for item in products:
+            db.execute(insert, [_cell(item.get(c)) for c in columns])
+            count += 1
+        if 'product_id' in columns:
+            db.execute('CREATE INDEX "{0}_product_id" ON "{0}" (product_id)'.format(table))
+        db.commit()
+    finally:
+        db.close()
+    return count
+
+
+def write_parquet(products, filename, batch=10000):
+    '''
+    Write a Parquet file with one string column per product key. Needs pyarrow.
+    '''
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Parquet output needs pyarrow, pip install pyarrow")
+
+    columns = _columns(products)
+    schema = pyarrow.schema([(c, pyarrow.string()) for c in columns])
+    count = 0
+    with pyarrow.parquet.ParquetWriter(filename, schema) as writer:
+        rows = []
+        for item in products:
+            rows.append(item)
+            if len(rows) == batch:
+                writer.write_table(_table(pyarrow, schema, columns, rows))
+                count += len(rows)
+                rows = []
+        if rows or not count:
+            writer.write_table(_table(pyarrow, schema, columns, rows))
+            count += len(rows)
+    return count
+
+
+def _table(pyarrow, schema, columns, rows):
+    return pyarrow.Table.from_arrays([pyarrow.array([_cell(item.get(c)) for item in rows], pyarrow.string())
+                                      for c in columns], schema=schema)
+
+
+class _BulkChunks(object):
+    # numbered chunk files of at most chunk_size bytes, <base>.0000<ext>, <base>.0001<ext> ...
+    def __init__(self, filename, chunk_size, compress):
+        self.base, self.ext = os.path.splitext(filename[:-3] if filename.endswith('.gz') else filename)
+        self.chunk_size = chunk_size
+        self.compress = compress or filename.endswith('.gz')
+        self.files = []
+        self._f = None
+        self._size = 0
+        self._clear()
+
+    def _clear(self):
+        # chunks of an earlier run into the same name, compressed or not, would be posted with the new ones
+        directory, prefix = os.path.split(self.base)
+        pattern = re.compile(re.escape(prefix) + r'\.\d{4}' + re.escape(self.ext) + r'(\.gz)?$')
+        for name in os.listdir(directory or '.'):
+            if pattern.match(name):
+                os.remove(os.path.join(directory, name))
+
+    def write(self, data):
+        if self._f is None or (self._size and self._size + len(data) > self.chunk_size):
+            self.close()
+            name = '{}.{:04d}{}'.format(self.base, len(self.files), self.ext) + ('.gz' if self.compress else '')
+            self._f = gzip.open(name, 'wb') if self.compress else open(name, 'wb')
+            self.files.append(name)
+            self._size = 0
+        self._f.write(data)
+        self._size += len(data)
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+
+def _bulk_action(action, index, _id):
+    meta = {}
+    if index:
+        meta['_index'] = index
+    if _id is not None:
+        meta['_id'] = str(_id)
+    return json.dumps({action: meta}, separators=(',', ':')) + '\n'
+
+
+def write_bulk(products, filename, index='icecat', id_field='product_id', chunk_size=10 * 2 ** 20, compress=False,
+               action='index', ids=None, deletes=(), files=None):
+    '''
+    Write Elasticsearch / OpenSearch bulk API files: an action line and a document line per product.
+    The output is split in numbered files of at most chunk_size bytes, filename daily.ndjson gives
+    daily.0000.ndjson, daily.0001.ndjson ... each one a request body for POST /_bulk. Numbered files left by
+    an earlier run into the same name are removed first. Returns the number of products written.
+
+    :param index: target index, None to leave it to the request url
+    :param id_field: product key used as document _id, None lets the cluster assign ids
+    :param chunk_size: size limit of a file in bytes, before compression. A larger document gets a file of its own
+    :param compress: gzip the files, also when filename ends with .gz
+    :param action: 'index' to replace the documents, 'create' to skip existing ones
+    :param ids: optional set of id_field values to write, e.g. the products changed by an incremental run
+    :param deletes: optional ids to write delete actions for, e.g. diff.IndexDiff.removed()
+    :param files: optional list, the names of the files written are appended to it
+    '''
+    chunks = _BulkChunks(filename, chunk_size, compress)
+    count = 0
+    try:
+        for item in products:
+            if ids is not None and item.get(id_field) not in ids:
+                continue
+            _id = item.get(id_field) if id_field else None
+            chunks.write((_bulk_action(action, index, _id) +
+                          json.dumps(item, default=json_default, separators=(',', ':')) + '\n').encode())
+            count += 1
+        for _id in deletes:
+            chunks.write(_bulk_action('delete', index, _id).encode())
+    finally:
+        chunks.close()
+        if files is not None:
+            files.extend(chunks.files)
+    return count
+
+
+WRITERS = {
+    'json': write_json,
+    'ndjson': write_ndjson,
+    'sqlite': write_sqlite,
+    'parquet': write_parquet,
+    'bulk': write_bulk,
+}
+
+
+def write(products, filename, format=None, **options):
+    '''
+    Write products with the writer of format, by default guessed from the file extension.
+    Returns the number of products written.
+
+    :param products: iterable of product dicts
+    :param filename: output file
+    :param format: one of WRITERS, e.g. 'ndjson'
+    :param options: writer options, e.g. index='products' for write_bulk()
+    '''
+    if format is None:
+        format = os.path.splitext(filename)[1].lstrip('.').lower() or 'json'
+        if format in ('db', 'sqlite3'):
+            format = 'sqlite'
+    if format not in WRITERS:
+        raise ValueError("Unknown output format {!r}, use one of {}".format(format, ', '.join(sorted(WRITERS))))
+    return WRITERS[format](products, filename, **options)
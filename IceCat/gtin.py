@@ -0,0 +1,237 @@
+'''
+EAN/UPC (GTIN) normalization and a product lookup index on disk.
+
+The index lists the barcodes of a product under EAN_UPCS.  normalize() brings
+every form to one representation, without raising:
+
+- EAN-13 stays as is
+- UPC-A (12 digits) and EAN-8 get leading zeros, to 13 digits
+- GTIN-14 keeps 14 digits unless it starts with 0
+- codes that lost their leading zeros (9 to 11 digits) are padded as well
+
+A code with a wrong check digit, other characters than digits, spaces and
+dashes, or an unusual length is invalid, normalize() returns None for it.  The
+index parser keeps such codes as they are under ean_upcs_invalid.  UPC-E is not
+expanded, an 8 digit code is always taken as EAN-8.
+
+build_index() writes the barcodes of a catalog to a sorted, fixed record
+file, GtinIndex looks them up with a binary search over a read only mmap:
+
+    gtin.build_index(catalog.get_data(), 'gtin.idx')
+    with gtin.GtinIndex('gtin.idx') as index:
+        index.lookup('5025232253685')  # ['108912']
+'''
+import heapq
+import mmap
+import os
+import struct
+import tempfile
+
+# file header: magic, format version, record size, number of records
+HEADER = struct.Struct('<4sHHQ')
+MAGIC = b'GTIN'
+VERSION = 1
+# record: GTIN-14 as an integer, product_id
+RECORD = struct.Struct('<QI')
+MAX_PRODUCT_ID = 2 ** 32 - 1
+
+_SEPARATORS = str.maketrans('', '', ' -')
+
+
+def check_digit(digits):
+    '''
+    Return the GS1 check digit of a string of digits, the code without its check digit
+    '''
+    total = 0
+    for i, digit in enumerate(reversed(digits)):
+        total += (ord(digit) - 48) * (3 if i % 2 == 0 else 1)
+    return (10 - total % 10) % 10
+
+
+def normalize(code):
+    '''
+    Return the normalized GTIN of code, 13 digits or 14 for a GTIN-14, or None when code is not a valid GTIN
+
+    :param code: EAN-13, UPC-A, EAN-8 or GTIN-14 string, spaces and dashes are ignored
+    '''
+    if not isinstance(code, str):
+        return None
+    code = code.strip().translate(_SEPARATORS)
+    if not (8 <= len(code) <= 14) or not code.isdigit() or not code.isascii():
+        return None
+    code = code.zfill(14)
+    if code == '0' * 14 or check_digit(code[:-1]) != ord(code[-1]) - 48:
+        return None
+    return code[1:] if code[0] == '0' else code
+
+
+def values(node):
+    '''
+    Return the strings of an EAN_UPCS structure, any of
+    {'ean_upc': {'value': ...}}, {'ean_upc': [{'value': ...}, ...]}, a list of strings or a string
+    '''
+    if node is None:
+        return []
+    if isinstance(node, str):
+        return [node]
+    if isinstance(node, dict):
+        node = node.values()
+    elif not isinstance(node, (list, tuple)):
+        return []
+    found = []
+    for item in node:
+        found.extend(values(item))
+    return found
+
+
+def normalize_all(node):
+    '''
+    Return the unique valid GTINs of an EAN_UPCS structure, normalized, in order of appearance
+    '''
+    found = []
+    for code in values(node):
+        code = normalize(code)
+        if code is not None and code not in found:
+            found.append(code)
+    return found
+
+
+def _pairs(products, key):
+    for item in products:
+        product_id = item.get('product_id')
+        if not (isinstance(product_id, str) and product_id.isdigit() and int(product_id) <= MAX_PRODUCT_ID):
+            continue
+        for code in normalize_all(item.get(key)):
+            yield int(code), int(product_id)
+
+
+def _write_run(pairs, tmp_dir):
+    fd, filename = tempfile.mkstemp(suffix='.gtin', dir=tmp_dir)
+    with os.fdopen(fd, 'wb') as f:
+        for pair in sorted(set(pairs)):
+            f.write(RECORD.pack(*pair))
+    return filename
+
+
+def _read_run(filename):
+    with open(filename, 'rb') as f:
+        while True:
+            data = f.read(RECORD.size * 4096)
+            if not data:
+                break
+            yield from RECORD.iter_unpack(data)
+
+
+def build_index(products, filename, key='ean_upcs', chunk=1000000, tmp_dir=None):
+    '''
+    Write the GTIN to product_id index of products. Returns the number of records.
+    Memory use is bounded by chunk, larger catalogs are sorted in runs on disk and merged.
+
+    :param products: iterable of product dicts, e.g. IceCatCatalog.get_data()
+    :param filename: index file
+    :param key: product key holding the barcodes
+    :param chunk: number of (gtin, product_id) pairs sorted in memory at a time
+    :param tmp_dir: directory of the sorted runs, defaults to the directory of filename
+    '''
+    tmp_dir = tmp_dir or os.path.dirname(os.path.abspath(filename))
+    runs = []
+    pairs = []
+    try:
+        for pair in _pairs(products, key):
+            pairs.append(pair)
+            if len(pairs) >= chunk:
+                runs.append(_write_run(pairs, tmp_dir))
+                pairs = []
+        if pairs or not runs:
+            runs.append(_write_run(pairs, tmp_dir))
+
+        count = 0
+        part = filename + '.part'
+        with open(part, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, RECORD.size, 0))
+            previous = None
+            for pair in heapq.merge(*[_read_run(run) for run in runs]):
+                if pair != previous:
+                    f.write(RECORD.pack(*pair))
+                    previous = pair
+                    count += 1
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, VERSION, RECORD.size, count))
+        os.replace(part, filename)
+    finally:
+        for run in runs:
+            os.remove(run)
+    return count
+
+
+class GtinIndex(object):
+    '''
+    Read only GTIN to product_id lookups on an index file written by build_index().
+    The file is memory mapped, only the pages the binary search touches are read.
+
+    :param filename: index file
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, size, self.count = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION or size != RECORD.size:
+            self._map.close()
+            raise ValueError("{} is not a GTIN index of version {}".format(filename, VERSION))
+        if len(self._map) < HEADER.size + self.count * RECORD.size:
+            self._map.close()
+            raise ValueError("{} is truncated".format(filename))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, code):
+        return bool(self.lookup(code))
+
+    def _gtin(self, i):
+        return RECORD.unpack_from(self._map, HEADER.size + i * RECORD.size)[0]
+
+    def lookup(self, code):
+        '''
+        Return the product ids of a barcode as a list of strings, empty when unknown or invalid
+
+        :param code: EAN-13, UPC-A, EAN-8 or GTIN-14, normalized with normalize()
+        '''
+        code = normalize(code)
+        if code is None:
+            return []
+        gtin = int(code)
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._gtin(mid) < gtin:
+                lo = mid + 1
+            else:
+                hi = mid
+        found = []
+        while lo < self.count:
+            value, product_id = RECORD.unpack_from(self._map, HEADER.size + lo * RECORD.size)
+            if value != gtin:
+                break
+            found.append(str(product_id))
+            lo += 1
+        return found
+
+    def __iter__(self):
+        '''
+        Iterate (gtin, product_id) string pairs in GTIN order
+        '''
+        for i in range(self.count):
+            value, product_id = RECORD.unpack_from(self._map, HEADER.size + i * RECORD.size)
+            yield str(value).zfill(13), str(product_id)
+
+    def close(self):
+        self._map.close()
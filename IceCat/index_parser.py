@@ -0,0 +1,156 @@
+'''
+Parallel parser for large IceCat index files (files.index.xml).
+
+The index is split into byte ranges at <file ...> element boundaries.  Worker
+processes parse their range with the same rules as IceCatCatalog (attribute
+names lowered, exclude_keys dropped, EAN_UPCS normalized) and the batches are
+returned in file order.
+'''
+import gzip
+import os
+import logging
+from multiprocessing import Pool
+
+from IceCat import gtin
+from IceCat import xml_backend
+
+FILE_TAG = b'<file '
+INDEX_END = b'</files.index>'
+# default size of the byte range handed to a worker
+CHUNK_SIZE = 16 * 1024 * 1024
+_BLOCK = 64 * 1024
+
+
+def unroll_ean_upcs(value, log=None):
+    '''
+    Replace the EAN_UPCS structure of an index product, in place, with the list of its
+    normalized GTINs, see gtin.normalize(). Repeated codes are dropped. Invalid codes are
+    kept as they are in the index under ean_upcs_invalid. Returns the number of invalid codes.
+    '''
+    invalid = []
+    for key in ('ean_upcs', 'EAN_UPCS'):
+        if key in value:
+            codes = gtin.values(value[key])
+            value[key] = gtin.normalize_all(codes)
+            invalid = [code for code in codes if gtin.normalize(code) is None]
+            if invalid:
+                value[key.lower() + '_invalid'] = invalid
+                (log or logging.getLogger()).debug("Invalid EAN/UPC codes {} of product_id: {}".format(
+                    invalid, value.get('product_id')))
+    return len(invalid)
+
+
+def _find(f, pattern, pos):
+    '''
+    Return the offset of the first pattern at or after pos, or None
+    '''
+    f.seek(pos)
+    overlap = b''
+    while True:
+        block = f.read(_BLOCK)
+        if not block:
+            return None
+        data = overlap + block
+        i = data.find(pattern)
+        if i >= 0:
+            return pos - len(overlap) + i
+        overlap = data[-(len(pattern) - 1):]
+        pos += len(block)
+
+
+def _index_end(f, size):
+    # the closing tag is at the very end of the file, search backwards
+    pos = max(0, size - _BLOCK)
+    f.seek(pos)
+    i = f.read().rfind(INDEX_END)
+    return pos + i if i >= 0 else size
+
+
+def split_index(xml_file, chunk_size=CHUNK_SIZE):
+    '''
+    Split an index file into byte ranges, each holding only whole <file> elements.
+    Returns a list of (start, end) offsets.
+
+    :param xml_file: index file name
+    :param chunk_size: approximate size of a range in bytes
+    '''
+    size = os.path.getsize(xml_file)
+    ranges = []
+    with open(xml_file, 'rb') as f:
+        start = _find(f, FILE_TAG, 0)
+        if start is None:
+            return ranges
+        end_of_files = _index_end(f, size)
+        while start < end_of_files:
+            end = _find(f, FILE_TAG, start + chunk_size) if start + chunk_size < end_of_files else None
+            if end is None or end > end_of_files:
+                end = end_of_files
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+class _RangeParser(object):
+    '''
+    postprocessor applying the IceCatCatalog key rules to one byte range
+    '''
+    def __init__(self, exclude_keys):
+        self.exclude_keys = exclude_keys
+
+    def __call__(self, path, key, value):
+        if key in self.exclude_keys:
+            return None
+        return key.lower(), value
+
+
+def _products(source, exclude_keys):
+    # the <file> elements of an index document as product dicts
+    for value in xml_backend.parse_records(source, 'file', _RangeParser(exclude_keys)):
+        unroll_ean_upcs(value)
+        yield value
+
+
+def parse_range(job):
+    '''
+    Parse the <file> elements in one byte range. Returns a list of product dicts.
+
+    :param job: (xml_file, start, end, exclude_keys) tuple
+    '''
+    xml_file, start, end, exclude_keys = job
+    with open(xml_file, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    return list(_products(b'<files.index>' + data + b'</files.index>', exclude_keys))
+
+
+def iter_index(xml_file, exclude_keys=['Country_Markets']):
+    '''
+    Stream the products of an index file in one process, one dict at a time, with the rules of IceCatCatalog.
+    Categories and suppliers are not resolved.
+
+    :param xml_file: index file name, may be gzipped (.gz)
+    :param exclude_keys: a list of keys to omit from the products
+    '''
+    if xml_file.endswith('.gz'):
+        with gzip.open(xml_file, 'rb') as f:
+            yield from _products(f, exclude_keys)
+    else:
+        yield from _products(xml_file, exclude_keys)
+
+
+def parse_index_parallel(xml_file, workers=None, exclude_keys=['Country_Markets'], chunk_size=CHUNK_SIZE):
+    '''
+    Parse an index file with a pool of worker processes.
+    Yields lists of product dicts, in the order they appear in the file.
+
+    :param xml_file: index file name
+    :param workers: number of worker processes, defaults to the number of cores
+    :param exclude_keys: a list of keys to omit from the products
+    :param chunk_size: approximate size of the byte range parsed by a worker at a time
+    '''
+    jobs = [(xml_file, start, end, exclude_keys) for start, end in split_index(xml_file, chunk_size)]
+    if not jobs:
+        return
+    with Pool(min(workers or os.cpu_count(), len(jobs))) as pool:
+        for products in pool.imap(parse_range, jobs):
+            yield products
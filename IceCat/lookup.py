@@ -0,0 +1,172 @@
+'''
+On demand product detail lookups, without a batch run over the whole index.
+
+ProductLookup fetches a single product XML, extracts the detail keys with the same
+rules as IceCatProductDetails and caches the result in memory (LRU) and on disk (TTL).
+Concurrent lookups of the same product share one download.
+'''
+import collections
+import copy
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from IceCat import IceCat
+from IceCat import details as detail_schema
+from IceCat import transport as http_transport
+
+
+class _Flight(object):
+    # one in-progress lookup, other callers wait on it
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+
+
+class ProductLookup(object):
+    '''
+    Cached single product detail lookups. Thread safe.
+
+    :param keys: default list of product detail keys. Refer to Basic Usage Example
+    :param auth: Username and password touple, as needed for Ice Cat website authentication
+    :param data_dir: Directory for the on-disk cache. None disables the disk cache.
+    :param max_items: Number of lookups kept in the in-memory LRU cache
+    :param ttl: Seconds a cached lookup stays fresh, in memory and on disk
+    :param transport: optional transport.Transport instance
+    :param log: optional logging.getLogger() instance
+    '''
+
+    def __init__(self, keys=['ProductDescription'], auth=('user', 'passwd'), data_dir='_data/product_cache/',
+                 max_items=10000, ttl=24 * 3600, transport=None, log=None):
+        self.keys = keys
+        self.auth = auth
+        self.data_dir = data_dir
+        self.max_items = max_items
+        self.ttl = ttl
+        self.transport = transport or http_transport.get_transport(auth)
+        self.log = log or logging.getLogger()
+        self.hits = 0
+        self.misses = 0
+        self._lru = collections.OrderedDict()
+        self._flights = {}
+        self._lock = threading.Lock()
+
+        if self.data_dir and not os.path.exists(self.data_dir):
+            os.makedirs(self.data_dir)
+
+    def _cache_key(self, product_id, keys):
+        return str(product_id), tuple(sorted(keys))
+
+    def _cache_file(self, key):
+        product_id, keys = key
+        digest = hashlib.sha1('\n'.join(keys).encode('utf-8')).hexdigest()[:12]
+        return os.path.join(self.data_dir, '{}.{}.json'.format(product_id, digest))
+
+    def _from_memory(self, key):
+        entry = self._lru.get(key)
+        if entry is None:
+            return None
+        fetched_at, details = entry
+        if time.time() - fetched_at > self.ttl:
+            del self._lru[key]
+            return None
+        self._lru.move_to_end(key)
+        return details
+
+    def _remember(self, key, details, fetched_at):
+        self._lru[key] = (fetched_at, details)
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_items:
+            self._lru.popitem(last=False)
+
+    def _from_disk(self, key):
+        if not self.data_dir:
+            return None
+        file = self._cache_file(key)
+        try:
+            fetched_at = os.path.getmtime(file)
+            if time.time() - fetched_at > self.ttl:
+                return None
+            with open(file, 'r') as f:
+                return fetched_at, detail_schema.DetailExtractor(list(key[1])).restore(json.load(f))
+        except (OSError, ValueError):
+            return None
+
+    def _to_disk(self, key, details):
+        if not self.data_dir:
+            return
+        file = self._cache_file(key)
+        part = file + '.part'
+        with open(part, 'w') as f:
+            json.dump(details, f, default=detail_schema.json_default)
+        os.replace(part, file)
+
+    def _load(self, key, product_id, keys):
+        cached = self._from_disk(key)
+        if cached is not None:
+            return cached
+        try:
+            details = IceCat.IceCatProductDetails.fetch(product_id, keys, self.transport, self.log)
+        except Exception as e:
+            self.log.error("Could not obtain product details from IceCat for product_id {}: {}".format(product_id, e))
+            return None
+        if details is None:
+            return None
+        self._to_disk(key, details)
+        return time.time(), details
+
+    def get(self, product_id, keys=None):
+        '''
+        Return a dict of product details, or None if the product could not be fetched.
+        Every call returns a copy of its own, changes to it do not reach the cache.
+
+        :param product_id: IceCat product id
+        :param keys: optional list of detail keys, defaults to the keys of the lookup
+        '''
+        key = self._cache_key(product_id, keys or self.keys)
+        with self._lock:
+            details = self._from_memory(key)
+            if details is not None:
+                self.hits += 1
+                return copy.deepcopy(details)
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                self.misses += 1
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            flight.event.wait()
+            return copy.deepcopy(flight.result)
+
+        try:
+            loaded = self._load(key, product_id, list(key[1]))
+            if loaded is not None:
+                fetched_at, flight.result = loaded
+                with self._lock:
+                    self._remember(key, flight.result, fetched_at)
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.event.set()
+        return copy.deepcopy(flight.result)
+
+    def invalidate(self, product_id):
+        '''
+        Drop a product from the in-memory cache, e.g. after the index reports it updated.
+        Disk entries of all key sets are removed too.
+
+        :param product_id: IceCat product id
+        '''
+        product_id = str(product_id)
+        with self._lock:
+            for key in [k for k in self._lru if k[0] == product_id]:
+                del self._lru[key]
+        if self.data_dir:
+            prefix = product_id + '.'
+            for name in os.listdir(self.data_dir):
+                if name.startswith(prefix) and name.endswith('.json'):
+                    os.remove(os.path.join(self.data_dir, name))
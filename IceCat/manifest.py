@@ -0,0 +1,126 @@
+'''
+Sidecar manifest of the product xml cache.
+
+fetchURLs records one entry per downloaded url: the product id, the index Updated
+value it was fetched for, when it was fetched, the HTTP ETag, the size and a sha1
+of the content.  Comparing the hash with the previous entry tells whether a
+re-download actually brought new content, so later steps can skip products
+whose xml did not change.  Once a product xml is parsed, the detail keys asked
+for and the keys its details came out with are noted in the entry, so the
+details of an unchanged product can be restored exactly.
+
+The manifest is a text file with one JSON array per line, in FIELDS order.
+New entries are appended as they are recorded, a later line for the same url
+replaces an earlier one.  save() rewrites the file with the current entries only.
+'''
+import json
+import os
+import threading
+import time
+
+
+class Manifest(object):
+    '''
+    Thread safe url -> entry map backed by a sidecar file.
+
+    :param filename: manifest file, created on first record
+    :param log: optional logging.getLogger() instance
+    '''
+
+    FIELDS = ('product_id', 'url', 'fetched_at', 'updated', 'etag', 'size', 'sha1', 'detail_keys', 'details')
+
+    def __init__(self, filename, log=None):
+        self.filename = filename
+        self.log = log
+        self.entries = {}
+        self._lock = threading.Lock()
+        self._file = None
+        self._load()
+
+    def _load(self):
+        if not os.path.isfile(self.filename):
+            return
+        with open(self.filename, 'r') as f:
+            for line in f:
+                try:
+                    values = json.loads(line)
+                except ValueError:
+                    # torn last line of an interrupted run
+                    if self.log:
+                        self.log.warning("Skipping broken manifest line in {}".format(self.filename))
+                    continue
+                # lines written before a field was added are shorter
+                entry = dict.fromkeys(self.FIELDS)
+                entry.update(zip(self.FIELDS, values))
+                self.entries[entry['url']] = entry
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, url):
+        return url in self.entries
+
+    def get(self, url):
+        '''
+        Return the entry of url as a dict, or None
+        '''
+        return self.entries.get(url)
+
+    def record(self, url, **fields):
+        '''
+        Add or replace the entry of url and append it to the manifest file.
+        Returns the previous entry or None.
+
+        :param url: downloaded url
+        :param fields: values of FIELDS, fetched_at defaults to now
+        '''
+        entry = dict.fromkeys(self.FIELDS)
+        entry.update(fields)
+        entry['url'] = url
+        if entry['fetched_at'] is None:
+            entry['fetched_at'] = int(time.time())
+        with self._lock:
+            previous = self.entries.get(url)
+            self.entries[url] = entry
+            self._write(entry)
+        return previous
+
+    def note(self, url, **fields):
+        '''
+        Update fields of the existing entry of url and append it to the manifest file.
+        Returns False if url has no entry.
+
+        :param url: downloaded url
+        :param fields: values of FIELDS, e.g. detail_keys and details
+        '''
+        with self._lock:
+            entry = self.entries.get(url)
+            if entry is None:
+                return False
+            entry.update(fields)
+            self._write(entry)
+        return True
+
+    def _write(self, entry):
+        # called with the lock held
+        if self._file is None:
+            self._file = open(self.filename, 'a')
+        self._file.write(json.dumps([entry[field] for field in self.FIELDS]) + '\n')
+        self._file.flush()
+
+    def save(self):
+        '''
+        Rewrite the manifest file with one line per url
+        '''
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            part = self.filename + '.part'
+            with open(part, 'w') as f:
+                for entry in self.entries.values():
+                    f.write(json.dumps([entry[field] for field in self.FIELDS]) + '\n')
+            os.replace(part, self.filename)
+
+    def close(self):
+        self.save()
@@ -0,0 +1,102 @@
+'''
+Single-flight loading of IceCat reference data (CategoriesList, supplier mapping).
+
+Catalog instances in one process share one mapping object per reference file,
+data_dir and credentials.  Across processes a lock file next to the downloaded
+file makes sure only one process downloads it, the others parse the fresh copy.
+'''
+import os
+import threading
+import time
+import logging
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+# seconds a downloaded reference file, or a loaded mapping, is reused
+MAX_AGE = 24 * 3600
+
+_registry = {}
+_registry_lock = threading.Lock()
+_key_locks = {}
+
+
+class FileLock(object):
+    '''
+    Exclusive, blocking inter-process lock on a file. Use as a context manager.
+
+    :param path: lock file name, created if needed
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.f = None
+
+    def __enter__(self):
+        self.f = open(self.path, 'a+')
+        if fcntl:
+            fcntl.flock(self.f.fileno(), fcntl.LOCK_EX)
+        else:
+            self.f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(self.f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK gives up after 10 seconds
+                    continue
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if fcntl:
+            fcntl.flock(self.f.fileno(), fcntl.LOCK_UN)
+        else:
+            self.f.seek(0)
+            msvcrt.locking(self.f.fileno(), msvcrt.LK_UNLCK, 1)
+        self.f.close()
+
+
+def get_reference(cls, data_dir='_data/', auth=('user', 'passwd'), log=None, transport=None, max_age=MAX_AGE):
+    '''
+    Return a shared reference mapping instance, downloading and parsing the file at most once.
+    Concurrent callers for the same mapping wait for the first one and get the same object.
+
+    :param cls: IceCatCategoryMapping or IceCatSupplierMapping
+    :param data_dir: Directory to hold downloaded reference files
+    :param auth: Username and password touple, as needed for Ice Cat website authentication
+    :param log: optional logging.getLogger() instance
+    :param transport: optional transport.Transport instance
+    :param max_age: seconds a downloaded file or loaded mapping is reused before it is refreshed
+    '''
+    log = log or logging.getLogger()
+    key = (cls, os.path.abspath(data_dir), tuple(auth) if auth else None)
+    with _registry_lock:
+        lock = _key_locks.setdefault(key, threading.Lock())
+
+    with lock:
+        entry = _registry.get(key)
+        if entry is not None and time.time() - entry[0] < max_age:
+            return entry[1]
+
+        if not os.path.exists(data_dir):
+            os.makedirs(data_dir, exist_ok=True)
+        local_file = data_dir + os.path.basename(cls.FILENAME)
+        with FileLock(local_file + '.lock'):
+            xml_file = None
+            if os.path.isfile(local_file) and time.time() - os.path.getmtime(local_file) < max_age:
+                log.info("Reusing {} downloaded at {}".format(local_file, time.ctime(os.path.getmtime(local_file))))
+                xml_file = local_file
+            mapping = cls(log=log, xml_file=xml_file, auth=auth, data_dir=data_dir, transport=transport)
+
+        _registry[key] = (time.time(), mapping)
+        return mapping
+
+
+def clear():
+    '''
+    Forget all shared mappings in this process
+    '''
+    with _registry_lock:
+        _registry.clear()
@@ -0,0 +1,254 @@
+'''
+Typed product records.
+
+Catalog products are plain dicts of strings whose shape depends on the index
+(m_prod_id is a string or a list, numbers and dates are text).  ProductSchema
+turns them into compact records with __slots__ (see details.Record), parsed
+once:
+
+- ids, counts and picture sizes are ints, on_market is a bool
+- updated and date_added are datetimes, release_date a date
+- m_prod_id, ean_upcs, ean_upcs_invalid and country_markets are always lists of strings
+- detail sections (features, gallery ...) stay lists of their records
+
+The fields are generated from IceCatCatalog._namespaces and the detail keys.
+Keys the schema does not know, and values that do not parse, are kept in
+record.extra.  dumps() serializes records with orjson when it is installed,
+with json otherwise.
+
+    schema = ProductSchema(keys=['ProductDescription[@ShortDesc]', 'features'])
+    for record in catalog.get_records(schema):
+        record.product_id, record.updated.year, schema.dumps(record)
+'''
+import datetime
+import json
+
+from IceCat import details
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# field types, anything not listed is a str
+INT_FIELDS = ('product_id', 'supplier_id', 'catid', 'product_view', 'highpicsize', 'highpicwidth', 'highpicheight')
+BOOL_FIELDS = ('on_market',)
+DATETIME_FIELDS = ('updated', 'date_added')
+DATE_FIELDS = ('release_date',)
+LIST_FIELDS = ('m_prod_id', 'ean_upcs', 'ean_upcs_invalid', 'country_markets')
+
+# index keys that are not in _namespaces, and the keys the catalog adds
+INDEX_FIELDS = ('path', 'supplier_id', 'date_added', 'm_prod_id', 'ean_upcs', 'ean_upcs_invalid',
+                'country_markets', 'supplier', 'category')
+
+SCHEMA_TYPES = {str: 'string', int: 'integer', bool: 'boolean', list: 'array',
+                datetime.datetime: 'string', datetime.date: 'string'}
+
+
+def _to_datetime(value):
+    # index dates are 20160208133238, or 2016-02-08 and 20160208 as a date
+    if isinstance(value, datetime.date) or value is None:
+        return value
+    digits = value.replace('-', '').replace(':', '').replace(' ', '').replace('T', '')
+    if not digits.isdigit() or len(digits) not in (8, 14):
+        raise ValueError("Invalid date {!r}".format(value))
+    return datetime.datetime(int(digits[:4]), int(digits[4:6]), int(digits[6:8]),
+                             int(digits[8:10] or 0), int(digits[10:12] or 0), int(digits[12:14] or 0))
+
+
+def _to_date(value):
+    value = _to_datetime(value)
+    return value.date() if isinstance(value, datetime.datetime) else value
+
+
+def _to_int(value):
+    if value is None or isinstance(value, int):
+        return value
+    return int(value)
+
+
+def _to_bool(value):
+    if value is None or isinstance(value, bool):
+        return value
+    if value not in ('0', '1'):
+        raise ValueError("Invalid flag {!r}".format(value))
+    return value == '1'
+
+
+def _to_list(value):
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return [str(item) for item in value]
+    return [str(value)]
+
+
+def _to_str(value):
+    if value is None or isinstance(value, str):
+        return value
+    raise ValueError("Invalid text {!r}".format(value))
+
+
+def _section_converter(section):
+    # section records, also from the dicts of serialized records
+    def convert(value):
+        return [item if isinstance(item, details.Record) else section.record(**item) for item in value or []]
+    return convert
+
+
+class ProductRecord(details.Record):
+    '''
+    Base class of the typed product records made by ProductSchema. Fields are attributes and keys,
+    keys without a field are kept in extra.
+    '''
+    __slots__ = ('extra',)
+
+    def __init__(self, *args, **kwargs):
+        super(ProductRecord, self).__init__(*args, **kwargs)
+        self.extra = None
+
+    def get(self, key, default=None):
+        if key in self._fields:
+            return getattr(self, key)
+        return (self.extra or {}).get(key, default)
+
+    def _asdict(self):
+        # unset fields are left out, as the product dicts leave out missing keys
+        o = {}
+        for field in self._fields:
+            value = getattr(self, field)
+            if value is not None and value != []:
+                o[field] = value
+        if self.extra:
+            o.update(self.extra)
+        return o
+
+
+def _detail_field(key, sections):
+    # output key of a detail key, same rules as DetailExtractor
+    if key in sections:
+        return key, _section_converter(sections[key]), list
+    if '@' in key:
+        return key[key.index('@') + 1:key.rindex(']')].lower(), _to_str, str
+    return key.lower(), _to_str, str
+
+
+class ProductSchema(object):
+    '''
+    Record type and converters of the catalog products.
+
+    :param keys: product detail keys and section names given to add_product_details..()
+    :param namespaces: index attribute names to field names, defaults to IceCatCatalog._namespaces
+    :param sections: detail sections, defaults to details.SECTIONS
+    '''
+
+    def __init__(self, keys=(), namespaces=None, sections=None):
+        if namespaces is None:
+            from IceCat.IceCat import IceCatCatalog
+            namespaces = IceCatCatalog._namespaces
+        sections = dict((section.name, section) for section in (sections or details.SECTIONS))
+        # source key -> (field, converter), fields in order with their types
+        self.sources = {}
+        self.fields = []
+        for attribute, field in namespaces.items():
+            # the index parser lower cases the attribute names
+            self._add(attribute.lower(), field, *self._index_type(field))
+        for field in INDEX_FIELDS:
+            self._add(field, field, *self._index_type(field))
+        for key in keys:
+            field, convert, kind = _detail_field(key, sections)
+            self._add(field, field, convert, kind)
+        names = tuple(field for field, kind in self.fields)
+        self._lists = [field for field, kind in self.fields if kind is list]
+        self.record = type('Product', (ProductRecord,), {'__slots__': names, '_fields': names})
+
+    @staticmethod
+    def _index_type(field):
+        if field in INT_FIELDS:
+            return _to_int, int
+        if field in BOOL_FIELDS:
+            return _to_bool, bool
+        if field in DATETIME_FIELDS:
+            return _to_datetime, datetime.datetime
+        if field in DATE_FIELDS:
+            return _to_date, datetime.date
+        if field in LIST_FIELDS:
+            return _to_list, list
+        return _to_str, str
+
+    def _add(self, source, field, convert, kind):
+        # serialized records use the field names, e.g. release_date for the releasedate index key
+        self.sources.setdefault(source, (field, convert))
+        self.sources.setdefault(field, (field, convert))
+        if field not in dict(self.fields):
+            self.fields.append((field, kind))
+
+    def from_dict(self, item, strict=False):
+        '''
+        Return the typed record of a product dict
+
+        :param item: product dict, or any mapping of the catalog
+        :param strict: raise ValueError for a value that does not parse, instead of keeping it as is in extra
+        '''
+        # missing list fields are empty lists
+        values = dict((field, []) for field in self._lists)
+        extra = None
+        for key, value in item.items():
+            source = self.sources.get(key)
+            if source is None:
+                if extra is None:
+                    extra = {}
+                extra[key] = value
+                continue
+            field, convert = source
+            try:
+                values[field] = convert(value)
+            except (TypeError, ValueError):
+                if strict:
+                    raise ValueError("Invalid {} {!r} of product_id {}".format(field, value, item.get('product_id')))
+                if extra is None:
+                    extra = {}
+                extra[key] = value
+        record = self.record(**values)
+        record.extra = extra
+        return record
+
+    def json_schema(self):
+        '''
+        Return a JSON Schema of the serialized records
+        '''
+        properties = {}
+        for field, kind in self.fields:
+            spec = {'type': [SCHEMA_TYPES.get(kind, 'object'), 'null']}
+            if kind is datetime.datetime:
+                spec['format'] = 'date-time'
+            elif kind is datetime.date:
+                spec['format'] = 'date'
+            elif kind is list:
+                spec = {'type': 'array'}
+            properties[field] = spec
+        return {'type': 'object', 'properties': properties, 'required': ['product_id'],
+                'additionalProperties': True}
+
+    def dumps(self, record):
+        '''
+        Serialize a record to JSON bytes, dates in ISO 8601
+        '''
+        if orjson is not None:
+            return orjson.dumps(record._asdict(), default=_default)
+        return json.dumps(record._asdict(), default=_default, separators=(',', ':')).encode()
+
+    def loads(self, data, strict=False):
+        '''
+        Return the record of JSON data written by dumps()
+        '''
+        item = orjson.loads(data) if orjson is not None else json.loads(data)
+        return self.from_dict(item, strict=strict)
+
+
+def _default(obj):
+    if isinstance(obj, details.Record):
+        return obj._asdict()
+    if isinstance(obj, datetime.date):
+        return obj.isoformat()
+    raise TypeError('{!r} is not JSON serializable'.format(obj))
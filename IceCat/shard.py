@@ -0,0 +1,113 @@
+'''
+Sharding of the product detail downloads across several nodes.
+
+Product ids are hashed into N shards, node k downloads and parses shard k only:
+
+    node 0: icecat sync full --shard 0/4 --data-dir shared/ --output full.0.ndjson
+    node 1: icecat sync full --shard 1/4 --data-dir shared/ --output full.1.ndjson
+    ...
+    icecat merge --output full.ndjson full.0.ndjson full.1.ndjson full.2.ndjson full.3.ndjson \\
+        --manifest shared/product_xml/manifest.0-of-4.ndjson ...
+
+The hash is crc32 of the product id, so the assignment is the same on every
+node, Python version and run.  A sharded run keeps its manifest and pending
+list in files of its own (see suffix()), so nodes may share a data directory.
+merge() combines the per shard outputs and manifests.
+'''
+import os
+import zlib
+
+from IceCat import export
+from IceCat import manifest as xml_manifest
+
+
+def parse(spec):
+    '''
+    Return the (k, n) tuple of a 'k/n' shard spec, e.g. '0/4'. k counts from 0.
+    '''
+    try:
+        k, n = (int(part) for part in spec.split('/'))
+    except ValueError:
+        raise ValueError("Invalid shard {!r}, use k/n e.g. 0/4".format(spec))
+    if not 0 <= k < n:
+        raise ValueError("Invalid shard {!r}, k must be between 0 and n - 1".format(spec))
+    return k, n
+
+
+def shard_of(product_id, shards):
+    '''
+    Return the shard, 0 to shards - 1, of product_id
+    '''
+    return zlib.crc32(str(product_id).encode()) % shards
+
+
+def in_shard(product_id, shard):
+    '''
+    True when product_id belongs to shard, a (k, n) tuple. Every product belongs to shard None.
+    '''
+    return shard is None or shard_of(product_id, shard[1]) == shard[0]
+
+
+def suffix(shard):
+    '''
+    File name suffix of the per shard files, e.g. '.0-of-4'. Empty for shard None.
+    '''
+    return '.{}-of-{}'.format(*shard) if shard else ''
+
+
+def read_products(filename):
+    '''
+    Stream the products of a JSON array or NDJSON output file, see export.read_products()
+    '''
+    return export.read_products(filename)
+
+
+class _Merged(object):
+    # products of the shard outputs, first one of a product_id wins. Iterable more than once, as the writers need
+    def __init__(self, filenames):
+        self.filenames = filenames
+
+    def __iter__(self):
+        seen = set()
+        for filename in self.filenames:
+            for item in read_products(filename):
+                if item['product_id'] not in seen:
+                    seen.add(item['product_id'])
+                    yield item
+
+
+def merge_manifests(filenames, output, log=None):
+    '''
+    Combine shard manifests into one, the latest fetch of a url wins. Returns the number of entries.
+
+    :param filenames: manifest files of the shards
+    :param output: merged manifest file, existing entries are kept unless a shard fetched the url later
+    '''
+    merged = xml_manifest.Manifest(output, log=log)
+    for filename in filenames:
+        for url, entry in xml_manifest.Manifest(filename, log=log).entries.items():
+            current = merged.get(url)
+            if current is None or (entry['fetched_at'] or 0) >= (current['fetched_at'] or 0):
+                merged.entries[url] = entry
+    merged.save()
+    return len(merged)
+
+
+def merge(outputs, output, format=None, manifests=None, manifest_output=None, log=None):
+    '''
+    Combine the outputs of the shard runs into one file. Returns the number of products written.
+
+    :param outputs: JSON or NDJSON output files of the shard runs, in the order they are written
+    :param output: merged output file
+    :param format: output format, see export.write()
+    :param manifests: optional manifest files of the shard runs
+    :param manifest_output: merged manifest, defaults to manifest.ndjson next to the first shard manifest
+    :param log: optional logging.getLogger() instance
+    '''
+    written = export.write(_Merged(outputs), output, format)
+    if manifests:
+        manifest_output = manifest_output or os.path.join(os.path.dirname(manifests[0]), 'manifest.ndjson')
+        merge_manifests(manifests, manifest_output, log=log)
+    if log:
+        log.info("Merged {} shard outputs into {}, {} products".format(len(outputs), output, written))
+    return written
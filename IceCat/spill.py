@@ -0,0 +1,231 @@
+'''
+Memory budgeted product store that spills to disk.
+
+SpillCatalog keeps recently added products in memory as plain dicts.  When their
+estimated size passes the memory limit, the in-memory batch is moved to a
+temporary SQLite database.  Products on disk are handed out as SpilledRow
+views that write changes straight back, so indexing, iterating and updating
+products works the same for both parts.  Peak memory stays near the limit no
+matter how large the catalog is.
+'''
+import collections
+import collections.abc
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import weakref
+
+
+def _sizeof(item):
+    # rough size of a product dict: the dict, its keys and values, one level deep
+    size = sys.getsizeof(item)
+    for key, value in item.items():
+        size += sys.getsizeof(key) + sys.getsizeof(value)
+    return size
+
+
+def _remove(filename):
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
+
+
+class SpilledRow(collections.abc.MutableMapping):
+    '''
+    Dict-like view of a product stored on disk. Every change is written back.
+    '''
+    __slots__ = ('_catalog', '_index', '_data')
+
+    def __init__(self, catalog, index, data):
+        self._catalog = catalog
+        self._index = index
+        self._data = data
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __setitem__(self, key, value):
+        self._data[key] = value
+        self._catalog._write(self._index, self._data)
+
+    def __delitem__(self, key):
+        del self._data[key]
+        self._catalog._write(self._index, self._data)
+
+    def update(self, *args, **kwargs):
+        # one write for the whole update
+        self._data.update(*args, **kwargs)
+        self._catalog._write(self._index, self._data)
+
+    def clear(self):
+        self._data.clear()
+        self._catalog._write(self._index, self._data)
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return 'SpilledRow({!r})'.format(self._data)
+
+
+class SpillCatalog(collections.abc.Sequence):
+    '''
+    Replacement for the list of product dicts built by IceCatCatalog, bounded in memory.
+
+    The newest products are plain dicts in memory, older ones are SpilledRow views of the
+    disk store. A dict taken from the memory part should not be kept across append() calls,
+    it may be moved to disk in between.
+
+    :param memory_limit: Approximate number of bytes of product data to keep in memory
+    :param spill_dir: Directory of the temporary SQLite file, defaults to the system temp dir
+    :param batch: Number of products read from disk at a time while iterating
+    '''
+
+    def __init__(self, memory_limit, spill_dir=None, batch=1000):
+        self.memory_limit = memory_limit
+        self.spill_dir = spill_dir
+        self.batch = batch
+        self.spilled = 0
+        self._memory = []
+        self._memory_bytes = 0
+        self._db = None
+        self._lock = threading.RLock()
+
+    def _open(self):
+        if self.spill_dir and not os.path.exists(self.spill_dir):
+            os.makedirs(self.spill_dir)
+        fd, self.filename = tempfile.mkstemp(prefix='icecat.', suffix='.spill.sqlite', dir=self.spill_dir)
+        os.close(fd)
+        self._finalizer = weakref.finalize(self, _remove, self.filename)
+        self._db = sqlite3.connect(self.filename, check_same_thread=False)
+        # scratch data, no need to survive a crash
+        self._db.execute('PRAGMA journal_mode=OFF')
+        self._db.execute('PRAGMA synchronous=OFF')
+        self._db.execute('CREATE TABLE products (pos INTEGER PRIMARY KEY, data TEXT)')
+
+    def _spill(self):
+        # move the in-memory batch to disk, positions do not change
+        with self._lock:
+            if self._db is None:
+                self._open()
+            start = self.spilled
+            self._db.executemany('INSERT INTO products (pos, data) VALUES (?, ?)',
+                                 ((start + i, json.dumps(dict(item))) for i, item in enumerate(self._memory)))
+            self.spilled += len(self._memory)
+            self._memory = []
+            self._memory_bytes = 0
+
+    def _write(self, i, data):
+        with self._lock:
+            self._db.execute('UPDATE products SET data = ? WHERE pos = ?', (json.dumps(data), i))
+
+    def _read(self, start, stop):
+        with self._lock:
+            rows = self._db.execute('SELECT pos, data FROM products WHERE pos >= ? AND pos < ? ORDER BY pos',
+                                    (start, stop)).fetchall()
+        return [SpilledRow(self, i, json.loads(data)) for i, data in rows]
+
+    def append(self, item):
+        '''
+        Add a product, spilling the in-memory batch to disk when it passes the memory limit
+
+        :param item: product dict
+        '''
+        self._memory.append(item)
+        self._memory_bytes += _sizeof(item)
+        if self._memory_bytes > self.memory_limit:
+            self._spill()
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+
+    def __len__(self):
+        return self.spilled + len(self._memory)
+
+    def _position(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('SpillCatalog index out of range')
+        return i
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        i = self._position(i)
+        if i >= self.spilled:
+            return self._memory[i - self.spilled]
+        return self._read(i, i + 1)[0]
+
+    def __setitem__(self, i, item):
+        i = self._position(i)
+        if i >= self.spilled:
+            self._memory[i - self.spilled] = item
+        else:
+            self._write(i, dict(item))
+
+    def __iter__(self):
+        for start in range(0, self.spilled, self.batch):
+            for row in self._read(start, min(start + self.batch, self.spilled)):
+                yield row
+        for item in list(self._memory):
+            yield item
+
+    def join(self, source, target, table):
+        '''
+        Set target from table[item[source]] on every product, see CompactCatalog.join().
+        Returns a Counter of the source values that had no match in table.
+        '''
+        missing = collections.Counter()
+
+        def resolve(data):
+            name = table.get(data.get(source))
+            if name is None:
+                missing[data.get(source)] += 1
+                return False
+            data[target] = name
+            return True
+
+        for start in range(0, self.spilled, self.batch):
+            # one write per batch
+            changed = [row for row in self._read(start, min(start + self.batch, self.spilled)) if resolve(row._data)]
+            with self._lock:
+                self._db.executemany('UPDATE products SET data = ? WHERE pos = ?',
+                                     ((json.dumps(row._data), row._index) for row in changed))
+        for item in self._memory:
+            resolve(item)
+        return missing
+
+    def filter(self, predicate):
+        '''
+        Return a new SpillCatalog holding only the products for which predicate(item) is true
+        '''
+        selected = SpillCatalog(self.memory_limit, spill_dir=self.spill_dir, batch=self.batch)
+        for item in self:
+            if predicate(item):
+                selected.append(dict(item))
+        return selected
+
+    def to_list(self):
+        '''
+        Return products as a list of plain dicts
+        '''
+        return [dict(item) for item in self]
+
+    def close(self):
+        '''
+        Drop the disk store
+        '''
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+                self._finalizer()
@@ -0,0 +1,93 @@
+'''
+Shared HTTP transport for IceCat reference, index and product detail downloads.
+
+All downloads in a process go through one requests.Session per set of credentials,
+so TCP/TLS connections are kept alive and reused between files, threads and
+repeated add_product_details_parallel() calls.
+'''
+import os
+import threading
+import logging
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# (connect, read) timeout in seconds
+DEFAULT_TIMEOUT = (10, 120)
+
+
+class Transport(object):
+    '''
+    A keep-alive requests.Session with a connection pool sized for the number of download threads.
+
+    :param auth: Username and password touple, as needed for Ice Cat website authentication
+    :param connections: Number of simultanious connections per host, the pool is sized to match
+    :param timeout: (connect, read) timeout in seconds applied to every request
+    :param retries: Number of retries on connection errors, passed to urllib3
+    '''
+
+    def __init__(self, auth=None, connections=10, timeout=DEFAULT_TIMEOUT, retries=2):
+        self.auth = auth
+        self.timeout = timeout
+        self.retries = retries
+        self.connections = 0
+        self._lock = threading.Lock()
+        self.session = requests.Session()
+        self.session.auth = auth
+        self.session.headers['Connection'] = 'keep-alive'
+        self.resize(connections)
+
+    def resize(self, connections):
+        '''
+        Grow the connection pool to at least connections, the pool never shrinks. The replaced adapter
+        is closed, its idle connections right away, connections of requests in flight when they are released.
+
+        :param connections: Number of simultanious connections per host
+        '''
+        with self._lock:
+            if connections <= self.connections:
+                return
+            self.connections = connections
+            adapter = HTTPAdapter(pool_connections=10, pool_maxsize=connections, max_retries=self.retries)
+            replaced = []
+            for prefix in ('https://', 'http://'):
+                old = self.session.adapters.get(prefix)
+                if old is not None and old not in replaced:
+                    replaced.append(old)
+                self.session.mount(prefix, adapter)
+            for old in replaced:
+                old.close()
+
+    def get(self, url, **kwargs):
+        '''
+        GET url on the shared session. Same arguments as requests.get(), timeout defaults to the transport timeout.
+        '''
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.get(url, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+_transports = {}
+_transports_lock = threading.Lock()
+
+
+def get_transport(auth=None, connections=10, timeout=DEFAULT_TIMEOUT):
+    '''
+    Return the process wide Transport for auth, creating it on first use.
+    The connection pool is grown to match connections.
+
+    :param auth: Username and password touple
+    :param connections: Number of simultanious connections the caller is going to use
+    :param timeout: (connect, read) timeout, only used when the transport is created
+    '''
+    # a forked process gets its own, the pooled connections of the parent must not be shared
+    key = (os.getpid(), tuple(auth) if auth else None)
+    with _transports_lock:
+        transport = _transports.get(key)
+        if transport is None:
+            transport = _transports[key] = Transport(auth=auth, connections=connections, timeout=timeout)
+            logging.getLogger("urllib3").setLevel(logging.WARNING)
+    transport.resize(connections)
+    return transport
@@ -0,0 +1,256 @@
+'''
+XML parser backends.
+
+All parsers of the package go through this module:
+
+- parse() returns the root element of a document, used by the reference mappings.
+  It always uses xml.etree: the reference files are parsed whole once, and loading
+  a category mapping does not import lxml
+- iterparse() streams (event, element) pairs, used by the product detail extraction
+- parse_records() streams repeated records, e.g. the <file> elements of the product index,
+  converted to dicts with the same rules as xmltodict.parse(attr_prefix='', postprocessor=...)
+
+Three backends are available, the first one installed is used:
+
+- 'lxml': lxml.etree, iterparse filtered on the record tag in C
+- 'expat': a direct pyexpat handler building the record dicts, no element tree at all
+- 'etree': xml.etree.ElementTree from the standard library
+
+Set the ICECAT_XML_BACKEND environment variable or call use() to pick one.
+'''
+import io
+import os
+import xml.etree.ElementTree as ET
+from xml.parsers import expat
+
+from IceCat._lazy import lazy_import
+
+# imported on first use of the lxml backend, see _lazy
+try:
+    lxml_etree = lazy_import('lxml.etree')
+except ImportError:
+    lxml_etree = None
+
+BACKENDS = ('lxml', 'expat', 'etree')
+
+_backend = None
+
+
+def available():
+    '''
+    Return the names of the backends that can be used here, fastest first
+    '''
+    return [name for name in BACKENDS if name != 'lxml' or lxml_etree is not None]
+
+
+def use(name=None):
+    '''
+    Select a backend. None picks $ICECAT_XML_BACKEND or the fastest available one. Returns the backend name.
+
+    :param name: one of BACKENDS
+    '''
+    global _backend
+    name = name or os.environ.get('ICECAT_XML_BACKEND') or available()[0]
+    if name not in available():
+        raise ValueError("XML backend {!r} is not available, use one of {}".format(name, ', '.join(available())))
+    _backend = name
+    return name
+
+
+def backend():
+    '''
+    Return the name of the backend in use
+    '''
+    return _backend or use()
+
+
+def parse(source):
+    '''
+    Parse a whole document and return its root element
+
+    :param source: file name or binary file object
+    '''
+    return ET.parse(source).getroot()
+
+
+def iterparse(source, events=('end',)):
+    '''
+    Stream (event, element) pairs of a document, like xml.etree.ElementTree.iterparse()
+
+    :param source: file name or binary file object
+    :param events: tuple of 'start' and 'end'
+    '''
+    if backend() == 'lxml':
+        return lxml_etree.iterparse(source, events=events, remove_comments=True, remove_pis=True)
+    return ET.iterparse(source, events=events)
+
+
+def _push(item, key, value, postprocessor):
+    # add key to the record dict item, xmltodict style: a repeated key becomes a list
+    if postprocessor is not None:
+        result = postprocessor(None, key, value)
+        if result is None:
+            return item
+        key, value = result
+    if item is None:
+        item = {}
+    if key in item:
+        current = item[key]
+        if isinstance(current, list):
+            current.append(value)
+        else:
+            item[key] = [current, value]
+    else:
+        item[key] = value
+    return item
+
+
+def _attributes(attrib, postprocessor):
+    item = None
+    for key, value in attrib:
+        item = _push(item, key, value, postprocessor)
+    return item
+
+
+def _finish(item, text, postprocessor):
+    # character data is stripped, an element with attributes or children keeps it as '#text'
+    text = text.strip() if text else None
+    if item is None:
+        return text or None
+    if text:
+        item = _push(item, '#text', text, postprocessor)
+    return item
+
+
+def element_to_dict(elem, postprocessor=None):
+    '''
+    Convert an element and its children to a dict, the same structure xmltodict builds
+    for it with attr_prefix=''. postprocessor(path, key, value) is called for every key, path is None.
+    '''
+    item = _attributes(elem.attrib.items(), postprocessor)
+    text = [elem.text] if elem.text else []
+    for child in elem:
+        if isinstance(child.tag, str):
+            item = _push(item, child.tag, element_to_dict(child, postprocessor), postprocessor)
+        if child.tail:
+            text.append(child.tail)
+    return _finish(item, ''.join(text), postprocessor)
+
+
+class _ExpatRecords(object):
+    # builds record dicts straight from the expat callbacks
+    def __init__(self, tag, postprocessor, records):
+        self.tag = tag
+        self.postprocessor = postprocessor
+        self.records = records
+        # [name, item, character data] of the open elements of the current record
+        self.stack = []
+
+    def start(self, name, attrs):
+        if not self.stack and name != self.tag:
+            return
+        # ordered_attributes gives a flat [name, value, name, value ...] list
+        item = _attributes(zip(attrs[::2], attrs[1::2]), self.postprocessor) if attrs else None
+        self.stack.append([name, item, []])
+
+    def end(self, name):
+        if not self.stack:
+            return
+        name, item, data = self.stack.pop()
+        item = _finish(item, ''.join(data), self.postprocessor)
+        if self.stack:
+            parent = self.stack[-1]
+            parent[1] = _push(parent[1], name, item, self.postprocessor)
+        else:
+            self.records.append(item)
+
+    def data(self, text):
+        if self.stack:
+            self.stack[-1][2].append(text)
+
+
+def _expat_records(source, tag, postprocessor):
+    records = []
+    handler = _ExpatRecords(tag, postprocessor, records)
+    parser = expat.ParserCreate()
+    parser.buffer_text = True
+    parser.ordered_attributes = True
+    parser.StartElementHandler = handler.start
+    parser.EndElementHandler = handler.end
+    parser.CharacterDataHandler = handler.data
+
+    close = False
+    if isinstance(source, str):
+        source = open(source, 'rb')
+        close = True
+    try:
+        if isinstance(source, bytes):
+            parser.Parse(source, True)
+            yield from records
+            return
+        while True:
+            block = source.read(1024 * 1024)
+            parser.Parse(block, not block)
+            yield from records
+            del records[:]
+            if not block:
+                break
+    finally:
+        if close:
+            source.close()
+
+
+def _lxml_records(source, tag, postprocessor):
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    for event, elem in lxml_etree.iterparse(source, events=('end',), tag=tag, remove_comments=True,
+                                            remove_pis=True):
+        yield element_to_dict(elem, postprocessor)
+        # drop the record and the ones before it
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+
+
+def _etree_records(source, tag, postprocessor):
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    parents = []
+    inside = 0
+    for event, elem in ET.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            parents.append(elem)
+            if elem.tag == tag:
+                inside += 1
+            continue
+        parents.pop()
+        if elem.tag != tag:
+            continue
+        inside -= 1
+        if inside:
+            # a record nested in a record is part of the outer one
+            continue
+        yield element_to_dict(elem, postprocessor)
+        elem.clear()
+        if parents:
+            parents[-1].remove(elem)
+
+
+_records = {
+    'lxml': _lxml_records,
+    'expat': _expat_records,
+    'etree': _etree_records,
+}
+
+
+def parse_records(source, tag, postprocessor=None):
+    '''
+    Stream the elements named tag of a document as dicts, see element_to_dict().
+    Records nested in records are kept inside the outer one.
+
+    :param source: file name, binary file object or bytes
+    :param tag: record element name, e.g. 'file'
+    :param postprocessor: optional xmltodict style postprocessor(path, key, value) returning (key, value)
+                          or None to drop the key. Called for the keys inside the records, not the records.
+    '''
+    return _records[backend()](source, tag, postprocessor)
@@ -0,0 +1,85 @@
+'''
+Memory and build time of a list of product dicts against a CompactCatalog.
+
+The products of the test index are repeated --copies times, each with the detail
+fields name, title and release_date set as a detail run would.  Memory is measured
+with tracemalloc, build time is the median of --runs.
+
+    python benchmarks/compact.py --copies 20000
+'''
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from IceCat import compact
+from IceCat import index_parser
+
+INDEX = os.path.join(ROOT, '_test_data', 'daily.index.test.xml')
+
+
+def allocated(build):
+    '''
+    Return the result of build() and the bytes it allocated
+    '''
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+
+def measure(func, runs):
+    times = []
+    for i in range(runs):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def products(sample, copies):
+    # fresh strings per product, as parsing gives them
+    for i in range(copies):
+        for item in sample:
+            item = json.loads(json.dumps(item))
+            item['product_id'] = str(int(item['product_id']) + i * 1000000)
+            item['name'] = '{} {}'.format(item['model_name'], i)
+            item['title'] = 'Title of {}'.format(item['product_id'])
+            item['release_date'] = '2016-02-08'
+            yield item
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--copies', type=int, default=5000, help='times the test index products are repeated')
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    sample = list(index_parser.iter_index(INDEX))
+    source = list(products(sample, args.copies))
+    dicts, dict_size = allocated(lambda: [json.loads(json.dumps(item)) for item in source])
+
+    def build():
+        catalog = compact.CompactCatalog()
+        catalog.extend(json.loads(json.dumps(item)) for item in source)
+        return catalog
+
+    catalog, compact_size = allocated(build)
+    print('{} products, {} with overflow keys'.format(len(dicts), len(catalog._extra)))
+    print('{:50} {:8.1f} MB'.format('dicts', dict_size / 2 ** 20))
+    print('{:50} {:8.1f} MB'.format('CompactCatalog', compact_size / 2 ** 20))
+    print('{:50} {:8.1f} ms'.format('CompactCatalog.extend', measure(
+        lambda: compact.CompactCatalog().extend(dicts), args.runs) * 1000))
+    print('{:50} {:8.1f} ms'.format('iterate rows as dicts', measure(
+        lambda: [dict(row) for row in catalog], args.runs) * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+'''
+Cold start benchmark of the package imports.
+
+Every scenario runs in a fresh interpreter, the median of --runs is reported.
+
+    python benchmarks/import_time.py --runs 15
+'''
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = [
+    ('import IceCat.IceCat', 'from IceCat import IceCat'),
+    ('category mapping from a local file',
+     "from IceCat import IceCat; IceCat.IceCatCategoryMapping(xml_file='_test_data/CategoriesList.test.xml', "
+     "data_dir='_test_data/')"),
+    ('import IceCat.IceCat and load every subsystem',
+     'from IceCat import IceCat, bulk_downloader, index_parser, transport, export, spill; '
+     'bulk_downloader.fetchURLs, index_parser.parse_range, transport.Transport, export.write, spill.SpillCatalog'),
+    ('import requests, for reference', 'import requests'),
+]
+
+TIMER = 'import time; _start = time.perf_counter()\n{}\nprint(time.perf_counter() - _start)'
+
+
+def measure(code, runs):
+    '''
+    Return the median seconds of code in a fresh interpreter
+    '''
+    times = []
+    for i in range(runs):
+        out = subprocess.check_output([sys.executable, '-c', TIMER.format(code)], cwd=ROOT,
+                                      stderr=subprocess.DEVNULL)
+        times.append(float(out.decode().split()[-1]))
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=9)
+    args = parser.parse_args()
+    for name, code in SCENARIOS:
+        print('{:50} {:8.1f} ms'.format(name, measure(code, args.runs) * 1000))
+
+
+if __name__ == '__main__':
+    main()
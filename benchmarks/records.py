@@ -0,0 +1,69 @@
+'''
+Memory and serialization time of catalog dicts against typed product records.
+
+The products of the test index are repeated --copies times.  Memory is measured
+with tracemalloc, serialization is the median of --runs.
+
+    python benchmarks/records.py --copies 20000
+'''
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from IceCat import index_parser
+from IceCat import schema
+
+INDEX = os.path.join(ROOT, '_test_data', 'daily.index.test.xml')
+
+
+def allocated(build):
+    '''
+    Return the result of build() and the bytes it allocated
+    '''
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+
+def measure(func, runs):
+    times = []
+    for i in range(runs):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--copies', type=int, default=5000, help='times the test index products are repeated')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    sample = list(index_parser.iter_index(INDEX))
+    product_schema = schema.ProductSchema()
+    dicts, dict_size = allocated(lambda: [json.loads(json.dumps(item)) for i in range(args.copies) for item in sample])
+    # built from copies of the dicts, so no strings are shared with them
+    records, record_size = allocated(lambda: [product_schema.from_dict(json.loads(json.dumps(item)))
+                                              for item in dicts])
+    print('{} products'.format(len(dicts)))
+    print('{:50} {:8.1f} MB'.format('dicts', dict_size / 2 ** 20))
+    print('{:50} {:8.1f} MB'.format('typed records', record_size / 2 ** 20))
+    print('{:50} {:8.1f} ms'.format('json.dumps of the dicts', measure(lambda: [json.dumps(item) for item in dicts],
+                                                                     args.runs) * 1000))
+    print('{:50} {:8.1f} ms'.format('ProductSchema.dumps of the records ({})'.format(
+        'orjson' if schema.orjson else 'json'), measure(lambda: [product_schema.dumps(r) for r in records],
+                                                        args.runs) * 1000))
+
+
+if __name__ == '__main__':
+    main()
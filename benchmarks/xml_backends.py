@@ -0,0 +1,97 @@
+'''
+Benchmark of the XML parser backends on a product index.
+
+The test index is repeated --copies times into a synthetic index in a
+temporary directory, then parsed with every available backend and, when it is
+installed, with xmltodict as the package did before xml_backend.  The median
+of --runs is reported.
+
+    python benchmarks/xml_backends.py --copies 5000 --runs 5
+'''
+import argparse
+import os
+import re
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from IceCat import xml_backend
+
+INDEX = os.path.join(ROOT, '_test_data', 'daily.index.test.xml')
+
+
+def _lower(path, key, value):
+    if key == 'Country_Markets':
+        return None
+    return key.lower(), value
+
+
+def make_index(filename, copies):
+    '''
+    Write an index with the <file> elements of the test index repeated copies times
+    '''
+    with open(INDEX, 'rb') as f:
+        data = f.read()
+    start = data.index(b'<file ')
+    end = data.rindex(b'</files.index>')
+    files = data[start:end]
+    with open(filename, 'wb') as f:
+        f.write(data[:start])
+        for i in range(copies):
+            # distinct product ids, as in a real index
+            f.write(re.sub(rb'Product_ID="(\d+)"', lambda m: b'Product_ID="' + m.group(1) + str(i).encode() + b'"',
+                           files))
+        f.write(data[end:])
+
+
+def run_backend(name, filename):
+    xml_backend.use(name)
+    return sum(1 for item in xml_backend.parse_records(filename, 'file', _lower))
+
+
+def run_xmltodict(filename):
+    import xmltodict
+    with open(filename, 'rb') as f:
+        data = xmltodict.parse(f, attr_prefix='', postprocessor=_lower)
+    return len(data['icecat-interface']['files.index']['file'])
+
+
+def measure(func, args, runs):
+    '''
+    Return the median seconds and the result of func(*args)
+    '''
+    times = []
+    for i in range(runs):
+        start = time.perf_counter()
+        result = func(*args)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--copies', type=int, default=2000, help='times the test index is repeated')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, 'files.index.xml')
+        make_index(filename, args.copies)
+        print('index of {:.1f} MB'.format(os.path.getsize(filename) / 2 ** 20))
+        cases = [('backend ' + name, run_backend, (name, filename)) for name in xml_backend.available()]
+        try:
+            import xmltodict
+            cases.append(('xmltodict, for reference', run_xmltodict, (filename,)))
+        except ImportError:
+            pass
+        for name, func, func_args in cases:
+            seconds, count = measure(func, func_args, args.runs)
+            print('{:50} {:8.1f} ms  {} products'.format(name, seconds * 1000, count))
+
+
+if __name__ == '__main__':
+    main()
@@ -12,10 +12,17 @@ setup(
     include_package_data = True,
     url = "https://github.com/moonlitesolutions/pyIceCat",
     description = "Python based parser for IceCat catalog. ",
+    python_requires = ">=3.7",
     install_requires = [
         "requests>=2.2.1",
         "progressbar2>=3.6.0",
-        "urllib3>=1.14",
-        "xmltodict>=0.9.2"
+        "urllib3>=1.14"
     ],
-)
\ No newline at end of file
+    extras_require = {
+        "parquet": ["pyarrow"],
+        "lxml": ["lxml"],
+    },
+    entry_points = {
+        "console_scripts": ["icecat = IceCat.cli:main"],
+    },
+)
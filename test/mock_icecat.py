@@ -0,0 +1,89 @@
+'''
+Local stand-in for the IceCat product xml server, used by the offline tests
+'''
+import hashlib
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+PRODUCT_XML = '''<?xml version="1.0" encoding="UTF-8"?>
+<ICECAT-interface>
+  <Product ID="{id}" Name="Product {id}" Prod_id="P-{id}">
+    <ProductDescription ID="1{id}" LongDesc="Long description of {id}" ShortDesc="Xeon {id}" langid="1"/>
+    <ShortSummaryDescription>Short summary {id}</ShortSummaryDescription>
+    <LongSummaryDescription>Long summary {id}</LongSummaryDescription>
+  </Product>
+</ICECAT-interface>
+'''
+
+
+class _Handler(BaseHTTPRequestHandler):
+	'''
+	serves paths in server.files as is, /.../<id>.xml as a product xml document.
+	ids in server.missing and anything else are 404. product xml has an ETag and
+	answers a matching If-None-Match with 304, server.versions changes the content of an id
+	'''
+	protocol_version = 'HTTP/1.1'
+
+	def do_GET(self):
+		self.server.requests.append(self.path)
+		self.server.clients.add(self.client_address)
+		if self.path in self.server.files:
+			time.sleep(self.server.file_delay)
+			self._send(self.server.files[self.path])
+			return
+		if not self.path.endswith('.xml'):
+			self.send_error(404)
+			return
+		product_id = os.path.basename(self.path)[:-4]
+		if product_id in self.server.missing:
+			self.send_error(404)
+			return
+		if product_id in self.server.slow:
+			time.sleep(self.server.delay)
+		body = PRODUCT_XML.format(id=product_id).encode() + self.server.versions.get(product_id, '').encode()
+		etag = '"{}"'.format(hashlib.sha1(body).hexdigest()[:16])
+		if self.headers.get('If-None-Match') == etag:
+			self.send_response(304)
+			self.send_header('ETag', etag)
+			self.send_header('Content-Length', '0')
+			self.end_headers()
+			return
+		self._send(body, etag)
+
+	def _send(self, body, etag=None):
+		self.send_response(200)
+		self.send_header('Content-Type', 'text/xml')
+		if etag:
+			self.send_header('ETag', etag)
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, *args):
+		pass
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+	daemon_threads = True
+
+
+def mock_server():
+	'''
+	start a local product xml server, returns (server, base url)
+	'''
+	server = _Server(('127.0.0.1', 0), _Handler)
+	server.requests = []
+	server.clients = set()
+	server.slow = set()
+	server.missing = set()
+	server.versions = {}
+	server.files = {}
+	server.file_delay = 0
+	server.delay = 2
+	t = threading.Thread(target=server.serve_forever)
+	t.daemon = True
+	t.start()
+	return server, 'http://127.0.0.1:{}/'.format(server.server_address[1])
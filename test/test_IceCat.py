@@ -1,8 +1,12 @@
 from IceCat import IceCat
+from IceCat import export
+from mock_icecat import mock_server
 import sys, os
 import logging
 import unittest
 import cProfile, pstats
+import json
+import tempfile
 
 class ModTest(unittest.TestCase):
 
@@ -52,6 +56,16 @@ class ModTest(unittest.TestCase):
 													data_dir=self.data_dir)
 		self.assertEqual(categories.get_cat_byId("1648"), 'popcorn poppers')
 
+	def testCategoryTitles(self):
+		'''
+		title cased category names are computed once and reused
+		'''
+		categories = IceCat.IceCatCategoryMapping(log=self.log, xml_file="_test_data/CategoriesList.test.xml",
+													data_dir=self.data_dir)
+		titles = categories.get_titles()
+		self.assertEqual(titles["1648"], 'Popcorn Poppers')
+		self.assertIs(categories.get_titles(), titles)
+
 	def testSupplierMaps(self):
 		'''
 		download live supplier reference file.  Verify parsing 7 = Acer
@@ -83,6 +97,371 @@ class ModTest(unittest.TestCase):
 
 
 
+	def testMemoryLimit(self):
+		'''
+		a memory budgeted catalog spills to disk and gives the same output, details included
+		'''
+		server, base = mock_server()
+		baseurl = IceCat.IceCatProductDetails.baseurl
+		IceCat.IceCatProductDetails.baseurl = base
+		try:
+			tmp = tempfile.mkdtemp() + '/'
+			categories = IceCat.IceCatCategoryMapping(log=self.log, xml_file="_test_data/CategoriesList.test.xml",
+														data_dir=self.data_dir)
+			suppliers = IceCat.IceCatSupplierMapping(log=self.log, xml_file="_test_data/supplier_mapping.xml",
+														data_dir=self.data_dir)
+			outputs = []
+			for memory_limit in (None, 1000):
+				catalog = IceCat.IceCatCatalog(log=self.log, xml_file="_test_data/daily.index.test.xml",
+												suppliers=suppliers, categories=categories, data_dir=tmp,
+												memory_limit=memory_limit)
+				if memory_limit:
+					self.assertGreater(catalog.get_data().spilled, 0)
+				catalog._categories = {'911': '', '375': '', '989': ''}
+				catalog.add_product_details_parallel(keys=['ProductDescription[@ShortDesc]'], connections=2)
+				self.assertEqual(catalog.get_data()[0]['shortdesc'], 'Xeon 3827')
+				catalog.dump_to_file(tmp + 'out.json')
+				with open(tmp + 'out.json') as f:
+					outputs.append(f.read())
+			self.assertEqual(outputs[1], outputs[0])
+
+			# a snapshot is streamed into the budgeted store, JSON array or NDJSON alike
+			export.write(catalog.get_data(), tmp + 'out.ndjson')
+			for snapshot in (tmp + 'out.json', tmp + 'out.ndjson'):
+				merged = IceCat.IceCatCatalog(log=self.log, xml_file="_test_data/daily.index.test.xml",
+												suppliers=suppliers, categories=categories, data_dir=tmp,
+												memory_limit=1000, snapshot=snapshot)
+				self.assertGreater(merged.get_data().spilled, 0)
+				self.assertEqual(merged.get_data()[0]['shortdesc'], 'Xeon 3827')
+
+			markets = IceCat.IceCatMultiMarketCatalog(log=self.log, markets=['EN', 'CZ'], suppliers=suppliers,
+														categories=categories, data_dir=tmp, memory_limit=1000,
+														xml_files={'EN': "_test_data/daily.index.test.xml",
+																	'CZ': "_test_data/daily.index.test.xml"})
+			self.assertGreater(markets.get_data().spilled, 0)
+			self.assertEqual(markets.get_data()[0]['markets'], ['CZ', 'EN'])
+			self.assertRaises(ValueError, IceCat.IceCatCatalog, compact=True, memory_limit=1000,
+								xml_file="_test_data/daily.index.test.xml", data_dir=tmp)
+		finally:
+			IceCat.IceCatProductDetails.baseurl = baseurl
+			server.shutdown()
+
+	def testSnapshotMerge(self):
+		'''
+		merge a daily index onto a snapshot from an earlier run. no internet connections in this test
+		'''
+		categories = IceCat.IceCatCategoryMapping(log=self.log, xml_file="_test_data/CategoriesList.test.xml",
+													data_dir=self.data_dir)
+		suppliers = IceCat.IceCatSupplierMapping(log=self.log, auth=self.auth, xml_file="_test_data/supplier_mapping.xml",
+													data_dir=self.data_dir)
+		catalog = IceCat.IceCatCatalog(log=self.log, xml_file="_test_data/daily.index.test.xml",
+										suppliers=suppliers, categories=categories, data_dir=self.data_dir)
+		products = catalog.get_data()
+		# 3827 is new, 108912 was updated, 110722 is newer in the snapshot than in the index
+		snapshot_products = [item for item in products if item['product_id'] != '3827']
+		snapshot_products[0]['updated'] = '20160101000000'
+		snapshot_products[0]['shortdesc'] = 'old details'
+		snapshot_products[1]['updated'] = '20990101000000'
+
+		tmp = tempfile.mkdtemp()
+		snapshot = os.path.join(tmp, 'snapshot.json')
+		with open(snapshot, 'w') as f:
+			json.dump(snapshot_products, f)
+		# 140202 goes off market
+		with open("_test_data/daily.index.test.xml") as f:
+			daily = f.read().replace('Product_ID="140202" Updated="20160208150856" Quality="ICECAT" Supplier_id="263" Prod_ID="UG-3220" Catid="381" On_Market="1"',
+									'Product_ID="140202" Updated="20160301000000" Quality="ICECAT" Supplier_id="263" Prod_ID="UG-3220" Catid="381" On_Market="0"')
+		daily_file = os.path.join(tmp, 'daily.index.xml')
+		with open(daily_file, 'w') as f:
+			f.write(daily)
+
+		for options in ({}, {'compact': True}, {'memory_limit': 500}):
+			merged = IceCat.IceCatCatalog(log=self.log, xml_file=daily_file, snapshot=snapshot,
+											suppliers=suppliers, categories=categories, data_dir=tmp + '/', **options)
+			self.assertEqual(len(merged.get_data()), 6)
+			self.assertEqual(merged.changes['added'], ['3827'])
+			self.assertEqual(merged.changes['updated'], ['108912'])
+			self.assertEqual(merged.changes['off_market'], ['140202'])
+			self.assertEqual(sorted(item['product_id'] for item in merged._detail_items()), ['108912', '140202', '3827'])
+			self.assertEqual(merged.get_data()[-1]['supplier'], 'Acer')
+			self.assertNotIn('shortdesc', merged.get_data()[0])
+			self.assertEqual(merged.get_data()[1]['updated'], '20990101000000')
+
+			merged.write_snapshot(os.path.join(tmp, 'next.json'))
+			with open(os.path.join(tmp, 'next.changes.json')) as f:
+				self.assertEqual(json.load(f)['added'], ['3827'])
+
+	def testDetailsDeadline(self):
+		'''
+		detail download against a local server with a time budget. pending products are picked up next run
+		'''
+		server, base = mock_server()
+		server.slow.add('110722')
+		server.delay = 3
+		baseurl = IceCat.IceCatProductDetails.baseurl
+		IceCat.IceCatProductDetails.baseurl = base
+		try:
+			tmp = tempfile.mkdtemp() + '/'
+			categories = IceCat.IceCatCategoryMapping(log=self.log, xml_file="_test_data/CategoriesList.test.xml",
+														data_dir=self.data_dir)
+			suppliers = IceCat.IceCatSupplierMapping(log=self.log, xml_file="_test_data/supplier_mapping.xml",
+														data_dir=self.data_dir)
+			catalog = IceCat.IceCatCatalog(log=self.log, xml_file="_test_data/daily.index.test.xml",
+											suppliers=suppliers, categories=categories, data_dir=tmp)
+			catalog._categories = {'911': '', '375': '', '989': ''}
+			pending = catalog.add_product_details_parallel(keys=['ProductDescription[@ShortDesc]'], connections=1,
+															priority='updated', deadline=1)
+			# most recently updated first: 110722 stalls past the deadline, it is still downloaded and parsed.
+			# 108912 and 3827 are left pending, in priority order
+			self.assertEqual(pending, ['108912', '3827'])
+			details = {item['product_id']: item.get('shortdesc') for item in catalog.get_data()}
+			self.assertEqual(details, {'3827': None, '108912': None, '110722': 'Xeon 110722'})
+			self.assertTrue(os.path.isfile(tmp + 'product_xml/pending.json'))
+
+			server.slow.clear()
+			catalog = IceCat.IceCatCatalog(log=self.log, xml_file="_test_data/daily.index.test.xml",
+											suppliers=suppliers, categories=categories, data_dir=tmp)
+			catalog._categories = {'911': ''}
+			pending = catalog.add_product_details_parallel(keys=['ProductDescription[@ShortDesc]'], connections=1)
+			self.assertEqual(pending, [])
+			self.assertEqual(sorted(item['product_id'] for item in catalog.get_data()), ['108912', '3827'])
+			self.assertEqual([item['shortdesc'] for item in catalog.get_data()], ['Xeon 3827', 'Xeon 108912'])
+			self.assertFalse(os.path.isfile(tmp + 'product_xml/pending.json'))
+		finally:
+			IceCat.IceCatProductDetails.baseurl = baseurl
+			server.shutdown()
+
+	def testFailedRetry(self):
+		'''
+		products whose product xml was answered with a bad status are saved and downloaded again by the next run
+		'''
+		server, base = mock_server()
+		server.missing.add('110722')
+		baseurl = IceCat.IceCatProductDetails.baseurl
+		IceCat.IceCatProductDetails.baseurl = base
+		try:
+			tmp = tempfile.mkdtemp() + '/'
+			categories = IceCat.IceCatCategoryMapping(log=self.log, xml_file="_test_data/CategoriesList.test.xml",
+														data_dir=self.data_dir)
+			suppliers = IceCat.IceCatSupplierMapping(log=self.log, xml_file="_test_data/supplier_mapping.xml",
+														data_dir=self.data_dir)
+			catalog = IceCat.IceCatCatalog(log=self.log, xml_file="_test_data/daily.index.test.xml",
+											suppliers=suppliers, categories=categories, data_dir=tmp)
+			catalog._categories = {'911': '', '375': '', '989': ''}
+			self.assertEqual(catalog.add_product_details_parallel(keys=['ProductDescription[@ShortDesc]'],
+																	connections=1), [])
+			self.assertEqual(catalog.failed, ['110722'])
+			self.assertTrue(os.path.isfile(tmp + 'product_xml/failed.json'))
+
+			# the next run lists the product in none of its categories, it is still downloaded again
+			server.missing.clear()
+			del server.requests[:]
+			catalog = IceCat.IceCatCatalog(log=self.log, xml_file="_test_data/daily.index.test.xml",
+											suppliers=suppliers, categories=categories, data_dir=tmp)
+			catalog._categories = {'911': ''}
+			catalog.add_product_details_parallel(keys=['ProductDescription[@ShortDesc]'], connections=1)
+			self.assertEqual(catalog.failed, [])
+			self.assertTrue(any(path.endswith('/110722.xml') for path in server.requests))
+			details = {item['product_id']: item.get('shortdesc') for item in catalog.get_data()}
+			self.assertEqual(details['110722'], 'Xeon 110722')
+			self.assertFalse(os.path.isfile(tmp + 'product_xml/failed.json'))
+		finally:
+			IceCat.IceCatProductDetails.baseurl = baseurl
+			server.shutdown()
+
+	def testSnapshotUnchangedDetails(self):
+		'''
+		products updated by the index keep their snapshot details when the product xml did not change
+		'''
+		server, base = mock_server()
+		baseurl = IceCat.IceCatProductDetails.baseurl
+		IceCat.IceCatProductDetails.baseurl = base
+		try:
+			tmp = tempfile.mkdtemp() + '/'
+			categories = IceCat.IceCatCategoryMapping(log=self.log, xml_file="_test_data/CategoriesList.test.xml",
+														data_dir=self.data_dir)
+			suppliers = IceCat.IceCatSupplierMapping(log=self.log, xml_file="_test_data/supplier_mapping.xml",
+														data_dir=self.data_dir)
+			keys = ['ProductDescription[@ShortDesc]']
+			catalog = IceCat.IceCatCatalog(log=self.log, xml_file="_test_data/daily.index.test.xml",
+											suppliers=suppliers, categories=categories, data_dir=tmp)
+			catalog._categories = {'911': '', '375': '', '989': ''}
+			catalog.add_product_details_parallel(keys=keys, connections=2)
+			snapshot_products = catalog.get_data()
+			for item in snapshot_products:
+				item['updated'] = '20160101000000'
+				item['shortdesc'] = 'snapshot ' + item['product_id']
+				# an index field today's index no longer lists
+				item['ean_upcs'] = ['4006381333931']
+			snapshot = tmp + 'snapshot.json'
+			with open(snapshot, 'w') as f:
+				json.dump(snapshot_products, f)
+
+			server.versions['108912'] = '<!-- new -->'
+			del server.requests[:]
+			merged = IceCat.IceCatCatalog(log=self.log, xml_file="_test_data/daily.index.test.xml", snapshot=snapshot,
+											suppliers=suppliers, categories=categories, data_dir=tmp)
+			merged._categories = {'911': '', '375': '', '989': ''}
+			merged.add_product_details_parallel(keys=keys, connections=1)
+			self.assertEqual(sorted(merged.changes['updated']), ['108912', '110722', '3827'])
+			self.assertEqual(len(server.requests), 3)
+			self.assertEqual(sorted(merged.unchanged), ['110722', '3827'])
+			details = {item['product_id']: item['shortdesc'] for item in merged.get_data()}
+			self.assertEqual(details, {'3827': 'snapshot 3827', '108912': 'Xeon 108912', '110722': 'snapshot 110722'})
+			self.assertNotIn(['4006381333931'], [item.get('ean_upcs') for item in merged.get_data()])
+		finally:
+			IceCat.IceCatProductDetails.baseurl = baseurl
+			server.shutdown()
+
+	def testUnchangedProductKey(self):
+		'''
+		unchanged products get the same detail keys as parsed ones, Product sets index keys like prod_id
+		'''
+		server, base = mock_server()
+		baseurl = IceCat.IceCatProductDetails.baseurl
+		IceCat.IceCatProductDetails.baseurl = base
+		try:
+			tmp = tempfile.mkdtemp() + '/'
+			categories = IceCat.IceCatCategoryMapping(log=self.log, xml_file="_test_data/CategoriesList.test.xml",
+														data_dir=self.data_dir)
+			suppliers = IceCat.IceCatSupplierMapping(log=self.log, xml_file="_test_data/supplier_mapping.xml",
+														data_dir=self.data_dir)
+			keys = ['Product', 'ProductDescription[@ShortDesc]']
+			catalog = IceCat.IceCatCatalog(log=self.log, xml_file="_test_data/daily.index.test.xml",
+											suppliers=suppliers, categories=categories, data_dir=tmp)
+			catalog._categories = {'911': '', '375': '', '989': ''}
+			catalog.add_product_details_parallel(keys=keys, connections=2)
+			snapshot_products = catalog.get_data()
+			for item in snapshot_products:
+				item['updated'] = '20160101000000'
+			snapshot = tmp + 'snapshot.json'
+			with open(snapshot, 'w') as f:
+				json.dump(snapshot_products, f)
+
+			server.versions['108912'] = '<!-- new -->'
+			merged = IceCat.IceCatCatalog(log=self.log, xml_file="_test_data/daily.index.test.xml", snapshot=snapshot,
+											suppliers=suppliers, categories=categories, data_dir=tmp)
+			merged._categories = {'911': '', '375': '', '989': ''}
+			merged.add_product_details_parallel(keys=keys, connections=1)
+			self.assertEqual(sorted(merged.unchanged), ['110722', '3827'])
+			products = merged.get_data()
+			self.assertEqual({item['product_id']: item['prod_id'] for item in products},
+							 {'3827': 'P-3827', '108912': 'P-108912', '110722': 'P-110722'})
+			for item in products:
+				self.assertEqual((item['id'], item['name']), (item['product_id'], 'Product ' + item['product_id']))
+				self.assertIn('shortdesc', item)
+
+			# other detail keys than the manifest noted, the product xml is parsed
+			server.versions['108912'] = '<!-- newer -->'
+			again = IceCat.IceCatCatalog(log=self.log, xml_file="_test_data/daily.index.test.xml", snapshot=snapshot,
+											suppliers=suppliers, categories=categories, data_dir=tmp)
+			again._categories = {'911': '', '375': '', '989': ''}
+			again.add_product_details_parallel(keys=['Product'], connections=1)
+			self.assertEqual(again.unchanged, [])
+			self.assertEqual(sorted(item['name'] for item in again.get_data()),
+							 ['Product 108912', 'Product 110722', 'Product 3827'])
+		finally:
+			IceCat.IceCatProductDetails.baseurl = baseurl
+			server.shutdown()
+
+	def testLazyDetails(self):
+		'''
+		lazy detail records parse their product xml on first access to a detail field
+		'''
+		server, base = mock_server()
+		baseurl = IceCat.IceCatProductDetails.baseurl
+		IceCat.IceCatProductDetails.baseurl = base
+		try:
+			tmp = tempfile.mkdtemp() + '/'
+			categories = IceCat.IceCatCategoryMapping(log=self.log, xml_file="_test_data/CategoriesList.test.xml",
+														data_dir=self.data_dir)
+			suppliers = IceCat.IceCatSupplierMapping(log=self.log, xml_file="_test_data/supplier_mapping.xml",
+														data_dir=self.data_dir)
+			catalog = IceCat.IceCatCatalog(log=self.log, xml_file="_test_data/daily.index.test.xml",
+											suppliers=suppliers, categories=categories, data_dir=tmp)
+			catalog._categories = {'911': '', '375': '', '989': ''}
+			catalog.add_product_details_parallel(keys=['ProductDescription[@ShortDesc]', 'ShortSummaryDescription'],
+												connections=2, lazy=True)
+		finally:
+			IceCat.IceCatProductDetails.baseurl = baseurl
+			server.shutdown()
+
+		products = catalog.get_data()
+		self.assertTrue(all(isinstance(item, IceCat.LazyProduct) for item in products))
+		self.assertEqual(products[0]['prod_id'], u'91.42R29.002')
+		self.assertFalse(products[0].resolved)
+		products[1]['shortdesc'] = 'edited'
+		self.assertEqual(products[0]['shortdesc'], 'Xeon 3827')
+		self.assertTrue(products[0].resolved)
+		self.assertEqual(products[1]['shortdesc'], 'edited')
+		self.assertEqual(dict(products[2])['shortsummarydescription'], 'Short summary 110722')
+
+		file = tmp + 'lazy.json'
+		catalog.dump_to_file(file)
+		with open(file) as f:
+			self.assertEqual(json.load(f)[2]['shortdesc'], 'Xeon 110722')
+
+	def testMultiMarket(self):
+		'''
+		two market indexes downloaded from a local server, products deduplicated and markets merged
+		'''
+		with open("_test_data/daily.index.test.xml", 'rb') as f:
+			daily = f.read()
+		# second market lists 140206 with a newer update
+		other = daily.replace(b'Product_ID="140206" Updated="20160208150858"', b'Product_ID="140206" Updated="20160301000000"')
+		other = other.replace(b'<Country_Market Value="US" />', b'<Country_Market Value="CZ" />')
+		server, base = mock_server()
+		server.files['/export/freexml/EN/daily.index.xml'] = daily
+		server.files['/export/freexml/CZ/daily.index.xml'] = other
+		baseurl = IceCat.IceCatMultiMarketCatalog.MARKET_BASEURL
+		IceCat.IceCatMultiMarketCatalog.MARKET_BASEURL = base + 'export/freexml/{}/'
+		try:
+			categories = IceCat.IceCatCategoryMapping(log=self.log, xml_file="_test_data/CategoriesList.test.xml",
+														data_dir=self.data_dir)
+			suppliers = IceCat.IceCatSupplierMapping(log=self.log, xml_file="_test_data/supplier_mapping.xml",
+														data_dir=self.data_dir)
+			catalog = IceCat.IceCatMultiMarketCatalog(log=self.log, markets=['EN', 'CZ'], suppliers=suppliers,
+														categories=categories, data_dir=tempfile.mkdtemp() + '/')
+		finally:
+			IceCat.IceCatMultiMarketCatalog.MARKET_BASEURL = baseurl
+			server.shutdown()
+
+		products = catalog.get_data()
+		self.assertEqual(len(server.requests), 2)
+		self.assertEqual([item['product_id'] for item in products], ['3827', '108912', '110722', '126442', '140202', '140206'])
+		self.assertEqual(products[0]['markets'], ['CZ', 'EN'])
+		self.assertEqual(products[0]['country_markets'], ['CZ', 'US'])
+		self.assertEqual(products[5]['updated'], '20160301000000')
+		self.assertEqual(products[5]['category'], 'Living Room Bookcases')
+		self.assertEqual(products[2]['supplier'], 'Intel')
+
+	def testMultiMarketPartial(self):
+		'''
+		a market whose index fails to download is skipped, the others are kept. none at all is an error
+		'''
+		with open("_test_data/daily.index.test.xml", 'rb') as f:
+			daily = f.read()
+		server, base = mock_server()
+		server.files['/export/freexml/CZ/daily.index.xml'] = daily
+		server.missing.add('daily.index')
+		baseurl = IceCat.IceCatMultiMarketCatalog.MARKET_BASEURL
+		IceCat.IceCatMultiMarketCatalog.MARKET_BASEURL = base + 'export/freexml/{}/'
+		try:
+			categories = IceCat.IceCatCategoryMapping(log=self.log, xml_file="_test_data/CategoriesList.test.xml",
+														data_dir=self.data_dir)
+			suppliers = IceCat.IceCatSupplierMapping(log=self.log, xml_file="_test_data/supplier_mapping.xml",
+														data_dir=self.data_dir)
+			catalog = IceCat.IceCatMultiMarketCatalog(log=self.log, markets=['EN', 'CZ'], suppliers=suppliers,
+														categories=categories, data_dir=tempfile.mkdtemp() + '/')
+			self.assertEqual(len(catalog.get_data()), 6)
+			self.assertEqual(catalog.get_data()[0]['markets'], ['CZ'])
+			self.assertEqual(sorted(catalog.market_files), ['CZ'])
+			self.assertRaises(IOError, IceCat.IceCatMultiMarketCatalog, log=self.log, markets=['EN', 'DE'],
+								suppliers=suppliers, categories=categories, data_dir=tempfile.mkdtemp() + '/')
+		finally:
+			IceCat.IceCatMultiMarketCatalog.MARKET_BASEURL = baseurl
+			server.shutdown()
+
 	def testIndexfileWithDetails(self):
 		'''
 		load a small local index file and parse. connect to IceCat and download detail data
@@ -1,11 +1,17 @@
 import sys
+import os
 import logging
 import unittest
+import tempfile
 
 import cProfile, pstats
 
 
 from IceCat import bulk_downloader
+from IceCat import transport
+from IceCat import manifest
+from mock_icecat import mock_server
+
 
 class ModTest(unittest.TestCase):
 
@@ -64,6 +70,168 @@ class ModTest(unittest.TestCase):
 
 
 
+	def testLocalKeepAlive(self):
+		'''
+		download from a local server. connections are reused between urls and fetchURLs runs
+		'''
+		server, base = mock_server()
+		data_dir = tempfile.mkdtemp() + '/'
+		shared = transport.Transport(connections=2)
+		urls = [base + '{}.xml'.format(i) for i in range(20)]
+		download = bulk_downloader.fetchURLs(log=self.log, urls=urls, data_dir=data_dir,
+											connections=2, transport=shared)
+		self.assertEqual(download.get_count(), 20)
+		self.assertEqual(len(os.listdir(data_dir)), 20)
+
+		urls = [base + '{}.xml'.format(i) for i in range(20, 30)] + [base + 'missing']
+		download = bulk_downloader.fetchURLs(log=self.log, urls=urls, data_dir=data_dir,
+											connections=2, transport=shared)
+		self.assertEqual(download.get_count(), 10)
+		# 31 requests over at most 2 pooled connections
+		self.assertEqual(len(server.requests), 31)
+		self.assertLessEqual(len(server.clients), 2)
+		server.shutdown()
+
+	def testPriorityDedup(self):
+		'''
+		duplicates are fetched once, higher priority first, equal priorities spread over path prefixes
+		'''
+		server, base = mock_server()
+		data_dir = tempfile.mkdtemp() + '/'
+		urls = [base + 'a/1.xml', base + 'a/2.xml', base + 'a/3.xml', base + 'b/4.xml', base + 'b/5.xml',
+				base + 'a/1.xml', base + 'c/6.xml']
+		priorities = {base + 'c/6.xml': 10, base + 'a/3.xml': 5}
+		download = bulk_downloader.fetchURLs(log=self.log, urls=urls, data_dir=data_dir,
+											connections=1, priorities=priorities)
+		self.assertEqual(download.get_count(), 6)
+		self.assertEqual(server.requests, ['/c/6.xml', '/a/3.xml', '/a/1.xml', '/b/4.xml', '/a/2.xml', '/b/5.xml'])
+		server.shutdown()
+
+	def testDeadline(self):
+		'''
+		no download starts past the deadline, the one in flight is finished and recorded before fetchURLs returns
+		'''
+		server, base = mock_server()
+		server.slow.add('3')
+		server.delay = 3
+		data_dir = tempfile.mkdtemp() + '/'
+		urls = [base + '{}.xml'.format(i) for i in range(1, 6)]
+		xml_manifest = manifest.Manifest(data_dir + 'manifest.ndjson')
+		download = bulk_downloader.fetchURLs(log=self.log, urls=urls, data_dir=data_dir,
+											connections=1, deadline=1, manifest=xml_manifest)
+		self.assertEqual(download.get_count(), 3)
+		self.assertEqual(download.get_pending(), urls[3:])
+		self.assertTrue(os.path.isfile(data_dir + '3.xml'))
+		self.assertEqual(len(server.requests), 3)
+		# the manifest file holds every download, nothing is written after save()
+		self.assertEqual(sorted(manifest.Manifest(data_dir + 'manifest.ndjson').entries), sorted(urls[:3]))
+		server.shutdown()
+
+	def testManifest(self):
+		'''
+		downloads are recorded with size, ETag and content hash. refreshed urls are only reported changed
+		when their content changed
+		'''
+		server, base = mock_server()
+		data_dir = tempfile.mkdtemp() + '/'
+		urls = [base + '{}.xml'.format(i) for i in range(1, 4)]
+		meta = {url: {'product_id': str(i), 'updated': '2016010100000' + str(i)} for i, url in enumerate(urls, 1)}
+		manifest_file = data_dir + 'manifest.ndjson'
+		download = bulk_downloader.fetchURLs(log=self.log, urls=urls, data_dir=data_dir, connections=2,
+											manifest=manifest.Manifest(manifest_file), meta=meta)
+		self.assertEqual(download.changed, set(urls))
+		entries = manifest.Manifest(manifest_file)
+		self.assertEqual(len(entries), 3)
+		entry = entries.get(urls[0])
+		self.assertEqual((entry['product_id'], entry['updated']), ('1', '20160101000001'))
+		self.assertEqual(entry['size'], os.path.getsize(data_dir + '1.xml'))
+		self.assertTrue(entry['etag'] and entry['sha1'])
+
+		# 2 has new content, 1 and 3 answer 304
+		server.versions['2'] = '<!-- v2 -->'
+		del server.requests[:]
+		download = bulk_downloader.fetchURLs(log=self.log, urls=urls, data_dir=data_dir, connections=1,
+											manifest=manifest.Manifest(manifest_file), meta=meta, refresh=set(urls))
+		self.assertEqual(download.changed, {urls[1]})
+		self.assertEqual(download.unchanged, {urls[0], urls[2]})
+		self.assertEqual(len(server.requests), 3)
+		self.assertNotEqual(manifest.Manifest(manifest_file).get(urls[1])['sha1'], entries.get(urls[1])['sha1'])
+		with open(manifest_file) as f:
+			self.assertEqual(len(f.readlines()), 3)
+		server.shutdown()
+
+	def testResults(self):
+		'''
+		every url has an outcome with status, bytes, latency and attempts. failed urls can be run again on their own
+		'''
+		server, base = mock_server()
+		server.missing.add('2')
+		data_dir = tempfile.mkdtemp() + '/'
+		with open(data_dir + '4.xml', 'w') as f:
+			f.write('cached')
+		urls = [base + '{}.xml'.format(i) for i in range(1, 5)]
+		download = bulk_downloader.fetchURLs(log=self.log, urls=urls, data_dir=data_dir, connections=2)
+		results = {result.url: result for result in download.get_results()}
+		self.assertEqual([results[url].outcome for url in urls], ['fetched', 'failed', 'fetched', 'cached'])
+		self.assertEqual((results[urls[0]].status, results[urls[0]].attempts), (200, 1))
+		self.assertEqual(results[urls[0]].bytes, os.path.getsize(data_dir + '1.xml'))
+		self.assertGreater(results[urls[0]].seconds, 0)
+		self.assertEqual((results[urls[1]].status, results[urls[1]].bytes), (404, 0))
+		self.assertEqual((results[urls[3]].bytes, results[urls[3]].attempts), (6, 0))
+		self.assertEqual(download.get_count(), 3)
+		self.assertEqual(download.get_failed(), [urls[1]])
+		summary = download.summary()
+		self.assertEqual((summary['fetched'], summary['cached'], summary['failed'], summary['pending']), (2, 1, 1, 0))
+		self.assertEqual(summary['attempts'], 3)
+
+		server.missing.clear()
+		del server.requests[:]
+		download = bulk_downloader.fetchURLs(log=self.log, urls=download.get_failed(), data_dir=data_dir,
+											connections=2)
+		self.assertEqual(server.requests, ['/2.xml'])
+		self.assertEqual(download.get_count(), 1)
+
+		# a refused connection ends the worker, the url stays pending with its error
+		dead = 'http://127.0.0.1:{}/5.xml'.format(server.server_address[1])
+		server.shutdown()
+		server.server_close()
+		download = bulk_downloader.fetchURLs(log=self.log, urls=[dead], data_dir=data_dir, connections=1,
+											transport=transport.Transport(connections=1))
+		result, = download.get_results()
+		self.assertEqual((result.outcome, result.attempts), ('pending', 1))
+		self.assertTrue(result.error)
+		self.assertEqual(download.get_pending(), [dead])
+
+	def testSharedTransport(self):
+		'''
+		one transport per credentials, the pool grows with the number of connections
+		'''
+		t = transport.get_transport(('icat', 'passwd'), connections=5)
+		self.assertIs(transport.get_transport(('icat', 'passwd'), connections=20), t)
+		self.assertEqual(t.connections, 20)
+		self.assertIsNot(transport.get_transport(('other', 'passwd')), t)
+
+	def testResizeClosesAdapter(self):
+		'''
+		growing the pool closes the replaced adapter, the same or a smaller size keeps it
+		'''
+		server, base = mock_server()
+		try:
+			t = transport.Transport(connections=2)
+			adapter = t.session.get_adapter(base)
+			self.assertEqual(t.get(base + '1.xml').status_code, 200)
+			self.assertEqual(len(adapter.poolmanager.pools), 1)
+			t.resize(2)
+			t.resize(1)
+			self.assertIs(t.session.get_adapter(base), adapter)
+			t.resize(4)
+			self.assertIsNot(t.session.get_adapter(base), adapter)
+			self.assertIs(t.session.get_adapter('https://data.icecat.biz/'), t.session.get_adapter(base))
+			self.assertEqual(len(adapter.poolmanager.pools), 0)
+			self.assertEqual(t.get(base + '2.xml').status_code, 200)
+		finally:
+			server.shutdown()
+
 
 if __name__ == '__main__':    
 	unittest.main()
\ No newline at end of file
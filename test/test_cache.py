@@ -0,0 +1,133 @@
+from IceCat import IceCat
+from IceCat import cache
+from mock_icecat import mock_server
+import logging
+import os
+import tempfile
+import time
+import unittest
+
+
+class ModTest(unittest.TestCase):
+
+	data_dir = '_test_data/'
+
+	logging.basicConfig(filename='test.log',level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+	log = logging.getLogger()
+
+	def _files(self, directory, names, size=100, age=0):
+		for name in names:
+			with open(directory + name, 'wb') as f:
+				f.write(b'x' * size)
+			os.utime(directory + name, (time.time() - age, time.time() - age))
+
+	def testRetention(self):
+		'''
+		least recently used files past the size limit and files past the age limit go, pinned files stay
+		'''
+		tmp = tempfile.mkdtemp() + '/'
+		self._files(tmp, ['old.xml'], age=3600)
+		self._files(tmp, ['1.xml', '2.xml', '3.xml'], age=60)
+		self._files(tmp, ['manifest.ndjson'])
+		retention = cache.CacheRetention(tmp, max_size=450, max_age=1800, pinned=['1.xml'], low_water=0.7)
+		self.assertEqual((len(retention), retention.size), (4, 400))
+		self.assertIn(tmp + '2.xml', retention)
+
+		# a hit makes 2 the most recent, a download pushes the cache past its limit
+		retention.used(tmp + '2.xml')
+		self._files(tmp, ['4.xml'])
+		retention.used(tmp + '4.xml', 100)
+		self.assertEqual(sorted(os.listdir(tmp)), ['1.xml', '2.xml', '4.xml', 'manifest.ndjson'])
+		self.assertEqual(retention.size, 300)
+
+		self._files(tmp, ['5.xml'], age=3600)
+		retention = cache.CacheRetention(tmp, max_age=1800, pinned=['1.xml'])
+		self.assertEqual(retention.enforce(), 1)
+		self.assertEqual(sorted(os.listdir(tmp)), ['1.xml', '2.xml', '4.xml', 'manifest.ndjson'])
+
+		# pinned files are kept over the limit
+		retention = cache.CacheRetention(tmp, max_size=50, pinned=['1.xml'], log=self.log)
+		retention.enforce()
+		self.assertEqual(sorted(os.listdir(tmp)), ['1.xml', 'manifest.ndjson'])
+		self.assertEqual(retention.summary(), {'files': 1, 'bytes': 100, 'pinned': 1, 'evicted': 2,
+												'evicted_bytes': 200})
+
+	def testPinnedOverLimit(self):
+		'''
+		once only pinned files are left over the limit, downloads evict nothing else and the warning is logged once
+		'''
+		tmp = tempfile.mkdtemp() + '/'
+		pinned = ['{}.xml'.format(i) for i in range(50)]
+		self._files(tmp, pinned + ['a.xml', 'b.xml'])
+		warnings = []
+		log = logging.getLogger('test_cache.pinned')
+		log.warning = lambda message: warnings.append(message)
+		retention = cache.CacheRetention(tmp, max_size=1000, pinned=pinned, log=log)
+		self.assertEqual((retention.size, retention.pinned_size), (5200, 5000))
+		for name in pinned:
+			retention.used(tmp + name)
+		self.assertEqual(sorted(os.listdir(tmp)), sorted(pinned))
+		self.assertEqual(retention.summary(), {'files': 50, 'bytes': 5000, 'pinned': 50, 'evicted': 2,
+												'evicted_bytes': 200})
+		self.assertEqual(len(warnings), 1)
+
+	def testCatalogCache(self):
+		'''
+		product xml is kept between runs of both detail paths, xml of other categories is evicted first
+		'''
+		server, base = mock_server()
+		baseurl = IceCat.IceCatProductDetails.baseurl
+		IceCat.IceCatProductDetails.baseurl = base
+		try:
+			tmp = tempfile.mkdtemp() + '/'
+			xml_dir = tmp + 'product_xml/'
+			os.makedirs(xml_dir)
+			self._files(xml_dir, ['1.xml'], size=1000, age=120)
+			self._files(xml_dir, ['2.xml'], size=1000, age=60)
+			categories = IceCat.IceCatCategoryMapping(log=self.log, xml_file="_test_data/CategoriesList.test.xml",
+														data_dir=self.data_dir)
+			suppliers = IceCat.IceCatSupplierMapping(log=self.log, xml_file="_test_data/supplier_mapping.xml",
+														data_dir=self.data_dir)
+
+			def catalog():
+				catalog = IceCat.IceCatCatalog(log=self.log, xml_file="_test_data/daily.index.test.xml",
+												suppliers=suppliers, categories=categories, data_dir=tmp)
+				catalog._filter_products(lambda item: item['catid'] in ('911', '375', '989'))
+				return catalog
+
+			single = catalog()
+			single.add_product_details(keys=['ProductDescription[@ShortDesc]'])
+			self.assertEqual(single.get_data()[0]['shortdesc'], 'Xeon 3827')
+			self.assertEqual(len(server.requests), 3)
+			self.assertEqual(len(os.listdir(xml_dir)), 5)
+			single = catalog()
+			single.add_product_details(keys=['ProductDescription[@ShortDesc]'], cache_size=2500)
+			self.assertEqual(len(server.requests), 3)
+			self.assertEqual(single.get_data()[2]['shortdesc'], 'Xeon 110722')
+			self.assertEqual(sorted(os.listdir(xml_dir)), ['108912.xml', '110722.xml', '2.xml', '3827.xml'])
+
+			parallel = catalog()
+			parallel._categories = {'911': '', '375': '', '989': ''}
+			parallel.add_product_details_parallel(keys=['ProductDescription[@ShortDesc]'], connections=2,
+													cache_size=10, cache_age=3600)
+			self.assertEqual(len(server.requests), 3)
+			self.assertEqual(sorted(name for name in os.listdir(xml_dir) if name.endswith('.xml')),
+							['108912.xml', '110722.xml', '3827.xml'])
+			self.assertEqual(parallel.cache_summary['evicted'], 1)
+			self.assertEqual(parallel.get_data()[1]['shortdesc'], 'Xeon 108912')
+
+			# a shard keeps the product xml of the other shards sharing data_dir, 3827 is in shard 1
+			sharded = catalog()
+			sharded._categories = {'911': '', '375': '', '989': ''}
+			sharded.add_product_details_parallel(keys=['ProductDescription[@ShortDesc]'], connections=2,
+												  shard=(0, 2), cache_size=10)
+			self.assertEqual([item['product_id'] for item in sharded.get_data()], ['108912', '110722'])
+			self.assertEqual(sorted(name for name in os.listdir(xml_dir) if name.endswith('.xml')),
+							['108912.xml', '110722.xml', '3827.xml'])
+		finally:
+			IceCat.IceCatProductDetails.baseurl = baseurl
+			server.shutdown()
+
+
+if __name__ == '__main__':
+	unittest.main()
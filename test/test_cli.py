@@ -0,0 +1,166 @@
+from IceCat import IceCat
+from IceCat import cli
+from IceCat import gtin
+from mock_icecat import mock_server
+import contextlib
+import gzip
+import io
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import unittest
+
+
+class ModTest(unittest.TestCase):
+
+	logging.basicConfig(filename='test.log',level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+	log = logging.getLogger()
+
+	def setUp(self):
+		self.server, base = mock_server()
+		self.baseurl = IceCat.IceCatProductDetails.baseurl
+		IceCat.IceCatProductDetails.baseurl = base
+		self.tmp = tempfile.mkdtemp() + '/'
+
+	def tearDown(self):
+		IceCat.IceCatProductDetails.baseurl = self.baseurl
+		self.server.shutdown()
+
+	def sync(self, *args):
+		return cli.main(['sync', 'daily', '--user', 'icat_user', '--password', 'icat_passwd',
+						'--data-dir', self.tmp + 'data', '--log-file', 'test.log',
+						'--index-file', '_test_data/daily.index.test.xml',
+						'--categories-file', '_test_data/CategoriesList.test.xml',
+						'--suppliers-file', '_test_data/supplier_mapping.xml',
+						'--category', '911', '--category', '375', '--category', '989'] + list(args))
+
+	def testSyncFormats(self):
+		'''
+		one run per output format, against local reference files and a local product server
+		'''
+		self.assertEqual(self.sync('--output', self.tmp + 'daily.json', '--connections', '2',
+									'--key', 'ProductDescription[@ShortDesc]', '--metrics', self.tmp + 'metrics.json',
+									'--gtin-index', self.tmp + 'gtin.idx'), 0)
+		with open(self.tmp + 'daily.json') as f:
+			products = json.load(f)
+		self.assertEqual(sorted(item['product_id'] for item in products), ['108912', '110722', '3827'])
+		self.assertEqual(products[0]['shortdesc'], 'Xeon 3827')
+		with open(self.tmp + 'metrics.json') as f:
+			metrics = json.load(f)
+		self.assertEqual((metrics['products'], metrics['written'], metrics['pending']), (3, 3, 0))
+		self.assertEqual(sorted(metrics['seconds']), ['details', 'export', 'index', 'total'])
+		with gtin.GtinIndex(self.tmp + 'gtin.idx') as index:
+			self.assertEqual(index.lookup('5025232253685'), ['108912'])
+
+		self.sync('--output', self.tmp + 'daily.ndjson', '--no-details')
+		with open(self.tmp + 'daily.ndjson') as f:
+			lines = [json.loads(line) for line in f]
+		self.assertEqual([item['product_id'] for item in lines], [item['product_id'] for item in products])
+		self.assertNotIn('shortdesc', lines[0])
+
+		self.sync('--output', self.tmp + 'daily.db', '--key', 'ShortSummaryDescription')
+		db = sqlite3.connect(self.tmp + 'daily.db')
+		rows = db.execute('SELECT product_id, shortsummarydescription FROM products ORDER BY product_id').fetchall()
+		self.assertEqual(rows[0], ('108912', 'Short summary 108912'))
+		db.close()
+
+		self.sync('--output', self.tmp + 'bulk.ndjson', '--format', 'bulk', '--bulk-index', 'products', '--gzip')
+		with gzip.open(self.tmp + 'bulk.0000.ndjson.gz', 'rt') as f:
+			lines = [json.loads(line) for line in f]
+		self.assertEqual(lines[0], {'index': {'_index': 'products', '_id': products[0]['product_id']}})
+		self.assertEqual(len(lines), 6)
+
+	def testIncremental(self):
+		'''
+		the second incremental run only fetches and writes what the index changed
+		'''
+		self.sync('--incremental', '--output', self.tmp + 'daily.json')
+		self.assertTrue(os.path.isfile(self.tmp + 'data/snapshot.json'))
+		requests = len(self.server.requests)
+		self.sync('--incremental', '--changed-only', '--output', self.tmp + 'changes.ndjson',
+					'--metrics', self.tmp + 'metrics.json')
+		self.assertEqual(len(self.server.requests), requests)
+		with open(self.tmp + 'metrics.json') as f:
+			metrics = json.load(f)
+		self.assertEqual(metrics['changes'], {'added': 0, 'updated': 0, 'off_market': 0})
+		self.assertEqual(os.path.getsize(self.tmp + 'changes.ndjson'), 0)
+
+		# bulk output of the changes: 3827 goes off market and is deleted, 108912 is indexed again.
+		# the chunk left by an earlier, larger run is removed
+		with open('_test_data/daily.index.test.xml', 'rb') as f:
+			index = f.read()
+		index = index.replace(b'Product_ID="3827" Updated="20160208133238"', b'Product_ID="3827" Updated="20990101000000"')
+		index = index.replace(b'Catid="911" On_Market="1"', b'Catid="911" On_Market="0"')
+		index = index.replace(b'Product_ID="108912" Updated="20160208150849"', b'Product_ID="108912" Updated="20990101000000"')
+		with open(self.tmp + 'next.index.xml', 'wb') as f:
+			f.write(index)
+		with open(self.tmp + 'bulk.0003.ndjson', 'w') as f:
+			f.write('{"index": {"_id": "stale"}}\n{}\n')
+		self.sync('--incremental', '--changed-only', '--index-file', self.tmp + 'next.index.xml',
+					'--format', 'bulk', '--bulk-index', 'products', '--output', self.tmp + 'bulk.ndjson')
+		self.assertEqual(sorted(name for name in os.listdir(self.tmp) if name.startswith('bulk.')), ['bulk.0000.ndjson'])
+		with open(self.tmp + 'bulk.0000.ndjson') as f:
+			lines = [json.loads(line) for line in f]
+		self.assertEqual([lines[0], lines[1]['product_id'], lines[2]],
+						[{'index': {'_index': 'products', '_id': '108912'}}, '108912',
+						{'delete': {'_index': 'products', '_id': '3827'}}])
+		self.assertEqual(len(lines), 3)
+
+	def testIncrementalShard(self):
+		'''
+		each shard of an incremental run keeps a snapshot of its own products
+		'''
+		for k in range(2):
+			self.sync('--incremental', '--shard', '{}/2'.format(k), '--output', self.tmp + 'daily.{}.json'.format(k))
+		snapshots = []
+		for k in range(2):
+			with open(self.tmp + 'data/snapshot.{}-of-2.json'.format(k)) as f:
+				snapshots.append(sorted(item['product_id'] for item in json.load(f)))
+		self.assertFalse(os.path.isfile(self.tmp + 'data/snapshot.json'))
+		self.assertEqual(sorted(snapshots[0] + snapshots[1]), ['108912', '110722', '3827'])
+
+	def testAllCategories(self):
+		'''
+		without --category the details and the index only output cover the same, all products
+		'''
+		outputs = []
+		for options in ([], ['--no-details']):
+			output = self.tmp + 'all{}.json'.format(len(outputs))
+			cli.main(['sync', 'daily', '--user', 'icat_user', '--password', 'icat_passwd',
+					'--data-dir', self.tmp + 'data', '--log-file', 'test.log',
+					'--index-file', '_test_data/daily.index.test.xml',
+					'--categories-file', '_test_data/CategoriesList.test.xml',
+					'--suppliers-file', '_test_data/supplier_mapping.xml', '--output', output] + options)
+			with open(output) as f:
+				outputs.append([item['product_id'] for item in json.load(f)])
+		self.assertEqual(outputs[0], outputs[1])
+		self.assertGreater(len(outputs[0]), 3)
+
+	def testMetricsStdout(self):
+		'''
+		with --metrics - stdout holds the metrics JSON only
+		'''
+		stdout = io.StringIO()
+		with contextlib.redirect_stdout(stdout):
+			self.sync('--output', self.tmp + 'daily.json', '--metrics', '-')
+		metrics = json.loads(stdout.getvalue())
+		self.assertEqual(metrics['products'], 3)
+
+	def testCredentials(self):
+		'''
+		credentials are required, there are no built in ones
+		'''
+		environ = dict(os.environ)
+		os.environ.pop('ICECAT_USER', None)
+		os.environ.pop('ICECAT_PASSWORD', None)
+		try:
+			with self.assertRaises(SystemExit):
+				cli.main(['sync', 'daily'])
+		finally:
+			os.environ.update(environ)
+
+
+if __name__ == '__main__':
+	unittest.main()
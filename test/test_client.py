@@ -0,0 +1,84 @@
+from IceCat import IceCat
+from IceCat.client import IceCatClient
+from mock_icecat import mock_server
+import asyncio
+import logging
+import tempfile
+import unittest
+
+
+class ModTest(unittest.TestCase):
+
+	data_dir = '_test_data/'
+
+	logging.basicConfig(filename='test.log',level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+	log = logging.getLogger()
+
+	def testReferencesAndIndex(self):
+		'''
+		reference files are loaded once per client, index parsed off the event loop
+		'''
+		async def run():
+			async with IceCatClient(log=self.log, data_dir=self.data_dir) as c:
+				categories = await c.categories(xml_file="_test_data/CategoriesList.test.xml")
+				suppliers = await c.suppliers(xml_file="_test_data/supplier_mapping.xml")
+				self.assertIs(await c.categories(), categories)
+				self.assertEqual(suppliers.get_mfr_byId("7"), 'Acer')
+				products = [item async for item in c.iter_products('daily', xml_file="_test_data/daily.index.test.xml")]
+				self.assertEqual(products[2]['supplier'], 'Intel')
+				self.assertEqual(products[5]['category'], 'Living Room Bookcases')
+				catalog = await c.index('daily', xml_file="_test_data/daily.index.test.xml")
+				self.assertEqual(products, catalog.get_data())
+
+				# stopping early ends the parsing thread, the client stays usable
+				async for item in c.iter_products('daily', xml_file="_test_data/daily.index.test.xml", batch=1):
+					self.assertEqual(item['product_id'], '3827')
+					break
+				self.assertEqual(len([item async for item in c.iter_products(
+					'daily', xml_file="_test_data/daily.index.test.xml", batch=4)]), 6)
+				with self.assertRaises(ValueError):
+					await c.index('weekly')
+		asyncio.run(run())
+
+	def testSupplierMappingFails(self):
+		'''
+		products are listed without supplier names when the supplier mapping can not be downloaded
+		'''
+		baseurl = IceCat.IceCatSupplierMapping.baseurl
+		# nothing listens there, the download fails right away
+		IceCat.IceCatSupplierMapping.baseurl = 'http://127.0.0.1:1/'
+		async def run():
+			async with IceCatClient(log=self.log, data_dir=tempfile.mkdtemp() + '/') as c:
+				await c.categories(xml_file="_test_data/CategoriesList.test.xml")
+				self.assertIsNone(await c.suppliers())
+				return [item async for item in c.iter_products('daily', xml_file="_test_data/daily.index.test.xml")]
+		try:
+			products = asyncio.run(run())
+		finally:
+			IceCat.IceCatSupplierMapping.baseurl = baseurl
+		self.assertEqual(len(products), 6)
+		self.assertNotIn('supplier', products[2])
+		self.assertEqual(products[5]['category'], 'Living Room Bookcases')
+
+	def testProductDetails(self):
+		'''
+		concurrent product detail lookups against a local server
+		'''
+		server, base = mock_server()
+		baseurl = IceCat.IceCatProductDetails.baseurl
+		IceCat.IceCatProductDetails.baseurl = base
+		async def run():
+			async with IceCatClient(log=self.log, data_dir=self.data_dir, connections=4) as c:
+				return await c.product_details(['3827', '108912', '110722'],
+												keys=['ProductDescription[@ShortDesc]', 'ShortSummaryDescription'])
+		try:
+			details = asyncio.run(run())
+		finally:
+			IceCat.IceCatProductDetails.baseurl = baseurl
+			server.shutdown()
+		self.assertEqual(sorted(details), ['108912', '110722', '3827'])
+		self.assertEqual(details['3827'], {'shortdesc': 'Xeon 3827', 'shortsummarydescription': 'Short summary 3827'})
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,91 @@
+from IceCat import IceCat
+from IceCat import compact
+import json
+import logging
+import unittest
+
+
+class ModTest(unittest.TestCase):
+
+	data_dir = '_test_data/'
+
+	logging.basicConfig(filename='test.log',level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+	log = logging.getLogger()
+
+	def _catalogs(self):
+		categories = IceCat.IceCatCategoryMapping(log=self.log, xml_file="_test_data/CategoriesList.test.xml",
+													data_dir=self.data_dir)
+		suppliers = IceCat.IceCatSupplierMapping(log=self.log, xml_file="_test_data/supplier_mapping.xml",
+													data_dir=self.data_dir)
+		plain = IceCat.IceCatCatalog(log=self.log, xml_file="_test_data/daily.index.test.xml",
+										suppliers=suppliers, categories=categories, data_dir=self.data_dir)
+		packed = IceCat.IceCatCatalog(log=self.log, xml_file="_test_data/daily.index.test.xml",
+										suppliers=suppliers, categories=categories, data_dir=self.data_dir, compact=True)
+		return plain, packed
+
+	def testCompactRows(self):
+		'''
+		compact catalog rows must match the regular dict based catalog
+		'''
+		plain, packed = self._catalogs()
+		self.assertIsInstance(packed.get_data(), compact.CompactCatalog)
+		self.assertEqual(len(packed.get_data()), len(plain.get_data()))
+		for row, item in zip(packed.get_data(), plain.get_data()):
+			self.assertEqual(dict(row), item)
+			self.assertEqual(list(row), list(item))
+		self.assertEqual(packed.get_data()[0]['prod_id'],u'91.42R29.002')
+		self.assertEqual(packed.get_data()[-1]['category'],'Living Room Bookcases')
+		self.assertEqual(packed.get_data()[2]['supplier'],'Intel')
+		self.assertNotIn('category', packed.get_data()[0])
+
+	def testCompactUpdate(self):
+		'''
+		row updates land in the typed columns or in the overflow dict
+		'''
+		plain, packed = self._catalogs()
+		row = packed.get_data()[2]
+		row.update({'shortdesc': 'Xeon', 'catid': '575'})
+		self.assertEqual(row['shortdesc'], 'Xeon')
+		self.assertEqual(packed.get_data().column('catid')[2], 575)
+		row['catid'] = 'n/a'
+		self.assertEqual(row['catid'], 'n/a')
+		del row['shortdesc']
+		self.assertNotIn('shortdesc', row)
+
+	def testCompactListAndDetailColumns(self):
+		'''
+		code lists and the common detail fields have columns, only real overflow stays in the row dicts
+		'''
+		plain, packed = self._catalogs()
+		catalog = packed.get_data()
+		self.assertEqual(catalog[0]['m_prod_id'], '9142R29002')
+		self.assertEqual(catalog[1]['m_prod_id'], ['PAN_UG3350', 'UG3350'])
+		self.assertEqual(catalog[1]['ean_upcs'], ['5025232253685'])
+		self.assertNotIn('ean_upcs', catalog[0])
+		self.assertEqual(catalog._extra, {})
+		row = catalog[1]
+		row.update({'name': 'Product 108912', 'title': 'Panasonic UG-3350', 'release_date': '2005-06-27',
+					'shortdesc': 'Toner'})
+		row['ean_upcs'] = ['5025232253692']
+		self.assertEqual(catalog._extra, {1: {'shortdesc': 'Toner'}})
+		# a list of another length does not fit in place
+		row['ean_upcs'] = ['5025232253685', '5025232253692']
+		self.assertEqual(row['ean_upcs'], ['5025232253685', '5025232253692'])
+		self.assertEqual(catalog._extra[1]['ean_upcs'], ['5025232253685', '5025232253692'])
+		self.assertEqual(list(row)[-4:], ['name', 'title', 'release_date', 'supplier'])
+		selected = catalog.filter(lambda item: item['product_id'] == '108912')
+		self.assertEqual(dict(selected[0]), dict(row))
+
+	def testCompactFilterAndDump(self):
+		'''
+		filtering keeps the compact store, JSON output is identical
+		'''
+		plain, packed = self._catalogs()
+		selected = packed.get_data().filter(lambda item: item['supplier_id'] == '263')
+		self.assertIsInstance(selected, compact.CompactCatalog)
+		self.assertEqual([r['product_id'] for r in selected], ['108912', '140202', '140206'])
+		self.assertEqual(json.dumps(plain.get_data()), json.dumps(packed.get_data(), default=packed._json_default))
+
+
+if __name__ == '__main__':
+	unittest.main()
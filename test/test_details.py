@@ -0,0 +1,110 @@
+from IceCat import IceCat
+from IceCat import details
+from mock_icecat import PRODUCT_XML
+import io
+import json
+import logging
+import unittest
+import xml.etree.ElementTree as ET
+
+
+SAMPLE_XML = '''<?xml version="1.0" encoding="UTF-8"?>
+<ICECAT-interface>
+  <Product ID="42" Name="Sample" Prod_id="S-42">
+    <ProductDescription ID="142" ShortDesc="Sample 42" langid="1"/>
+    <ShortSummaryDescription>Short summary 42</ShortSummaryDescription>
+    <BulletPoints>
+      <BulletPoint No="1" Value="Fast"/>
+      <BulletPoint No="2">Quiet</BulletPoint>
+    </BulletPoints>
+    <ProductFeature ID="7" CategoryFeatureGroup_ID="3" No="1" Value="4" Presentation_Value="4 GB" Searchable="1">
+      <Feature ID="11">
+        <Measure ID="5" Sign="GB"/>
+        <Name ID="20" langid="2" Value="Speicher"/>
+        <Name ID="21" langid="1" Value="Memory"/>
+      </Feature>
+    </ProductFeature>
+    <ProductFeature ID="8" CategoryFeatureGroup_ID="3" No="2" Value="N" Presentation_Value="No" Searchable="0">
+      <Feature ID="12">
+        <Name ID="22" langid="1" Value="Wi-Fi"/>
+      </Feature>
+    </ProductFeature>
+    <ProductGallery>
+      <ProductPicture ProductPicture_ID="99" No="1" Pic="http://images/42.jpg" PicWidth="800" PicHeight="600" Size="1234" ThumbPic="http://thumbs/42.jpg"/>
+    </ProductGallery>
+    <ProductRelated ID="55" Category_ID="381" Preferred="1">
+      <Product ID="43" Prod_id="S-43" Name="Sample cable">
+        <Supplier ID="1" Name="HP"/>
+      </Product>
+    </ProductRelated>
+  </Product>
+</ICECAT-interface>
+'''
+
+
+class ModTest(unittest.TestCase):
+
+	logging.basicConfig(filename='test.log',level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+	log = logging.getLogger()
+
+	def testLegacyKeys(self):
+		'''
+		plain detail keys give the same result as the tree based extraction
+		'''
+		for keys in (['ProductDescription[@ShortDesc]', 'ShortSummaryDescription'],
+					 ['ProductDescription', 'Product[@Name]', 'LongSummaryDescription', 'ShortDesc'],
+					 ['Product', 'ProductDescription[@LongDesc]', 'Name']):
+			for xml in (PRODUCT_XML.format(id='3827'), SAMPLE_XML):
+				expected = IceCat.extract_details(ET.fromstring(xml), keys)
+				got = details.DetailExtractor(keys).extract(io.BytesIO(xml.encode()))
+				self.assertEqual(got, expected)
+
+	def testSections(self):
+		'''
+		features, gallery, bullet points and related products come out as typed records
+		'''
+		keys = ['ProductDescription[@ShortDesc]', 'features', 'gallery', 'bullets', 'related']
+		o = details.DetailExtractor(keys).extract(io.BytesIO(SAMPLE_XML.encode()))
+		self.assertEqual(o['shortdesc'], 'Sample 42')
+
+		memory, wifi = o['features']
+		self.assertEqual(memory.name, 'Memory')
+		self.assertEqual(memory.feature_id, 11)
+		self.assertEqual(memory.presentation_value, '4 GB')
+		self.assertEqual(memory.sign, 'GB')
+		self.assertTrue(memory.searchable)
+		self.assertEqual(wifi['name'], 'Wi-Fi')
+		self.assertIsNone(wifi.sign)
+		self.assertFalse(wifi.searchable)
+
+		picture, = o['gallery']
+		self.assertEqual((picture.width, picture.height, picture.size), (800, 600, 1234))
+		self.assertEqual([(b.no, b.value) for b in o['bullets']], [(1, 'Fast'), (2, 'Quiet')])
+
+		related, = o['related']
+		self.assertEqual((related.product_id, related.supplier, related.preferred), (43, 'HP', True))
+
+		# sections that are not requested are not extracted
+		self.assertNotIn('features', details.DetailExtractor(['ShortDesc']).extract(io.BytesIO(SAMPLE_XML.encode())))
+
+	def testJsonRoundTrip(self):
+		'''
+		records serialize as objects and can be restored from JSON
+		'''
+		extractor = details.DetailExtractor(['features', 'gallery'])
+		o = extractor.extract(io.BytesIO(SAMPLE_XML.encode()))
+		loaded = json.loads(json.dumps(o, default=details.json_default))
+		self.assertEqual(loaded['gallery'][0]['pic'], 'http://images/42.jpg')
+		self.assertEqual(extractor.restore(loaded), o)
+
+	def testCustomSection(self):
+		'''
+		sections are plain schema definitions
+		'''
+		names = details.Section('names', 'Name', [('id', '@ID', int), ('lang', '@langid', int), ('value', '@Value', str)])
+		o = details.DetailExtractor(['names'], sections=[names]).extract(io.BytesIO(SAMPLE_XML.encode()))
+		self.assertEqual([n.value for n in o['names'] if n.lang == 1], ['Memory', 'Wi-Fi'])
+
+
+if __name__ == '__main__':
+	unittest.main()
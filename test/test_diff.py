@@ -0,0 +1,71 @@
+from IceCat import cli
+from IceCat import diff
+import gzip
+import json
+import logging
+import os
+import re
+import tempfile
+import unittest
+
+
+class ModTest(unittest.TestCase):
+
+	index_file = '_test_data/daily.index.test.xml'
+
+	logging.basicConfig(filename='test.log',level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+	log = logging.getLogger()
+
+	def setUp(self):
+		'''
+		today's index: 3827 removed, 999999 added, 108912 updated, 110722 moved to category 999
+		'''
+		self.tmp = tempfile.mkdtemp() + '/'
+		with open(self.index_file) as f:
+			data = f.read()
+		data = re.sub(r'\s*<file path="export/freexml.int/EN/3827.xml".*?</file>', '', data, flags=re.S)
+		added = re.search(r'<file path="export/freexml.int/EN/140206.xml".*?</file>', data, flags=re.S).group(0)
+		data = data.replace('</files.index>', added.replace('140206', '999999') + '\n  </files.index>')
+		data = data.replace('Product_ID="108912" Updated="20160208150849"', 'Product_ID="108912" Updated="20160209150849"')
+		data = data.replace('Product_ID="110722" Updated="20160208201738" Quality="ICECAT" Supplier_id="85" '
+							'Prod_ID="BX80546KG2800EA" Catid="989"',
+							'Product_ID="110722" Updated="20160208201738" Quality="ICECAT" Supplier_id="85" '
+							'Prod_ID="BX80546KG2800EA" Catid="999"')
+		self.today = self.tmp + 'today.index.xml.gz'
+		with gzip.open(self.today, 'wt') as f:
+			f.write(data)
+
+	def testDiff(self):
+		'''
+		added, removed and changed products with the changed fields
+		'''
+		with diff.IndexDiff(self.index_file, self.today, tmp_dir=self.tmp, batch=2) as changes:
+			self.assertEqual(list(changes.added()), ['999999'])
+			self.assertEqual(list(changes.removed()), ['3827'])
+			changed = {product_id: fields for product_id, fields, old, new in changes.changed()}
+			self.assertEqual(changed, {'108912': ['updated'], '110722': ['catid']})
+			self.assertEqual(changes.counts(), {'added': 1, 'removed': 1, 'changed': 2})
+			self.assertIn({'change': 'changed', 'product_id': '110722', 'fields': ['catid'],
+							'old': {'catid': '989'}, 'new': {'catid': '999'}}, list(changes))
+		# the temporary database is gone
+		self.assertEqual(sorted(os.listdir(self.tmp)), ['today.index.xml.gz'])
+
+		with diff.IndexDiff(self.index_file, self.index_file) as changes:
+			self.assertEqual(changes.counts(), {'added': 0, 'removed': 0, 'changed': 0})
+			self.assertEqual(list(changes), [])
+
+	def testCommandLine(self):
+		'''
+		icecat diff writes NDJSON changes
+		'''
+		self.assertEqual(cli.main(['diff', self.index_file, self.today, '--output', self.tmp + 'delta.ndjson',
+									'--log-file', 'test.log']), 0)
+		with open(self.tmp + 'delta.ndjson') as f:
+			lines = [json.loads(line) for line in f]
+		self.assertEqual([(line['change'], line['product_id']) for line in lines],
+						[('added', '999999'), ('removed', '3827'), ('changed', '108912'), ('changed', '110722')])
+		self.assertEqual(lines[2]['new'], {'updated': '20160209150849'})
+
+
+if __name__ == '__main__':
+	unittest.main()
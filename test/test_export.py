@@ -0,0 +1,125 @@
+from IceCat import export
+from IceCat import details
+import gzip
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import unittest
+
+
+class ModTest(unittest.TestCase):
+
+	logging.basicConfig(filename='test.log',level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+	log = logging.getLogger()
+
+	Picture = details.record_type('ProductPicture', ['no', 'pic'])
+	products = [
+		{'product_id': '3827', 'updated': '20160208150856', 'ean_upcs': ['0123456789012', '0123456789029']},
+		{'product_id': '108912', 'shortdesc': 'Xeon 108912', 'gallery': [Picture(1, 'http://images/1.jpg')]},
+	]
+
+	def testJson(self):
+		'''
+		streamed JSON has the layout of a json.dumps of the whole list
+		'''
+		tmp = tempfile.mkdtemp() + '/'
+		self.assertEqual(export.write(self.products, tmp + 'out.json'), 2)
+		with open(tmp + 'out.json') as f:
+			self.assertEqual(f.read(), json.dumps(self.products, indent=2, default=export.json_default))
+		export.write([], tmp + 'empty.json')
+		with open(tmp + 'empty.json') as f:
+			self.assertEqual(json.load(f), [])
+
+	def testReadProducts(self):
+		'''
+		JSON arrays and NDJSON read back one product at a time, items spanning the read buffer included
+		'''
+		tmp = tempfile.mkdtemp() + '/'
+		expected = json.loads(json.dumps(self.products, default=export.json_default))
+		export.write(self.products, tmp + 'out.json')
+		export.write(self.products, tmp + 'out.ndjson')
+		self.assertEqual(list(export.read_products(tmp + 'out.json')), expected)
+		self.assertEqual(list(export.read_products(tmp + 'out.ndjson')), expected)
+		with open(tmp + 'out.json') as f:
+			self.assertEqual(list(export._json_array(f, chunk=7)), expected)
+		export.write([], tmp + 'empty.json')
+		self.assertEqual(list(export.read_products(tmp + 'empty.json')), [])
+
+	def testNdjsonSqlite(self):
+		'''
+		one object per line, one column per key with nested values as JSON
+		'''
+		tmp = tempfile.mkdtemp() + '/'
+		export.write(self.products, tmp + 'out.ndjson')
+		with open(tmp + 'out.ndjson') as f:
+			self.assertEqual(json.loads(f.readlines()[1])['gallery'], [{'no': 1, 'pic': 'http://images/1.jpg'}])
+
+		export.write(self.products, tmp + 'out.data', format='sqlite')
+		db = sqlite3.connect(tmp + 'out.data')
+		rows = db.execute('SELECT product_id, ean_upcs, shortdesc FROM products').fetchall()
+		db.close()
+		self.assertEqual(rows, [('3827', '["0123456789012", "0123456789029"]', None), ('108912', None, 'Xeon 108912')])
+		self.assertRaises(ValueError, export.write, self.products, tmp + 'out.xls')
+
+	def testBulk(self):
+		'''
+		bulk API action and document lines, split in size bounded files, optionally gzipped
+		'''
+		tmp = tempfile.mkdtemp() + '/'
+		files = []
+		self.assertEqual(export.write(self.products, tmp + 'bulk.ndjson', 'bulk', index='products', files=files), 2)
+		self.assertEqual(files, [tmp + 'bulk.0000.ndjson'])
+		with open(files[0]) as f:
+			lines = [json.loads(line) for line in f]
+		self.assertEqual(lines[0], {'index': {'_index': 'products', '_id': '3827'}})
+		self.assertEqual(lines[1], self.products[0])
+		self.assertEqual(lines[3]['gallery'], [{'no': 1, 'pic': 'http://images/1.jpg'}])
+
+		# one product per file, only the changed one, a delete for a removed one
+		files = []
+		products = [dict(item, product_id=str(i)) for i, item in enumerate(self.products * 5)]
+		export.write_bulk(products, tmp + 'changed.ndjson.gz', index=None, chunk_size=50, action='create',
+							ids={'1', '4', '7'}, deletes=['99'], files=files)
+		self.assertEqual(len(files), 4)
+		lines = []
+		for name in files:
+			self.assertTrue(name.endswith('.ndjson.gz'))
+			with gzip.open(name, 'rt') as f:
+				lines.append([json.loads(line) for line in f])
+		self.assertEqual([chunk[0] for chunk in lines],
+						[{'create': {'_id': '1'}}, {'create': {'_id': '4'}}, {'create': {'_id': '7'}},
+						{'delete': {'_id': '99'}}])
+		self.assertEqual(lines[0][1]['shortdesc'], 'Xeon 108912')
+
+		# several small products share a file
+		files = []
+		export.write_bulk(products, tmp + 'small.ndjson', id_field=None, chunk_size=400, files=files)
+		self.assertEqual(len(files), 4)
+		for name in files:
+			self.assertLessEqual(os.path.getsize(name), 400)
+		self.assertEqual(sum(len(open(name).readlines()) for name in files), 20)
+		with open(files[0]) as f:
+			self.assertEqual(json.loads(f.readline()), {'index': {'_index': 'icecat'}})
+
+		# a smaller run into the same name leaves no chunks of the earlier one behind
+		export.write_bulk(products[:2], tmp + 'small.ndjson')
+		self.assertEqual(sorted(name for name in os.listdir(tmp) if name.startswith('small.')), ['small.0000.ndjson'])
+
+	def testParquet(self):
+		'''
+		Parquet output, only where pyarrow is installed
+		'''
+		try:
+			import pyarrow.parquet
+		except ImportError:
+			self.skipTest('pyarrow is not installed')
+		tmp = tempfile.mkdtemp() + '/'
+		export.write(self.products, tmp + 'out.parquet')
+		table = pyarrow.parquet.read_table(tmp + 'out.parquet')
+		self.assertEqual(table.column('product_id').to_pylist(), ['3827', '108912'])
+
+
+if __name__ == '__main__':
+	unittest.main()
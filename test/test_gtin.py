@@ -0,0 +1,124 @@
+from IceCat import IceCat
+from IceCat import gtin
+from IceCat import index_parser
+import logging
+import os
+import tempfile
+import unittest
+
+
+class ModTest(unittest.TestCase):
+
+	data_dir = '_test_data/'
+
+	logging.basicConfig(filename='test.log',level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+	log = logging.getLogger()
+
+	def testNormalize(self):
+		'''
+		every barcode form to 13 digits, or 14 for a GTIN-14
+		'''
+		self.assertEqual(gtin.normalize('5025232253685'), '5025232253685')
+		self.assertEqual(gtin.normalize('036000291452'), '0036000291452')
+		self.assertEqual(gtin.normalize('96385074'), '0000096385074')
+		self.assertEqual(gtin.normalize('10012345678902'), '10012345678902')
+		self.assertEqual(gtin.normalize('00012345678905'), '0012345678905')
+		self.assertEqual(gtin.normalize(' 0 36000-29145 2 '), '0036000291452')
+		for code in ('5025232253686', '50252322536A5', '1234567', '123456789012345', '00000000', '',
+					'５０２５２３２２５３６８５', None, 42, {'value': '5025232253685'}):
+			self.assertIsNone(gtin.normalize(code), code)
+
+	def testUnroll(self):
+		'''
+		the EAN_UPCS structures of the index become lists of GTINs
+		'''
+		for ean_upcs, expected in [
+			({'ean_upc': {'value': '5025232253685'}}, ['5025232253685']),
+			({'ean_upc': [{'value': '036000291452'}, {'value': 'bad'}, {'value': '0036000291452'}]}, ['0036000291452']),
+			('5025232253685', ['5025232253685']),
+			(['5025232253685', '96385074'], ['5025232253685', '0000096385074']),
+			(None, []),
+		]:
+			product = {'product_id': '1', 'ean_upcs': ean_upcs}
+			index_parser.unroll_ean_upcs(product)
+			self.assertEqual(product['ean_upcs'], expected)
+
+		# invalid codes are kept as they are, and counted
+		product = {'product_id': '1', 'ean_upcs': {'ean_upc': [{'value': '5025232253686'}, {'value': '036000291452'},
+																{'value': 'bad'}]}}
+		self.assertEqual(index_parser.unroll_ean_upcs(product), 2)
+		self.assertEqual(product['ean_upcs'], ['0036000291452'])
+		self.assertEqual(product['ean_upcs_invalid'], ['5025232253686', 'bad'])
+		product = {'product_id': '1', 'ean_upcs': '5025232253685'}
+		self.assertEqual(index_parser.unroll_ean_upcs(product), 0)
+		self.assertNotIn('ean_upcs_invalid', product)
+
+		categories = IceCat.IceCatCategoryMapping(log=self.log, xml_file="_test_data/CategoriesList.test.xml",
+													data_dir=self.data_dir)
+		suppliers = IceCat.IceCatSupplierMapping(log=self.log, xml_file="_test_data/supplier_mapping.xml",
+													data_dir=self.data_dir)
+		catalog = IceCat.IceCatCatalog(log=self.log, xml_file='_test_data/daily.index.test.xml',
+										suppliers=suppliers, categories=categories, data_dir=self.data_dir)
+		self.assertEqual([item.get('ean_upcs') for item in catalog.get_data()],
+						[None, ['5025232253685'], None, ['8710895816069'], ['4010869002943'], ['3598042100101']])
+
+		self.assertEqual(catalog.invalid_ean_upcs, 0)
+
+		tmp = tempfile.mkdtemp() + '/'
+		with open('_test_data/daily.index.test.xml', 'rb') as f:
+			index = f.read().replace(b'<EAN_UPC Value="5025232253685" />', b'<EAN_UPC Value="5025232253686" />')
+		with open(tmp + 'invalid.index.xml', 'wb') as f:
+			f.write(index)
+		for workers in (1, 2):
+			invalid = IceCat.IceCatCatalog(log=self.log, xml_file=tmp + 'invalid.index.xml', parse_workers=workers,
+											suppliers=suppliers, categories=categories, data_dir=tmp)
+			self.assertEqual(invalid.invalid_ean_upcs, 1)
+			self.assertEqual([item.get('ean_upcs_invalid') for item in invalid.get_data()][:2],
+							[None, ['5025232253686']])
+
+		self.assertEqual(catalog.write_gtin_index(tmp + 'gtin.idx'), 4)
+		with gtin.GtinIndex(tmp + 'gtin.idx') as index:
+			self.assertEqual(index.lookup('5025232253685'), ['108912'])
+			self.assertEqual(index.lookup('0000000000000'), [])
+
+	def testIndex(self):
+		'''
+		sorted runs merged into one index, lookups by any form of the barcode
+		'''
+		products = [{'product_id': str(1000 + i), 'ean_upcs': ['400' + str(i).zfill(9)]} for i in range(500)]
+		for item in products:
+			code = item['ean_upcs'][0]
+			item['ean_upcs'] = [code + str(gtin.check_digit(code))]
+		products.append({'product_id': '7', 'ean_upcs': ['036000291452', '96385074']})
+		products.append({'product_id': '8', 'ean_upcs': ['0036000291452']})
+		products.append({'product_id': '7', 'ean_upcs': ['036000291452']})
+		products.append({'product_id': 'x1', 'ean_upcs': ['5025232253685']})
+		products.append({'product_id': '9'})
+
+		tmp = tempfile.mkdtemp() + '/'
+		self.assertEqual(gtin.build_index(products, tmp + 'gtin.idx', chunk=64), 503)
+		self.assertEqual([name for name in os.listdir(tmp)], ['gtin.idx'])
+		self.assertEqual(os.path.getsize(tmp + 'gtin.idx'), gtin.HEADER.size + 503 * gtin.RECORD.size)
+		with gtin.GtinIndex(tmp + 'gtin.idx') as index:
+			self.assertEqual(len(index), 503)
+			codes = [code for code, product_id in index]
+			self.assertEqual(codes, sorted(codes))
+			self.assertEqual(index.lookup('036000291452'), ['7', '8'])
+			self.assertEqual(index.lookup('0 0036000 291452'), ['7', '8'])
+			self.assertEqual(index.lookup('96385074'), ['7'])
+			self.assertEqual(index.lookup(products[123]['ean_upcs'][0]), ['1123'])
+			self.assertIn(products[0]['ean_upcs'][0], index)
+			self.assertNotIn('5025232253685', index)
+			self.assertEqual(index.lookup('not a code'), [])
+
+		self.assertEqual(gtin.build_index([], tmp + 'empty.idx'), 0)
+		with gtin.GtinIndex(tmp + 'empty.idx') as index:
+			self.assertEqual(index.lookup('036000291452'), [])
+
+		with open(tmp + 'other.idx', 'wb') as f:
+			f.write(b'\0' * 64)
+		self.assertRaises(ValueError, gtin.GtinIndex, tmp + 'other.idx')
+
+
+if __name__ == '__main__':
+	unittest.main()
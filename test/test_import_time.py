@@ -0,0 +1,82 @@
+import logging
+import os
+import subprocess
+import sys
+import unittest
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# loaded on first use only, see IceCat._lazy
+HEAVY = ['requests', 'urllib3', 'lxml', 'progressbar', 'sqlite3', 'multiprocessing']
+
+# package subsystems loaded on first use
+SUBSYSTEMS = ['IceCat.transport', 'IceCat.bulk_downloader', 'IceCat.index_parser', 'IceCat.compact',
+			  'IceCat.spill', 'IceCat.export']
+
+CHECK = '''
+import sys
+from IceCat import IceCat
+IceCat.IceCatCategoryMapping(xml_file='_test_data/CategoriesList.test.xml', data_dir='_test_data/')
+loaded = [m for m in {modules!r} if m in sys.modules]
+print(' '.join(loaded) or '-')
+'''
+
+THREADS = '''
+import threading
+from IceCat import IceCat
+errors = []
+barrier = threading.Barrier(8)
+def first_use():
+	barrier.wait()
+	try:
+		IceCat.xml_backend.parse, IceCat.http_transport.get_transport, IceCat.bulk_downloader.fetchURLs
+	except Exception as e:
+		errors.append(repr(e))
+threads = [threading.Thread(target=first_use) for i in range(8)]
+for t in threads:
+	t.start()
+for t in threads:
+	t.join()
+print(len(errors))
+'''
+
+
+class ModTest(unittest.TestCase):
+
+	logging.basicConfig(filename='test.log',level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+	log = logging.getLogger()
+
+	def run_python(self, code):
+		return subprocess.check_output([sys.executable, '-c', code], cwd=ROOT).decode().split()
+
+	def testLightweightImport(self):
+		'''
+		loading a local category mapping does not import the download, parse and store dependencies
+		'''
+		self.assertEqual(self.run_python(CHECK.format(modules=HEAVY)), ['-'])
+
+	def testLazySubsystems(self):
+		'''
+		the download, parse and store modules of the package are not imported by a category mapping either
+		'''
+		self.assertEqual(self.run_python(CHECK.format(modules=SUBSYSTEMS)), ['-'])
+
+	def testLazySubmodule(self):
+		'''
+		a lazy submodule, e.g. lxml.etree, does not import its package before first use
+		'''
+		code = ('import sys; from IceCat._lazy import lazy_import; text = lazy_import("email.mime.text"); '
+				'print("email" in sys.modules, text.MIMEText.__name__, "email" in sys.modules)')
+		self.assertEqual(self.run_python(code), ['False', 'MIMEText', 'True'])
+
+	def testConcurrentFirstUse(self):
+		'''
+		threads using lazy modules for the first time at once all see the loaded modules
+		'''
+		for i in range(5):
+			self.assertEqual(self.run_python(THREADS), ['0'])
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,52 @@
+from IceCat import IceCat
+from IceCat import index_parser
+import logging
+import unittest
+
+
+class ModTest(unittest.TestCase):
+
+	data_dir = '_test_data/'
+	index_file = '_test_data/daily.index.test.xml'
+
+	logging.basicConfig(filename='test.log',level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+	log = logging.getLogger()
+
+	def testSplit(self):
+		'''
+		byte ranges start at <file elements and cover the whole index
+		'''
+		ranges = index_parser.split_index(self.index_file, chunk_size=500)
+		self.assertGreater(len(ranges), 1)
+		with open(self.index_file, 'rb') as f:
+			data = f.read()
+		for start, end in ranges:
+			self.assertTrue(data[start:].startswith(b'<file '))
+		for (start, end), (next_start, next_end) in zip(ranges, ranges[1:]):
+			self.assertEqual(end, next_start)
+		self.assertTrue(data[ranges[-1][1]:].startswith(b'</files.index>'))
+		self.assertEqual(sum(data[start:end].count(b'<file ') for start, end in ranges), 6)
+
+	def testParallelCatalog(self):
+		'''
+		parallel parse gives the same products as the single process parser
+		'''
+		categories = IceCat.IceCatCategoryMapping(log=self.log, xml_file="_test_data/CategoriesList.test.xml",
+													data_dir=self.data_dir)
+		suppliers = IceCat.IceCatSupplierMapping(log=self.log, xml_file="_test_data/supplier_mapping.xml",
+													data_dir=self.data_dir)
+		serial = IceCat.IceCatCatalog(log=self.log, xml_file=self.index_file,
+										suppliers=suppliers, categories=categories, data_dir=self.data_dir)
+		parallel = IceCat.IceCatCatalog(log=self.log, xml_file=self.index_file, parse_workers=2,
+										suppliers=suppliers, categories=categories, data_dir=self.data_dir)
+		self.assertEqual(parallel.get_data(), serial.get_data())
+
+		batches = list(index_parser.parse_index_parallel(self.index_file, workers=2, chunk_size=500))
+		self.assertGreater(len(batches), 1)
+		self.assertEqual([p['product_id'] for batch in batches for p in batch],
+						['3827', '108912', '110722', '126442', '140202', '140206'])
+		self.assertNotIn('country_markets', batches[0][0])
+
+
+if __name__ == '__main__':
+	unittest.main()
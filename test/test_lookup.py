@@ -0,0 +1,85 @@
+from IceCat import IceCat
+from IceCat.lookup import ProductLookup
+from mock_icecat import mock_server
+import logging
+import os
+import tempfile
+import threading
+import unittest
+
+
+class ModTest(unittest.TestCase):
+
+	logging.basicConfig(filename='test.log',level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+	log = logging.getLogger()
+
+	keys = ['ProductDescription[@ShortDesc]', 'ShortSummaryDescription']
+
+	def setUp(self):
+		self.server, base = mock_server()
+		self.baseurl = IceCat.IceCatProductDetails.baseurl
+		IceCat.IceCatProductDetails.baseurl = base
+		self.data_dir = tempfile.mkdtemp() + '/'
+
+	def tearDown(self):
+		IceCat.IceCatProductDetails.baseurl = self.baseurl
+		self.server.shutdown()
+
+	def testMemoryAndDiskCache(self):
+		'''
+		a product is downloaded once, then served from memory, and from disk by a new lookup
+		'''
+		lookup = ProductLookup(keys=self.keys, data_dir=self.data_dir, log=self.log)
+		details = lookup.get('3827')
+		self.assertEqual(details['shortdesc'], 'Xeon 3827')
+		self.assertEqual(lookup.get(3827), details)
+		self.assertEqual(lookup.hits, 1)
+		# results are copies, a caller changing one does not change the cache
+		details['shortdesc'] = 'changed'
+		self.assertEqual(lookup.get('3827')['shortdesc'], 'Xeon 3827')
+
+		other = ProductLookup(keys=self.keys, data_dir=self.data_dir, log=self.log)
+		self.assertEqual(other.get('3827'), lookup.get('3827'))
+		# different key set is a different cache entry
+		self.assertEqual(other.get('3827', keys=['ShortSummaryDescription']), {'shortsummarydescription': 'Short summary 3827'})
+		self.assertEqual(len(self.server.requests), 2)
+
+		other.invalidate('3827')
+		self.assertEqual(os.listdir(self.data_dir), [])
+		other.get('3827')
+		self.assertEqual(len(self.server.requests), 3)
+
+	def testLruAndTtl(self):
+		'''
+		least recently used entries are evicted, stale entries are fetched again
+		'''
+		lookup = ProductLookup(keys=self.keys, data_dir=None, max_items=2, log=self.log)
+		for product_id in ('1', '2', '1', '3', '1'):
+			lookup.get(product_id)
+		self.assertEqual(self.server.requests, ['/export/freexml.int/EN/1.xml', '/export/freexml.int/EN/2.xml',
+												'/export/freexml.int/EN/3.xml'])
+		lookup.ttl = -1
+		lookup.get('1')
+		self.assertEqual(len(self.server.requests), 4)
+
+	def testCoalescing(self):
+		'''
+		concurrent lookups of the same product share one download
+		'''
+		self.server.slow.add('42')
+		self.server.delay = 1
+		lookup = ProductLookup(keys=self.keys, data_dir=self.data_dir, log=self.log)
+		results = []
+		threads = [threading.Thread(target=lambda: results.append(lookup.get('42'))) for i in range(5)]
+		for t in threads:
+			t.start()
+		for t in threads:
+			t.join()
+		self.assertEqual(len(self.server.requests), 1)
+		self.assertEqual([r['shortdesc'] for r in results], ['Xeon 42'] * 5)
+		self.server.missing.add('43')
+		self.assertIsNone(lookup.get('43'))
+
+
+if __name__ == '__main__':
+	unittest.main()
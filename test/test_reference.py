@@ -0,0 +1,66 @@
+from IceCat import IceCat
+from IceCat import reference
+from mock_icecat import mock_server
+import logging
+import os
+import tempfile
+import threading
+import unittest
+
+
+class ModTest(unittest.TestCase):
+
+	logging.basicConfig(filename='test.log',level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+	log = logging.getLogger()
+
+	def setUp(self):
+		self.server, base = mock_server()
+		with open('_test_data/CategoriesList.test.xml', 'rb') as f:
+			self.server.files['/CategoriesList.xml'] = f.read()
+		self.server.file_delay = 0.5
+		self.saved = IceCat.IceCatCategoryMapping.baseurl, IceCat.IceCatCategoryMapping.FILENAME
+		IceCat.IceCatCategoryMapping.baseurl = base
+		IceCat.IceCatCategoryMapping.FILENAME = 'CategoriesList.xml'
+		self.data_dir = tempfile.mkdtemp() + '/'
+		reference.clear()
+
+	def tearDown(self):
+		IceCat.IceCatCategoryMapping.baseurl, IceCat.IceCatCategoryMapping.FILENAME = self.saved
+		self.server.shutdown()
+		reference.clear()
+
+	def testSingleFlight(self):
+		'''
+		concurrent requests for the same mapping share one download and one object
+		'''
+		results = []
+		def load():
+			results.append(reference.get_reference(IceCat.IceCatCategoryMapping, data_dir=self.data_dir, log=self.log))
+		threads = [threading.Thread(target=load) for i in range(8)]
+		for t in threads:
+			t.start()
+		for t in threads:
+			t.join()
+		self.assertEqual(len(self.server.requests), 1)
+		self.assertEqual(len(set(id(r) for r in results)), 1)
+		self.assertEqual(results[0].get_cat_byId("1648"), 'popcorn poppers')
+
+	def testReuseDownloadedFile(self):
+		'''
+		a fresh file downloaded by another process is parsed, not downloaded again
+		'''
+		first = reference.get_reference(IceCat.IceCatCategoryMapping, data_dir=self.data_dir, log=self.log)
+		reference.clear()
+		second = reference.get_reference(IceCat.IceCatCategoryMapping, data_dir=self.data_dir, log=self.log)
+		self.assertIsNot(first, second)
+		self.assertEqual(second.id_map, first.id_map)
+		self.assertEqual(len(self.server.requests), 1)
+
+		# stale file is refreshed
+		reference.get_reference(IceCat.IceCatCategoryMapping, data_dir=self.data_dir, log=self.log, max_age=-1)
+		self.assertEqual(len(self.server.requests), 2)
+		self.assertFalse(os.path.isfile(self.data_dir + 'CategoriesList.xml.part'))
+
+
+if __name__ == '__main__':
+	unittest.main()
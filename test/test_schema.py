@@ -0,0 +1,91 @@
+from IceCat import IceCat
+from IceCat import details
+from IceCat import schema
+from mock_icecat import mock_server
+import datetime
+import json
+import logging
+import tempfile
+import unittest
+
+
+class ModTest(unittest.TestCase):
+
+	data_dir = '_test_data/'
+
+	logging.basicConfig(filename='test.log',level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+	log = logging.getLogger()
+
+	def catalog(self, data_dir=None):
+		categories = IceCat.IceCatCategoryMapping(log=self.log, xml_file="_test_data/CategoriesList.test.xml",
+													data_dir=self.data_dir)
+		suppliers = IceCat.IceCatSupplierMapping(log=self.log, xml_file="_test_data/supplier_mapping.xml",
+													data_dir=self.data_dir)
+		return IceCat.IceCatCatalog(log=self.log, xml_file="_test_data/daily.index.test.xml",
+									suppliers=suppliers, categories=categories, data_dir=data_dir or self.data_dir)
+
+	def testIndexRecords(self):
+		'''
+		index fields parsed once, lists always lists, unknown keys kept
+		'''
+		records = list(self.catalog().get_records())
+		first, second = records[0], records[1]
+		self.assertEqual((first.product_id, first.catid, first.supplier_id), (3827, 911, 7))
+		self.assertEqual(first.updated, datetime.datetime(2016, 2, 8, 13, 32, 38))
+		self.assertEqual(first.date_added, datetime.datetime(2005, 7, 15))
+		self.assertIs(first.on_market, True)
+		self.assertEqual(first.m_prod_id, ['9142R29002'])
+		self.assertEqual(second.m_prod_id, ['PAN_UG3350', 'UG3350'])
+		self.assertEqual(first.ean_upcs, [])
+		self.assertEqual(second['ean_upcs'], ['5025232253685'])
+		self.assertEqual(first.get('supplier'), 'Acer')
+		self.assertFalse(hasattr(first, '__dict__'))
+
+		product_schema = schema.ProductSchema()
+		record = product_schema.from_dict({'product_id': '1', 'releasedate': '2016-02-08', 'on_market': '2',
+											'color': 'red'})
+		self.assertEqual(record.release_date, datetime.date(2016, 2, 8))
+		self.assertIsNone(record.on_market)
+		self.assertEqual(record.extra, {'on_market': '2', 'color': 'red'})
+		self.assertRaises(ValueError, product_schema.from_dict, {'product_id': 'x1'}, strict=True)
+
+		properties = product_schema.json_schema()['properties']
+		for field in IceCat.IceCatCatalog._namespaces.values():
+			self.assertIn(field, properties)
+		self.assertEqual(properties['updated'], {'type': ['string', 'null'], 'format': 'date-time'})
+		self.assertEqual(properties['product_id'], {'type': ['integer', 'null']})
+
+	def testSerialize(self):
+		'''
+		records with detail keys and sections survive a dumps / loads round trip
+		'''
+		server, base = mock_server()
+		baseurl = IceCat.IceCatProductDetails.baseurl
+		IceCat.IceCatProductDetails.baseurl = base
+		try:
+			catalog = self.catalog(tempfile.mkdtemp() + '/')
+			catalog._categories = {'911': '', '375': '', '989': ''}
+			catalog.add_product_details_parallel(keys=['ProductDescription[@ShortDesc]', 'ShortSummaryDescription',
+														'features'], connections=2)
+		finally:
+			IceCat.IceCatProductDetails.baseurl = baseurl
+			server.shutdown()
+
+		product_schema = schema.ProductSchema(keys=catalog.keys)
+		records = list(catalog.get_records(product_schema))
+		self.assertEqual(records[0].shortdesc, 'Xeon 3827')
+		self.assertEqual(records[0].shortsummarydescription, 'Short summary 3827')
+		self.assertEqual(records[0].features, [])
+		for record in records:
+			data = product_schema.dumps(record)
+			self.assertEqual(json.loads(data)['product_id'], record.product_id)
+			self.assertEqual(product_schema.loads(data), record)
+		self.assertEqual(json.loads(product_schema.dumps(records[0]))['updated'], '2016-02-08T13:32:38')
+
+		Feature = details.SECTIONS[0].record
+		record = product_schema.from_dict({'product_id': '1', 'features': [Feature(id=7, name='Memory')]})
+		self.assertEqual(product_schema.loads(product_schema.dumps(record)).features, [Feature(id=7, name='Memory')])
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,104 @@
+from IceCat import IceCat
+from IceCat import bulk_downloader
+from IceCat import cli
+from IceCat import manifest
+from IceCat import shard
+from mock_icecat import mock_server
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+import unittest
+
+
+def _sync(args):
+	# one shard node, a separate process
+	return cli.main(args)
+
+
+class ModTest(unittest.TestCase):
+
+	logging.basicConfig(filename='test.log',level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+	log = logging.getLogger()
+
+	def setUp(self):
+		self.server, self.base = mock_server()
+		self.baseurl = IceCat.IceCatProductDetails.baseurl
+		IceCat.IceCatProductDetails.baseurl = self.base
+		self.tmp = tempfile.mkdtemp() + '/'
+
+	def tearDown(self):
+		IceCat.IceCatProductDetails.baseurl = self.baseurl
+		self.server.shutdown()
+
+	def args(self, *args):
+		return ['sync', 'daily', '--user', 'icat_user', '--password', 'icat_passwd',
+				'--data-dir', self.tmp + 'data', '--log-file', 'test.log',
+				'--index-file', '_test_data/daily.index.test.xml',
+				'--categories-file', '_test_data/CategoriesList.test.xml',
+				'--suppliers-file', '_test_data/supplier_mapping.xml',
+				'--category', '911', '--category', '375', '--category', '989',
+				'--key', 'ProductDescription[@ShortDesc]'] + list(args)
+
+	def testAssignment(self):
+		'''
+		shards are stable and cover every product once
+		'''
+		ids = [str(i) for i in range(1000)]
+		self.assertEqual([shard.shard_of(i, 4) for i in ids[:6]], [1, 3, 1, 3, 0, 2])
+		for n in (1, 3, 4):
+			owners = [[k for k in range(n) if shard.in_shard(i, (k, n))] for i in ids]
+			self.assertTrue(all(len(owner) == 1 for owner in owners))
+		self.assertTrue(shard.in_shard('3827', None))
+		self.assertEqual(shard.parse('1/4'), (1, 4))
+		for spec in ('4/4', '-1/4', '1', 'a/b'):
+			self.assertRaises(ValueError, shard.parse, spec)
+		self.assertEqual(shard.suffix((1, 4)), '.1-of-4')
+
+	def testFetchShard(self):
+		'''
+		fetchURLs downloads the urls of its shard only
+		'''
+		urls = [self.base + 'export/{}.xml'.format(i) for i in range(20)]
+		meta = {url: {'product_id': str(i)} for i, url in enumerate(urls)}
+		fetched = []
+		for k in range(3):
+			download = bulk_downloader.fetchURLs(log=self.log, urls=urls, data_dir=self.tmp, connections=2,
+													meta=meta, shard=(k, 3))
+			fetched.extend(download.done)
+		self.assertEqual(sorted(fetched), sorted(urls))
+		self.assertEqual(len(self.server.requests), 20)
+
+	def testShardedSync(self):
+		'''
+		shard runs in separate processes, merged, give the output of a single run
+		'''
+		self.assertEqual(_sync(self.args('--output', self.tmp + 'single.json', '--data-dir', self.tmp + 'single')), 0)
+		with open(self.tmp + 'single.json') as f:
+			single = json.load(f)
+		requests = len(self.server.requests)
+
+		outputs = [self.tmp + 'daily.{}.ndjson'.format(k) for k in range(3)]
+		jobs = [self.args('--shard', '{}/3'.format(k), '--output', outputs[k], '--connections', '2')
+				for k in range(3)]
+		with multiprocessing.get_context('fork').Pool(3) as pool:
+			self.assertEqual(pool.map(_sync, jobs), [0, 0, 0])
+		# every product fetched once, by the node of its shard
+		self.assertEqual(len(self.server.requests) - requests, len(single))
+
+		manifests = [self.tmp + 'data/product_xml/manifest.{}-of-3.ndjson'.format(k) for k in range(3)]
+		self.assertEqual(cli.main(['merge', '--output', self.tmp + 'merged.json', '--log-file', 'test.log']
+									+ outputs + sum([['--manifest', m] for m in manifests if os.path.isfile(m)], [])), 0)
+		with open(self.tmp + 'merged.json') as f:
+			merged = json.load(f)
+		key = lambda item: item['product_id']
+		self.assertEqual(sorted(merged, key=key), sorted(single, key=key))
+
+		merged_manifest = manifest.Manifest(self.tmp + 'data/product_xml/manifest.ndjson')
+		self.assertEqual(sorted(entry['product_id'] for entry in merged_manifest.entries.values()),
+						sorted(item['product_id'] for item in single))
+
+
+if __name__ == '__main__':
+	unittest.main()
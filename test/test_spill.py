@@ -0,0 +1,72 @@
+from IceCat.spill import SpillCatalog, SpilledRow
+import logging
+import os
+import tempfile
+import unittest
+
+
+class ModTest(unittest.TestCase):
+
+	logging.basicConfig(filename='test.log',level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+	log = logging.getLogger()
+
+	def products(self, n):
+		return [{'product_id': str(i), 'catid': str(i % 3), 'path': 'export/freexml.int/EN/{}.xml'.format(i)}
+				for i in range(n)]
+
+	def testSpill(self):
+		'''
+		products past the memory limit go to disk, positions and order are kept
+		'''
+		spill_dir = tempfile.mkdtemp()
+		store = SpillCatalog(memory_limit=4000, spill_dir=spill_dir, batch=7)
+		store.extend(self.products(100))
+		self.assertEqual(len(store), 100)
+		self.assertGreater(store.spilled, 50)
+		self.assertLess(len(store._memory), 20)
+		self.assertEqual(len(os.listdir(spill_dir)), 1)
+		self.assertEqual([item['product_id'] for item in store], [str(i) for i in range(100)])
+		self.assertEqual(store[3]['product_id'], '3')
+		self.assertIsInstance(store[3], SpilledRow)
+		self.assertEqual(store[-1]['product_id'], '99')
+		self.assertEqual(store.to_list(), self.products(100))
+
+		store.close()
+		self.assertEqual(os.listdir(spill_dir), [])
+
+	def testUpdates(self):
+		'''
+		changes to spilled products are written back
+		'''
+		store = SpillCatalog(memory_limit=2000)
+		store.extend(self.products(50))
+		for item in store:
+			item.update({'shortdesc': 'Xeon ' + item['product_id']})
+		store[1]['model_name'] = 'X1'
+		del store[2]['path']
+		store[4] = {'product_id': '4', 'replaced': '1'}
+		self.assertEqual(store[0]['shortdesc'], 'Xeon 0')
+		self.assertEqual(store[49]['shortdesc'], 'Xeon 49')
+		self.assertEqual(store[1]['model_name'], 'X1')
+		self.assertNotIn('path', store[2])
+		self.assertEqual(dict(store[4]), {'product_id': '4', 'replaced': '1'})
+
+	def testJoinFilter(self):
+		'''
+		join resolves names across memory and disk, filter keeps the spill behaviour
+		'''
+		store = SpillCatalog(memory_limit=2000)
+		store.extend(self.products(60))
+		missing = store.join('catid', 'category', {'0': 'Notebooks', '1': 'Servers'})
+		self.assertEqual(missing, {'2': 20})
+		self.assertEqual(store[0]['category'], 'Notebooks')
+		self.assertEqual(store[57]['category'], 'Notebooks')
+		self.assertNotIn('category', store[2])
+
+		servers = store.filter(lambda item: item.get('category') == 'Servers')
+		self.assertIsInstance(servers, SpillCatalog)
+		self.assertEqual([item['product_id'] for item in servers], [str(i) for i in range(1, 60, 3)])
+
+
+if __name__ == '__main__':
+	unittest.main()
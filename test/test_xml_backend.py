@@ -0,0 +1,81 @@
+from IceCat import IceCat
+from IceCat import details
+from IceCat import xml_backend
+from mock_icecat import PRODUCT_XML
+import io
+import logging
+import unittest
+
+try:
+	import xmltodict
+except ImportError:
+	xmltodict = None
+
+
+class ModTest(unittest.TestCase):
+
+	data_dir = '_test_data/'
+	index_file = '_test_data/daily.index.test.xml'
+
+	logging.basicConfig(filename='test.log',level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+	log = logging.getLogger()
+
+	def tearDown(self):
+		xml_backend.use()
+
+	@staticmethod
+	def _lower(path, key, value):
+		if key == 'Country_Markets':
+			return None
+		return key.lower(), value
+
+	@unittest.skipUnless(xmltodict, 'xmltodict is not installed')
+	def testRecordsMatchXmltodict(self):
+		'''
+		every backend builds the same product dicts as xmltodict did
+		'''
+		with open(self.index_file, 'rb') as f:
+			expected = xmltodict.parse(f, attr_prefix='', postprocessor=self._lower)
+		expected = expected['icecat-interface']['files.index']['file']
+		for name in xml_backend.available():
+			xml_backend.use(name)
+			self.assertEqual(list(xml_backend.parse_records(self.index_file, 'file', self._lower)), expected, name)
+			with open(self.index_file, 'rb') as f:
+				self.assertEqual(list(xml_backend.parse_records(f.read(), 'file', self._lower)), expected, name)
+
+	def testNestedText(self):
+		'''
+		mixed content, repeated keys and empty elements
+		'''
+		data = b'<r><a x="1"> one <b>2</b> two </a><a/><a>3</a><c><a>inner</a></c></r>'
+		for name in xml_backend.available():
+			xml_backend.use(name)
+			self.assertEqual(list(xml_backend.parse_records(data, 'a')),
+							[{'x': '1', 'b': '2', '#text': 'one  two'}, None, '3', 'inner'], name)
+
+	def testBackendsAgree(self):
+		'''
+		catalog and product details are the same with every backend
+		'''
+		results = []
+		for name in xml_backend.available():
+			xml_backend.use(name)
+			categories = IceCat.IceCatCategoryMapping(log=self.log, xml_file="_test_data/CategoriesList.test.xml",
+														data_dir=self.data_dir)
+			suppliers = IceCat.IceCatSupplierMapping(log=self.log, xml_file="_test_data/supplier_mapping.xml",
+														data_dir=self.data_dir)
+			catalog = IceCat.IceCatCatalog(log=self.log, xml_file=self.index_file,
+											suppliers=suppliers, categories=categories, data_dir=self.data_dir)
+			extracted = details.DetailExtractor(['ProductDescription[@ShortDesc]', 'features']).extract(
+				io.BytesIO(PRODUCT_XML.format(id=3827).encode()))
+			results.append((categories.id_map, categories.parents, suppliers.id_map, catalog.get_data(), extracted))
+		self.assertEqual(len(results[0][3]), 6)
+		for result in results[1:]:
+			self.assertEqual(result, results[0])
+
+	def testUnknownBackend(self):
+		self.assertRaises(ValueError, xml_backend.use, 'sax')
+
+
+if __name__ == '__main__':
+	unittest.main()